@@ -0,0 +1,208 @@
+
+# batch.py - bulk practice file generation
+
+
+import contextlib
+import itertools
+import multiprocessing
+import os
+import random
+import re
+import time
+
+import cwwords
+import keyer
+
+
+# A batch matrix file lists cwwords options, one per line in the same
+# 'key = value' syntax as the configuration files, except that each
+# option may have a comma separated list of values. A practice file is
+# generated for every combination of the values. The 'config' key
+# gives configuration files to start each session from. e.g.
+#
+#   config     = words.cfg, callsigns.cfg
+#   wpm        = 20, 25
+#   koch-chars = 20, 30, 40
+#
+# generates 12 practice files. Options that are flags take the values
+# 'true' or 'false'.
+#
+# The word and callsign corpora are loaded once in the parent process
+# and the sessions are generated by a pool of worker processes that
+# share them copy-on-write. Each session is written to its own file,
+# the answer key of a pileup session to a file next to it. With
+# spaced repetition each worker opens the review database itself, an
+# sqlite connection can't be shared across a fork.
+
+
+def readMatrix(matrixFile):
+    matrix = {}
+
+    with open(matrixFile, 'r') as fileobj:
+        for line in fileobj:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            try:
+                key, values = line.split('=', 1)
+            except ValueError:
+                print(f"ERROR: invalid line in batch file {matrixFile}: {line}")
+                raise SystemExit(1)
+            matrix[key.strip()] = [v.strip() for v in values.split(',') if v.strip()]
+
+    return matrix
+
+
+# Return the list of parameter sets, the cartesian product of the
+# values of each key in the matrix
+def expandMatrix(matrix):
+    keys = list(matrix.keys())
+    return [dict(zip(keys, values))
+            for values in itertools.product(*(matrix[k] for k in keys))]
+
+
+def sessionArgv(params):
+    argv = []
+    for key, value in params.items():
+        if key == 'config':
+            argv += ['-f', value]
+        elif value.lower() == 'true':
+            argv.append(f"--{key}")
+        elif value.lower() == 'false':
+            pass
+        else:
+            argv += [f"--{key}", value]
+
+    return argv
+
+
+def sessionFilename(params, num, outDir, fmt):
+    parts = []
+    for key, value in params.items():
+        if key == 'config':
+            value = os.path.splitext(os.path.basename(value))[0]
+            parts.append(value)
+        else:
+            parts.append(f"{key}{value}")
+    name = re.sub('[^A-Za-z0-9_.-]+', '_', '-'.join(parts))
+
+    return os.path.join(outDir, f"{name}-{num:04d}.{fmt}")
+
+
+# Start a pool worker, with spaced repetition ('useSRS') with its own
+# connection to the review database 'srsFile'
+def initWorker(useSRS, srsFile):
+    import srs
+
+    # the workers are forked with the same random state
+    random.seed()
+    if useSRS:
+        cwwords.REVIEW_DB = srs.openReviewDatabase(srsFile)
+
+
+# Return the answer key file of a pileup session, next to its sound
+# file
+def answerKeyFilename(outFile, fmt):
+    return f"{os.path.splitext(outFile)[0]}.key.{'txt' if fmt == 'text' else fmt}"
+
+
+# Generate one session into its own sound file. Run in a worker
+# process, the output of the session is discarded.
+def runSession(session):
+    outFile = session['outFile']
+
+    result = {'outFile': outFile, 'seconds': 0, 'error': None}
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            progArgs = session['progArgs']
+            charList = cwwords.getCharList(progArgs)
+            if progArgs['qsos']:
+                wordLst = cwwords.selectQSOs(progArgs, charList)
+            elif progArgs['callsigns']:
+                wordLst = cwwords.selectCallsigns(progArgs, charList)
+            else:
+                wordLst = cwwords.selectWords(progArgs, charList)
+
+            if not wordLst:
+                result['error'] = 'no words, callsigns or QSOs for these parameters'
+            elif progArgs['callsigns'] and progArgs['pileup']:
+                cwwords.executePileup(progArgs, wordLst)
+            elif progArgs['ninjaMode']:
+                cwwords.executeNinjaMode(progArgs, wordLst)
+            else:
+                cwwords.generateCWSoundFile(progArgs, ['vvvv'] + wordLst)
+    except SystemExit:
+        result['error'] = 'session exited'
+    except Exception as e:
+        result['error'] = str(e)
+
+    if result['error'] is None:
+        result['seconds'] = soundFileSeconds(outFile)
+
+    return result
+
+
+def soundFileSeconds(filename):
+    if filename.endswith('.wav'):
+        import wave
+        with wave.open(filename, 'rb') as fileobj:
+            return fileobj.getnframes() / fileobj.getframerate()
+    else:
+        return len(keyer.readSoundFile(filename)) / keyer.SAMPLE_RATE
+
+
+def getPool(jobs, useSRS=False, srsFile=None):
+    # fork shares the loaded corpora with the workers, other start
+    # methods (Windows) still work but each worker loads its own
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    return context.Pool(jobs, initializer=initWorker, initargs=(useSRS, srsFile))
+
+
+def runBatch(matrixFile, outDir, jobs=None, fmt='wav'):
+    startTime = time.monotonic()
+
+    os.makedirs(outDir, exist_ok=True)
+    paramLst = expandMatrix(readMatrix(matrixFile))
+
+    sessions = []
+    for num, params in enumerate(paramLst):
+        outFile = sessionFilename(params, num, outDir, fmt)
+        argv = sessionArgv(params) + ['--sound-file', outFile, '--cw-engine', 'keyer']
+        progArgs = cwwords.processArguments(cwwords.parseArguments(argv))
+        # the sessions are only written to their files
+        progArgs['play'] = False
+        if progArgs['callsigns'] and progArgs['pileup'] and not progArgs['outputFile']:
+            progArgs['outputFile'] = answerKeyFilename(outFile, progArgs['outputFormat'])
+        cwwords.preloadCorpus(progArgs)
+        sessions.append({'outFile': outFile, 'progArgs': progArgs})
+
+    srsFiles = {s['progArgs']['srsFile'] for s in sessions if s['progArgs']['srs']}
+    if len(srsFiles) > 1:
+        print("ERROR: the sessions of a batch must use the same '--srs-db', exiting...")
+        raise SystemExit(1)
+
+    loadTime = time.monotonic() - startTime
+    print(f"Generating {len(sessions)} practice files in: {os.path.abspath(outDir)}")
+
+    results = []
+    with getPool(jobs or os.cpu_count(), bool(srsFiles), next(iter(srsFiles), None)) as pool:
+        for result in pool.imap_unordered(runSession, sessions):
+            if result['error']:
+                print(f"  FAILED: {result['outFile']}: {result['error']}")
+            else:
+                print(f"  {result['outFile']}")
+            results.append(result)
+
+    wallTime = time.monotonic() - startTime
+    audioTime = sum(r['seconds'] for r in results)
+    numOK = sum(1 for r in results if r['error'] is None)
+
+    print("---------------------------------------------------------")
+    print(f"sessions: {numOK} generated, {len(results) - numOK} failed")
+    print(f"corpus load: {loadTime:.2f} sec, total: {wallTime:.2f} sec")
+    print(f"audio: {audioTime / 60:.1f} min, {numOK / wallTime:.2f} sessions/sec, "
+          f"{audioTime / wallTime:.0f}x real time")
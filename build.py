@@ -53,7 +53,7 @@ def parseArguments():
 
     # Optional arguments
     parser.add_argument('--onefile', '-o', action='store_true', dest='onefile',
-                        help='Build application in one, bundled file')
+                        help='Build application in one, bundled file (slower to start)')
 
     args = parser.parse_args()
 
@@ -91,6 +91,12 @@ def buildUnix(args, osType):
     if os.path.exists(args['builddir']):
         removeDir(args['builddir'])
 
+    # A one file bundle is unpacked into a temporary directory every
+    # time it is run, which dominates the start up time of short runs
+    # (e.g. printing a word list). The default one directory bundle
+    # starts without unpacking. The modules that cwwords.py imports
+    # inside functions (e.g. the audio modules) are still found and
+    # bundled by pyinstaller.
     cmd = "pyinstaller"
     if args['onefile']:
         cmd += ' --onefile'
@@ -0,0 +1,189 @@
+
+# callfeatures.py - callsign feature tables for targeted drills
+
+
+import array
+import bisect
+import random
+import re
+
+
+# The callsign index (see cwindex.py) holds a feature table for each
+# callsign table, so drills can be limited to e.g. 2x3 calls from the
+# 6th call district, without reading the raw callsign files. The
+# features of a callsign are:
+#   structure - letters before and after the district digit, e.g. 2x3
+#               for KB6ABC
+#   length    - number of characters
+#   prefix    - the characters before the district digit, e.g. KB
+#   district  - the district digit (US callsigns only)
+#   state     - the licensee's state (US callsigns only)
+#   country   - the DXCC country
+#
+# Callsigns with the same features are grouped in a cell. The table
+# stores the features of each cell once ('<name>.cells', a string
+# table of '|' separated features) and, for each character order, the
+# positions in the ranked table of the callsigns of each cell, in
+# ascending order: '<view>.cellpos', with the callsigns of cell c at
+# [cellstart[c], cellstart[c + 1]) of '<view>.cellstart'. As the
+# ranked table is sorted by rank, the callsigns of a cell that can be
+# sent with the first n characters are a prefix of the cell, found by
+# a bisect with the rank bound. A query is then a lookup of the
+# matching cells and one bisect per cell.
+
+FEATURES = ['structure', 'length', 'prefix', 'district', 'state', 'country']
+
+CALL_PATTERN = re.compile(r'^(.*?)(\d)([A-Z]+)$')
+
+
+# Return the structure, prefix and district digit of a callsign, they
+# are empty for a callsign that doesn't have a district digit
+# followed by letters
+def parseCallsign(callsign):
+    match = CALL_PATTERN.match(callsign.upper())
+    if match is None:
+        return '', '', ''
+
+    prefix, digit, suffix = match.groups()
+
+    return f"{len(prefix)}x{len(suffix)}", prefix, digit
+
+
+def callsignFeatures(callsign, state='', country='', us=False):
+    structure, prefix, digit = parseCallsign(callsign)
+
+    return {'structure': structure, 'length': str(len(callsign)), 'prefix': prefix,
+            'district': digit if us else '', 'state': state, 'country': country}
+
+
+# Add the feature table of the callsign table 'name' to the dict of
+# arrays of an index. 'features' is the list of feature dicts of the
+# callsigns in the order given to cwindex.addRankedStrings(), which
+# must have already added the ranked tables.
+def addFeatureTable(arrays, name, features, orders):
+    cells = {}
+    cellIds = []
+    for feature in features:
+        key = '|'.join(feature[f].replace('|', ' ') for f in FEATURES)
+        cellIds.append(cells.setdefault(key, len(cells)))
+
+    text = bytearray()
+    offsets = array.array('I', [0])
+    for key in cells:
+        text += key.encode('utf-8')
+        text += b'\n'
+        offsets.append(len(text))
+    arrays[f"{name}.cells.text"] = bytes(text)
+    arrays[f"{name}.cells.offsets"] = offsets
+
+    for orderName in orders:
+        view = f"{name}.{orderName}"
+        cellLsts = [[] for i in range(len(cells))]
+        for pos, i in enumerate(arrays[f"{view}.pos"]):
+            cellLsts[cellIds[i]].append(pos)
+
+        cellStart = array.array('I', [0])
+        cellPos = array.array('I')
+        for lst in cellLsts:
+            cellPos.extend(lst)
+            cellStart.append(len(cellPos))
+        arrays[f"{view}.cellstart"] = cellStart
+        arrays[f"{view}.cellpos"] = cellPos
+
+
+class FeatureTable:
+
+    # The feature table of the callsign table 'name' of an open index,
+    # for the character order 'orderName'
+    def __init__(self, index, name, orderName):
+        self.index = index
+        self.view = f"{name}.{orderName}"
+        self.bounds = index.array(f"{self.view}.bounds")
+        self.cellStart = index.array(f"{self.view}.cellstart")
+        self.cellPos = index.array(f"{self.view}.cellpos")
+
+        self.cells = [key.split('|') for key in index.strings(f"{name}.cells")]
+        self._cellsByFeature = {f: {} for f in FEATURES}
+        for cellId, cell in enumerate(self.cells):
+            for feature, value in zip(FEATURES, cell):
+                self._cellsByFeature[feature].setdefault(value, []).append(cellId)
+        self._counts = {}
+
+
+    def _bound(self, numChars):
+        return self.bounds[min(max(numChars, 0), len(self.bounds) - 1)]
+
+
+    # Return the ids of the cells that match the features, or None for
+    # all cells when no features are given
+    def _matchCells(self, features):
+        cellIds = None
+        for feature, value in features.items():
+            if value is None:
+                continue
+            if feature not in self._cellsByFeature:
+                raise ValueError(f"unknown callsign feature: {feature}")
+            matched = self._cellsByFeature[feature].get(str(value), [])
+            cellIds = set(matched) if cellIds is None else cellIds.intersection(matched)
+
+        return cellIds
+
+
+    # Return the matching cells and the cumulative number of their
+    # callsigns that can be sent with the first numChars characters
+    def _cellCounts(self, numChars, features):
+        key = (numChars, tuple(sorted((f, str(v)) for f, v in features.items()
+                                      if v is not None)))
+        if key not in self._counts:
+            cellIds = self._matchCells(features)
+            bound = self._bound(numChars)
+            cellLst = []
+            cumLst = []
+            total = 0
+            for cellId in sorted(cellIds):
+                start = self.cellStart[cellId]
+                end = bisect.bisect_left(self.cellPos, bound, start,
+                                         self.cellStart[cellId + 1])
+                if end > start:
+                    total += end - start
+                    cellLst.append(cellId)
+                    cumLst.append(total)
+            self._counts[key] = (cellLst, cumLst)
+
+        return self._counts[key]
+
+
+    # Return the number of callsigns with the features that can be sent
+    # with the first numChars characters, e.g.
+    #   count(25, structure='2x3', district='6')
+    def count(self, numChars, **features):
+        if self._matchCells(features) is None:
+            return self._bound(numChars)
+
+        cumLst = self._cellCounts(numChars, features)[1]
+
+        return cumLst[-1] if cumLst else 0
+
+
+    # Return up to k different random callsigns with the features that
+    # can be sent with the first numChars characters
+    def sample(self, k, numChars, **features):
+        k = max(k, 0)
+        if self._matchCells(features) is None:
+            bound = self._bound(numChars)
+            positions = random.sample(range(bound), min(k, bound))
+        else:
+            cellLst, cumLst = self._cellCounts(numChars, features)
+            total = cumLst[-1] if cumLst else 0
+            positions = []
+            for n in random.sample(range(total), min(k, total)):
+                i = bisect.bisect_right(cumLst, n)
+                offset = n - (cumLst[i - 1] if i else 0)
+                positions.append(self.cellPos[self.cellStart[cellLst[i]] + offset])
+
+        return [self.index.string(self.view, pos) for pos in positions]
+
+
+    # Return the values of a feature, e.g. the countries
+    def values(self, feature):
+        return sorted(v for v in self._cellsByFeature[feature] if v)
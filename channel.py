@@ -0,0 +1,234 @@
+
+# channel.py - simulation of the radio channel on the keyer's PCM stream
+
+
+import numpy as np
+
+import keyer
+
+
+# The keyer's CW is clean, real signals on the air are not. A Channel
+# adds band conditions to the PCM stream of a session:
+#
+#   - noise   - white Gaussian noise band limited to 'bandwidth' Hz
+#               around the sidetone, like the noise heard through a
+#               receiver's CW filter. The SNR is the power of the tone
+#               relative to the power of the noise in that bandwidth.
+#   - QSB     - fading, the signal is slowly attenuated by up to 'depth'
+#               (0 - 1) and back at 'rate' Hz
+#   - drift   - the pitch of the signal slowly wanders by up to 'drift'
+#               Hz over DRIFT_PERIOD seconds (chirp, the pitch shift as
+#               the key closes, is a property of the keyer's elements,
+#               see keyer.Keyer)
+#   - QRM     - other stations, sending their own messages at their own
+#               pitch, speed and strength, mixed into the signal
+#
+# The stream is processed in blocks of BLOCK_SIZE samples, all of the
+# effects of a block are computed with whole array operations, and the
+# filters keep their state between blocks (and between the chunks of a
+# streamed session) so the block edges can't be heard. The filters are
+# FIR filters applied by FFT convolution with overlap-add.
+
+# taps of the noise band pass filter and of the Hilbert transformer
+# used to shift the pitch
+NOISE_TAPS   = 1023
+HILBERT_TAPS = 255
+
+# a block and the filter tails fit in one power of two FFT
+FFT_SIZE   = 65536
+BLOCK_SIZE = FFT_SIZE - NOISE_TAPS + 1
+
+# seconds over which the pitch drifts back and forth
+DRIFT_PERIOD = 60.0
+
+# seconds of silence between the messages of a QRM station
+QRM_GAP = (0.5, 4.0)
+
+
+# A FIR filter that can be applied to a stream, block by block
+class StreamFilter:
+
+    def __init__(self, taps):
+        self.taps = np.asarray(taps, dtype=np.float64)
+        self._tail = np.zeros(len(self.taps) - 1)
+        self._spectra = {}
+
+
+    def process(self, x):
+        n = len(x)
+        size = 1 << (n + len(self.taps) - 2).bit_length()
+        spectrum = self._spectra.get(size)
+        if spectrum is None:
+            spectrum = self._spectra[size] = np.fft.rfft(self.taps, size)
+
+        y = np.fft.irfft(np.fft.rfft(x, size) * spectrum, size)[:n + len(self._tail)]
+        y[:len(self._tail)] += self._tail
+        self._tail = y[n:].copy()
+
+        return y[:n]
+
+
+# Return the taps of a band pass filter, 'low' to 'high' Hz, with a
+# Blackman window
+def bandPassTaps(low, high, numTaps, sampleRate):
+    n = np.arange(numTaps) - (numTaps - 1) / 2
+    low = max(low, 0) / sampleRate
+    high = min(high, sampleRate / 2) / sampleRate
+    taps = 2 * high * np.sinc(2 * high * n) - 2 * low * np.sinc(2 * low * n)
+
+    return taps * np.blackman(numTaps)
+
+
+def hilbertTaps(numTaps):
+    n = np.arange(numTaps) - (numTaps - 1) // 2
+    taps = np.zeros(numTaps)
+    odd = n % 2 == 1
+    taps[odd] = 2 / (np.pi * n[odd])
+
+    return taps * np.blackman(numTaps)
+
+
+# Band limited white Gaussian noise with a given power
+class NoiseSource:
+
+    def __init__(self, power, centerFreq, bandwidth, sampleRate, rng):
+        taps = bandPassTaps(centerFreq - bandwidth / 2, centerFreq + bandwidth / 2,
+                            NOISE_TAPS, sampleRate)
+        # the filter passes sum(taps ** 2) of the power of white noise
+        self.std = np.sqrt(power / np.sum(taps ** 2))
+        self.rng = rng
+        self._filter = StreamFilter(taps)
+
+
+    def samples(self, n):
+        return self._filter.process(self.rng.normal(0, self.std, n))
+
+
+# Shift the pitch of a signal by a frequency offset that changes with
+# time: the signal plus its Hilbert transform is the analytic signal,
+# which is rotated by the phase of the offset
+class PitchShifter:
+
+    def __init__(self):
+        self._hilbert = StreamFilter(hilbertTaps(HILBERT_TAPS))
+        # the real part is delayed by the group delay of the Hilbert
+        # filter
+        self._delayed = np.zeros((HILBERT_TAPS - 1) // 2)
+
+
+    # 'phase' is the phase (radians) of the offset at each sample
+    def process(self, x, phase):
+        imag = self._hilbert.process(x)
+        real = np.concatenate((self._delayed, x))
+        self._delayed = real[len(x):]
+
+        return real[:len(x)] * np.cos(phase) - imag * np.sin(phase)
+
+
+# Return the gain of QSB, 1 down to 1 - depth, at times 't'
+def qsbGain(t, depth, rate, phase=0.0):
+    return 1 - depth * 0.5 * (1 - np.cos(2 * np.pi * rate * t + phase))
+
+
+# A station that sends its messages one after another, each followed
+# by a random pause, for as long as samples are taken from it
+class Station:
+
+    def __init__(self, cwKeyer, messages, gap=QRM_GAP, delay=0.0,
+                 qsbDepth=0.0, qsbRate=0.0, rng=None):
+        self.cwKeyer = cwKeyer
+        self.messages = messages
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.gap = gap
+        self.qsbDepth = qsbDepth
+        self.qsbRate = qsbRate
+        self.qsbPhase = self.rng.uniform(0, 2 * np.pi)
+        self._buf = np.zeros(int(delay * cwKeyer.sampleRate), dtype=np.float32)
+        self._num = 0
+
+
+    def _nextMessage(self):
+        message = self.messages[self._num % len(self.messages)]
+        self._num += 1
+        pause = np.zeros(int(self.rng.uniform(*self.gap) * self.cwKeyer.sampleRate),
+                         dtype=np.float32)
+
+        return [self.cwKeyer.renderText([message]), pause]
+
+
+    # Return the next n samples of the station, 't' are their times
+    def take(self, n, t):
+        if len(self._buf) < n:
+            bufs = [self._buf]
+            length = len(self._buf)
+            while length < n:
+                for buf in self._nextMessage():
+                    bufs.append(buf)
+                    length += len(buf)
+            self._buf = np.concatenate(bufs)
+
+        samples = self._buf[:n]
+        self._buf = self._buf[n:]
+        if self.qsbDepth:
+            samples = samples * qsbGain(t, self.qsbDepth, self.qsbRate, self.qsbPhase)
+
+        return samples
+
+
+class Channel:
+
+    # 'freq' is the sidetone frequency and 'signalPower' the power of
+    # the keyer's tone (volume ** 2 / 2), the noise SNR (dB) is relative
+    # to it. 'stations' are the QRM stations.
+    def __init__(self, freq, signalPower, sampleRate=keyer.SAMPLE_RATE, snr=None,
+                 bandwidth=500, qsbDepth=0.0, qsbRate=0.1, drift=0.0,
+                 stations=None, seed=None):
+        self.sampleRate = sampleRate
+        self.qsbDepth = qsbDepth
+        self.qsbRate = qsbRate
+        self.drift = drift
+        self.stations = stations or []
+        self.rng = np.random.default_rng(seed)
+        self.numSamples = 0
+
+        self._noise = None
+        if snr is not None:
+            self._noise = NoiseSource(signalPower / 10 ** (snr / 10), freq,
+                                      bandwidth, sampleRate, self.rng)
+        self._shifter = PitchShifter() if drift else None
+
+
+    def _processBlock(self, x):
+        n = len(x)
+        t = (self.numSamples + np.arange(n)) / self.sampleRate
+        self.numSamples += n
+
+        x = x.astype(np.float64)
+        if self._shifter is not None:
+            # the offset drift * sin(2 pi t / P) Hz is the derivative
+            # of this phase
+            phase = self.drift * DRIFT_PERIOD * (1 - np.cos(2 * np.pi * t / DRIFT_PERIOD))
+            x = self._shifter.process(x, phase)
+        if self.qsbDepth:
+            x *= qsbGain(t, self.qsbDepth, self.qsbRate)
+        for station in self.stations:
+            x += station.take(n, t)
+        if self._noise is not None:
+            x += self._noise.samples(n)
+
+        return x.astype(np.float32)
+
+
+    # Return the samples with the channel applied, the channel carries
+    # on from the end of the previous samples
+    def process(self, samples):
+        blocks = [self._processBlock(samples[i:i + BLOCK_SIZE])
+                  for i in range(0, len(samples), BLOCK_SIZE)]
+
+        return keyer.concatenate(blocks)
+
+
+    # Apply the channel to a stream of chunks (e.g. keyer.iterWords())
+    def chunks(self, chunks):
+        for chunk in chunks:
+            yield self.process(chunk)
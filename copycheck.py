@@ -0,0 +1,366 @@
+
+# copycheck.py - interactive copy checking of a CW session
+
+
+import os
+import select
+import sys
+import threading
+import time
+
+
+# In copy check mode each word is played by the streaming keyer while
+# the user types what they copy. The terminal is put into cbreak mode
+# so every keystroke is read as it is typed, no Enter is needed: a
+# space (or Enter) ends the copy of a word, which is then scored
+# against the word that was sent and the result shown at once.
+#
+# All times are on the playback timeline: time 0 is the start of the
+# first word's audio, each word's audio is timestamped by the playback
+# thread as it starts, and the keystrokes by the keyboard thread as
+# they arrive. The response time of a word is from the end of its CW
+# (before the word gap) to the keystroke that ends its copy, and the
+# feedback time is from that keystroke to the score being shown.
+#
+# A copy is scored against the word whose audio (its CW and word gap)
+# the keystroke that ends it falls in, or the word before it if that
+# hasn't been copied yet and the copy is closer to it (the copy runs a
+# word behind). The words before it that weren't copied are missed, as
+# is a word that isn't copied by the end of the CW of the word after
+# it, so skipping a word doesn't shift the scoring of the words that
+# follow.
+
+KEY_ESC       = '\x1b'
+KEY_BACKSPACE = ('\x7f', '\b')
+KEY_END_WORD  = (' ', '\n', '\r')
+
+# seconds to wait for the copy of the last words after the session
+# has been played
+COPY_TIMEOUT = 5.0
+
+# seconds between checks of the keyboard thread for the end of the
+# session
+POLL_TIME = 0.05
+
+
+# Return the edit (Levenshtein) distance between the sent and copied
+# text, and the alignment of the characters as a list of (sent, copied)
+# pairs, where a missed character is copied as '' and an extra copied
+# character was sent as ''.
+def editDistance(sent, copied):
+    rows = len(sent) + 1
+    cols = len(copied) + 1
+    dist = [[0] * cols for i in range(rows)]
+    for i in range(rows):
+        dist[i][0] = i
+    for j in range(cols):
+        dist[0][j] = j
+
+    for i in range(1, rows):
+        for j in range(1, cols):
+            cost = 0 if sent[i - 1] == copied[j - 1] else 1
+            dist[i][j] = min(dist[i - 1][j] + 1, dist[i][j - 1] + 1,
+                             dist[i - 1][j - 1] + cost)
+
+    pairs = []
+    i, j = len(sent), len(copied)
+    while i > 0 or j > 0:
+        if (i > 0 and j > 0 and
+            dist[i][j] == dist[i - 1][j - 1] + (sent[i - 1] != copied[j - 1])):
+            pairs.append((sent[i - 1], copied[j - 1]))
+            i -= 1
+            j -= 1
+        elif i > 0 and dist[i][j] == dist[i - 1][j] + 1:
+            pairs.append((sent[i - 1], ''))
+            i -= 1
+        else:
+            pairs.append(('', copied[j - 1]))
+            j -= 1
+    pairs.reverse()
+
+    return dist[-1][-1], pairs
+
+
+# Counts of (sent, copied) character pairs
+class ConfusionMatrix:
+
+    def __init__(self):
+        self.counts = {}
+
+
+    def add(self, pairs):
+        for pair in pairs:
+            self.counts[pair] = self.counts.get(pair, 0) + 1
+
+
+    # Return {char: (number sent, number copied correctly)}
+    def charResults(self):
+        results = {}
+        for (sent, copied), count in self.counts.items():
+            if sent:
+                numSent, numCorrect = results.get(sent, (0, 0))
+                results[sent] = (numSent + count,
+                                 numCorrect + (count if sent == copied else 0))
+
+        return results
+
+
+    def confusions(self):
+        return sorted(((count, sent, copied) for (sent, copied), count
+                       in self.counts.items() if sent != copied), reverse=True)
+
+
+    def format(self, limit=10):
+        lines = []
+        for count, sent, copied in self.confusions()[:limit]:
+            lines.append(f"  {sent or '(none)':>6} copied as {copied or '(none)':<6} {count}")
+
+        return '\n'.join(lines)
+
+
+# The terminal in cbreak mode: keystrokes are read one at a time and
+# not echoed
+class RawTerminal:
+
+    def __init__(self, fileobj=sys.stdin):
+        self.fd = fileobj.fileno()
+        self._saved = None
+
+
+    def __enter__(self):
+        import termios
+        import tty
+        self._saved = termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+        return self
+
+
+    def __exit__(self, *exc):
+        import termios
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, self._saved)
+
+
+    # Return the next key, or None if no key is pressed within 'timeout'
+    # seconds
+    def readKey(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return None
+
+        return os.read(self.fd, 1).decode(errors='replace')
+
+
+class CopyCheck:
+
+    # 'words' are the words that are sent, one chunk each, after
+    # 'leadIn' chunks that are not copied (e.g. 'vvvv'). 'gapSamples'
+    # is the length of the word gap at the end of each chunk.
+    def __init__(self, words, sampleRate, gapSamples, leadIn=0, out=sys.stdout):
+        self.words = words
+        self.sampleRate = sampleRate
+        self.gapSamples = gapSamples
+        self.leadIn = leadIn
+        self.out = out
+        self.matrix = ConfusionMatrix()
+        # per word: dict of copy, distance, audio end, response and
+        # feedback times
+        self.results = []
+
+        self._chunkSamples = []
+        self._wordStarts = {}
+        self._wordEnds = {}
+        # the words before it have been scored or missed
+        self._nextWord = 0
+        self._typed = ''
+        self._startTime = None
+        self._lock = threading.Lock()
+        self._played = threading.Event()
+        self._stop = threading.Event()
+        self._aborted = threading.Event()
+
+
+    def now(self):
+        return time.monotonic() - self._startTime
+
+
+    # Wrap the chunks of the session to record their lengths, the
+    # session ends early if it is aborted (ESC)
+    def chunks(self, chunks):
+        for chunk in chunks:
+            if self._aborted.is_set():
+                break
+            self._chunkSamples.append(len(chunk))
+            yield chunk
+
+
+    # Called by the playback thread as the audio of each chunk starts
+    def chunkStarted(self, chunkNum):
+        with self._lock:
+            if self._startTime is None:
+                self._startTime = time.monotonic()
+            wordNum = chunkNum - self.leadIn
+            if wordNum >= 0:
+                cwSamples = self._chunkSamples[chunkNum] - self.gapSamples
+                self._wordStarts[wordNum] = self.now()
+                self._wordEnds[wordNum] = self.now() + cwSamples / self.sampleRate
+
+
+    def key(self, char):
+        with self._lock:
+            if self._startTime is None:
+                return
+            keyTime = self.now()
+
+        if char in KEY_END_WORD:
+            if self._typed:
+                self._scoreWord(self._typed, keyTime)
+                self._typed = ''
+        elif char in KEY_BACKSPACE:
+            if self._typed:
+                self._typed = self._typed[:-1]
+                self.out.write('\b \b')
+        elif char.isprintable():
+            self._typed += char.lower()
+            self.out.write(char.lower())
+        self.out.flush()
+
+
+    # Return the number of the word a copy ended at keyTime is of, or
+    # None if there isn't one (e.g. the word has been copied already)
+    def _copiedWord(self, copied, keyTime):
+        with self._lock:
+            started = [wordNum for wordNum, start in self._wordStarts.items()
+                       if start <= keyTime]
+        if not started:
+            return None
+
+        wordNum = max(started)
+        if (self._nextWord < wordNum < len(self.words) and
+            editDistance(self.words[wordNum - 1].lower(), copied)[0] <
+            editDistance(self.words[wordNum].lower(), copied)[0]):
+            wordNum -= 1
+
+        return wordNum if self._nextWord <= wordNum < len(self.words) else None
+
+
+    # Miss the words that weren't copied by the end of the CW of the
+    # word after them
+    def _missPassedWords(self, now):
+        while self._nextWord < len(self.words):
+            with self._lock:
+                nextEnd = self._wordEnds.get(self._nextWord + 1)
+            if nextEnd is None or nextEnd > now:
+                break
+            self.out.write(f"{' ' * 12}{self.words[self._nextWord].lower()} (missed)\n")
+            self.out.flush()
+            self._missWord(self._nextWord)
+
+
+    def _scoreWord(self, copied, keyTime):
+        wordNum = self._copiedWord(copied, keyTime)
+        if wordNum is None:
+            self.out.write(f"{' ' * max(12 - len(copied), 1)}(extra)\n")
+            self.out.flush()
+            return
+        while self._nextWord < wordNum:
+            self._missWord(self._nextWord)
+        self._nextWord = wordNum + 1
+        sent = self.words[wordNum].lower()
+
+        distance, pairs = editDistance(sent, copied)
+        self.matrix.add(pairs)
+
+        with self._lock:
+            wordEnd = self._wordEnds.get(wordNum)
+        result = {'sent': sent, 'copied': copied, 'distance': distance,
+                  'pairs': pairs, 'audioEnd': wordEnd,
+                  'response': None if wordEnd is None else keyTime - wordEnd}
+
+        if distance == 0:
+            mark = 'ok'
+        else:
+            mark = f"{sent} ({distance} error{'s' if distance > 1 else ''})"
+        if result['response'] is not None:
+            mark += f"  {1000 * result['response']:+.0f} ms"
+        self.out.write(f"{' ' * max(12 - len(copied), 1)}{mark}\n")
+        self.out.flush()
+
+        result['feedback'] = self.now() - keyTime
+        self.results.append(result)
+
+
+    def _missWord(self, wordNum):
+        sent = self.words[wordNum].lower()
+        distance, pairs = editDistance(sent, '')
+        self.matrix.add(pairs)
+        self.results.append({'sent': sent, 'copied': '', 'distance': distance,
+                             'pairs': pairs, 'audioEnd': self._wordEnds.get(wordNum),
+                             'response': None, 'feedback': None})
+        self._nextWord = wordNum + 1
+
+
+    def _readKeys(self, terminal):
+        lastKey = None
+        while not self._stop.is_set():
+            char = terminal.readKey(POLL_TIME)
+            if char is not None:
+                if char == KEY_ESC:
+                    self._aborted.set()
+                    break
+                self.key(char)
+                lastKey = time.monotonic()
+            if self._startTime is not None and not self._typed:
+                self._missPassedWords(self.now())
+            if self._nextWord >= len(self.words):
+                break
+            if (self._played.is_set() and
+                time.monotonic() - max(lastKey or 0, self._playedTime) > COPY_TIMEOUT):
+                break
+
+
+    # Play the session with 'playFunc', which is given the wrapped
+    # chunks and the chunk start callback, while the copy is read
+    def run(self, playFunc, terminal):
+        reader = threading.Thread(target=self._readKeys, args=(terminal,), daemon=True)
+        reader.start()
+        try:
+            playFunc(self.chunkStarted)
+        finally:
+            self._playedTime = time.monotonic()
+            self._played.set()
+            reader.join()
+            self._stop.set()
+
+        if self._typed:
+            self._scoreWord(self._typed, self.now())
+        while self._nextWord < len(self.words):
+            self._missWord(self._nextWord)
+
+
+    def report(self):
+        numWords = len(self.results)
+        numCorrect = sum(1 for r in self.results if r['distance'] == 0)
+        numChars = sum(len(r['sent']) for r in self.results)
+        numErrors = sum(r['distance'] for r in self.results)
+        responses = sorted(r['response'] for r in self.results
+                           if r['response'] is not None)
+        feedbacks = [r['feedback'] for r in self.results if r['feedback'] is not None]
+
+        lines = ["---------------------------------------------------------"]
+        lines.append(f"Words copied: {numCorrect}/{numWords}, character accuracy: "
+                     f"{100 * max(1 - numErrors / numChars, 0) if numChars else 0:.1f}%")
+        if responses:
+            lines.append(f"Response time (end of CW to end of copy): median "
+                         f"{1000 * responses[len(responses) // 2]:.0f} ms, "
+                         f"max {1000 * responses[-1]:.0f} ms")
+        if feedbacks:
+            gap = self.gapSamples / self.sampleRate
+            lines.append(f"Feedback time (end of copy to score): max "
+                         f"{1000 * max(feedbacks):.2f} ms "
+                         f"(word gap {1000 * gap:.0f} ms)")
+        confusions = self.matrix.format()
+        if confusions:
+            lines.append("Confusions:")
+            lines.append(confusions)
+
+        return '\n'.join(lines)
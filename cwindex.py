@@ -0,0 +1,316 @@
+
+# cwindex.py - memory-mapped on-disk corpus index files
+
+
+import array
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+
+# The corpora used by cwwords (the FCC EN.dat file, foreign.dat and
+# the word files) are plain text files that are expensive to parse on
+# every run. An index file is a one-time, compact binary rendering of
+# a corpus that is memory-mapped when it is loaded, so only the pages
+# that are actually used are read from disk.
+#
+# Index file layout:
+#   header   - magic, format version, length of the JSON metadata
+#   metadata - JSON: source file signatures, array layout, user data
+#   arrays   - named arrays of fixed width items, each 8 byte aligned
+#
+# String tables are stored as two arrays: '<name>.text', the strings
+# joined by newlines, and '<name>.offsets', the byte offset of the
+# start of each string plus one trailing offset for the end of the
+# table. A single string is then an O(1) lookup and a contiguous range
+# of strings is decoded with one decode() and split().
+#
+# Ranked string tables are string tables stored once per character
+# training order (Koch, CW Ops). The rank of a string is the position
+# in the order of the last character that it needs, so a string can
+# be sent by someone who has learned that many characters. Each
+# ranked table is sorted by rank and has a '.bounds' array where
+# bounds[n] is the number of strings with a rank <= n. Selecting the
+# strings usable with the first n characters of an order is then a
+# single range of the table rather than a scan of every character of
+# every string. The '.pos' array is the position of each string in the
+# original (unsorted) list, e.g. the frequency rank of a word.
+
+INDEX_MAGIC   = b'CWIX'
+INDEX_VERSION = 1
+INDEX_HEADER  = struct.Struct('<4sII')
+INDEX_ALIGN   = 8
+
+# rank of a string that contains a character not in the order
+RANK_NONE = 255
+
+CACHE_DIR_NAME = 'cwwords'
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+# Return the per-user cache directory used for index files, creating
+# it if necessary. This is outside of the source tree/pyinstaller
+# bundle, which is read-only (or temporary) when running bundled.
+def getCacheDir():
+    cacheHome = os.environ.get('XDG_CACHE_HOME',
+                               os.path.join(os.path.expanduser('~'), '.cache'))
+    cacheDir = os.path.join(cacheHome, CACHE_DIR_NAME)
+    os.makedirs(cacheDir, exist_ok=True)
+
+    return cacheDir
+
+
+def fileDigest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fileobj:
+        for block in iter(lambda: fileobj.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def sourceSignature(path):
+    st = os.stat(path)
+    sig = {}
+    sig['path'] = os.path.abspath(path)
+    sig['size'] = st.st_size
+    sig['mtime'] = st.st_mtime_ns
+    sig['sha256'] = fileDigest(path)
+
+    return sig
+
+
+# Add a string table to the dict of arrays that is written to an index
+# file by writeIndex().
+def addStrings(arrays, name, strings):
+    text = bytearray()
+    offsets = array.array('I', [0])
+    for s in strings:
+        text += s.encode('utf-8')
+        text += b'\n'
+        offsets.append(len(text))
+
+    arrays[f"{name}.text"] = bytes(text)
+    arrays[f"{name}.offsets"] = offsets
+
+
+def charRank(text, rankMap):
+    rank = 0
+    for c in text.lower():
+        r = rankMap.get(c, RANK_NONE)
+        if r > rank:
+            rank = r
+
+    return rank
+
+
+# Add a ranked string table for each of the character orders in the
+# dict 'orders' (name -> list of characters). The sort is stable, so
+# strings of the same rank keep the order they are given in.
+def addRankedStrings(arrays, name, strings, orders):
+    for orderName, order in orders.items():
+        rankMap = {c: i + 1 for i, c in enumerate(order)}
+        ranks = [charRank(s, rankMap) for s in strings]
+        perm = sorted(range(len(strings)), key=ranks.__getitem__)
+        sortedRanks = array.array('B', [ranks[i] for i in perm])
+
+        view = f"{name}.{orderName}"
+        addStrings(arrays, view, [strings[i] for i in perm])
+        arrays[f"{view}.rank"] = sortedRanks
+        arrays[f"{view}.pos"] = array.array('I', perm)
+        arrays[f"{view}.bounds"] = array.array(
+            'I', [bisect.bisect_right(sortedRanks, n) for n in range(len(order) + 1)])
+
+
+def _align(n):
+    return (n + INDEX_ALIGN - 1) // INDEX_ALIGN * INDEX_ALIGN
+
+
+# Write the index file. The file is written to a temporary name and
+# then renamed so that concurrent readers never see a partial index.
+def writeIndex(indexFile, meta, arrays):
+    layout = {}
+    offset = 0
+    for name, data in arrays.items():
+        if isinstance(data, array.array):
+            typecode = data.typecode
+            nbytes = len(data) * data.itemsize
+        else:
+            typecode = 'B'
+            nbytes = len(data)
+        layout[name] = {'type': typecode, 'offset': offset,
+                        'count': nbytes // struct.calcsize(typecode)}
+        offset += _align(nbytes)
+
+    meta = dict(meta)
+    meta['byteorder'] = sys.byteorder
+    meta['arrays'] = layout
+    metaBytes = json.dumps(meta).encode('utf-8')
+    dataStart = _align(INDEX_HEADER.size + len(metaBytes))
+
+    tmpFile = f"{indexFile}.{os.getpid()}.tmp"
+    with open(tmpFile, 'wb') as fileobj:
+        fileobj.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(metaBytes)))
+        fileobj.write(metaBytes)
+        fileobj.write(b'\0' * (dataStart - INDEX_HEADER.size - len(metaBytes)))
+        for name, data in arrays.items():
+            raw = data.tobytes() if isinstance(data, array.array) else data
+            fileobj.write(raw)
+            fileobj.write(b'\0' * (_align(len(raw)) - len(raw)))
+
+    os.replace(tmpFile, indexFile)
+
+
+class CorpusIndex:
+
+    def __init__(self, indexFile):
+        self.indexFile = indexFile
+        self._views = {}
+
+        with open(indexFile, 'rb') as fileobj:
+            try:
+                self._mmap = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # zero length file
+                raise IndexFormatError(f"empty index file: {indexFile}")
+
+        try:
+            magic, version, metaLen = INDEX_HEADER.unpack_from(self._mmap, 0)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise IndexFormatError(f"unknown index format: {indexFile}")
+            metaEnd = INDEX_HEADER.size + metaLen
+            self.meta = json.loads(self._mmap[INDEX_HEADER.size:metaEnd])
+            if self.meta['byteorder'] != sys.byteorder:
+                raise IndexFormatError(f"index byte order mismatch: {indexFile}")
+        except (struct.error, ValueError, KeyError) as e:
+            self._mmap.close()
+            raise IndexFormatError(f"corrupt index file {indexFile}: {e}")
+        except IndexFormatError:
+            self._mmap.close()
+            raise
+
+        self._dataStart = _align(metaEnd)
+
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views = {}
+        self._mmap.close()
+
+
+    # Check the source files that the index was built from. The file
+    # size and modification time are checked first, as that is
+    # cheap. If these don't match (e.g. the file was touched or
+    # re-extracted from the pyinstaller bundle) then the file contents
+    # are hashed and compared.
+    def isCurrent(self, sourceFiles):
+        sources = self.meta.get('sources', [])
+        if len(sources) != len(sourceFiles):
+            return False
+
+        for sig, path in zip(sources, sourceFiles):
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if st.st_size != sig['size']:
+                return False
+            if st.st_mtime_ns != sig['mtime'] and fileDigest(path) != sig['sha256']:
+                return False
+
+        return True
+
+
+    def hasArray(self, name):
+        return name in self.meta['arrays']
+
+
+    def array(self, name):
+        if name not in self._views:
+            try:
+                layout = self.meta['arrays'][name]
+            except KeyError:
+                raise IndexFormatError(f"index {self.indexFile} has no array '{name}'")
+            start = self._dataStart + layout['offset']
+            nbytes = layout['count'] * struct.calcsize(layout['type'])
+            view = memoryview(self._mmap)[start:start + nbytes]
+            self._views[name] = view.cast(layout['type'])
+
+        return self._views[name]
+
+
+    def count(self, name):
+        return len(self.array(f"{name}.offsets")) - 1
+
+
+    def string(self, name, i):
+        offsets = self.array(f"{name}.offsets")
+        text = self.array(f"{name}.text")
+
+        return bytes(text[offsets[i]:offsets[i + 1] - 1]).decode('utf-8')
+
+
+    def strings(self, name, start=0, end=None):
+        offsets = self.array(f"{name}.offsets")
+        text = self.array(f"{name}.text")
+        if end is None:
+            end = len(offsets) - 1
+        if end <= start:
+            return []
+
+        lst = bytes(text[offsets[start]:offsets[end]]).decode('utf-8').split('\n')
+        lst.pop()                      # empty string after the last newline
+
+        return lst
+
+
+    # Return the strings of a ranked string table that only use the
+    # first 'numChars' characters of the order.
+    def rankedStrings(self, name, orderName, numChars):
+        view = f"{name}.{orderName}"
+        bounds = self.array(f"{view}.bounds")
+        numChars = min(max(numChars, 0), len(bounds) - 1)
+
+        return self.strings(view, 0, bounds[numChars])
+
+
+    # Return the original positions of the strings returned by
+    # rankedStrings()
+    def rankedPositions(self, name, orderName, numChars):
+        view = f"{name}.{orderName}"
+        bounds = self.array(f"{view}.bounds")
+        numChars = min(max(numChars, 0), len(bounds) - 1)
+
+        return array.array('I', self.array(f"{view}.pos")[:bounds[numChars]])
+
+
+# Open an index file, (re)building it with buildFunc() if it is
+# missing, corrupt, older than any of its source files, or was built
+# with a different 'schema' (any JSON value describing the layout and
+# build parameters of the index). buildFunc returns a tuple of
+# (metadata dict, dict of arrays).
+def openIndex(indexFile, sourceFiles, buildFunc, schema=None, rebuild=False):
+    if not rebuild and os.path.exists(indexFile):
+        try:
+            index = CorpusIndex(indexFile)
+            if index.meta.get('schema') == schema and index.isCurrent(sourceFiles):
+                return index
+            index.close()
+        except IndexFormatError as e:
+            print(f"WARNING: {e}, rebuilding")
+
+    print(f"Building index: {indexFile}")
+    meta, arrays = buildFunc()
+    meta['schema'] = schema
+    meta['sources'] = [sourceSignature(f) for f in sourceFiles]
+    writeIndex(indexFile, meta, arrays)
+
+    return CorpusIndex(indexFile)
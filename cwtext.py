@@ -0,0 +1,153 @@
+
+# cwtext.py - tokenizing text for the keyer, the display and speech
+
+
+import collections
+import functools
+import re
+
+
+# Text sent in CW is a sequence of tokens: the characters, and the
+# prosigns, written as their letters in angle brackets (<AR>, <BT>,
+# <SK>, <KN>, <BK>, ...), which are sent as one character with no
+# character gap between their letters. The token table holds
+# everything that is needed about each token, worked out once:
+#   code     - the Morse elements, e.g. '.-.-.' for <AR>, None for a
+#              character that has no Morse Code
+#   chars    - the characters that must have been learned to send it,
+#              a prosign needs its letters
+#   spoken   - the text spoken for it (a prosign is spoken as its
+#              letters)
+#   phonetic - the text spoken for it when spelled phonetically
+#   external - the text given to the external CW programs, which know
+#              the prosigns that have a punctuation equivalent
+#
+# A word is split into its tokens in one pass of a precompiled regular
+# expression, and the tokens of recently used words are cached, so the
+# keyer, the display and the speech of a session share one parse of
+# each word.
+
+MORSE_CODE = {
+    'a': '.-',     'b': '-...',   'c': '-.-.',   'd': '-..',
+    'e': '.',      'f': '..-.',   'g': '--.',    'h': '....',
+    'i': '..',     'j': '.---',   'k': '-.-',    'l': '.-..',
+    'm': '--',     'n': '-.',     'o': '---',    'p': '.--.',
+    'q': '--.-',   'r': '.-.',    's': '...',    't': '-',
+    'u': '..-',    'v': '...-',   'w': '.--',    'x': '-..-',
+    'y': '-.--',   'z': '--..',
+    '0': '-----',  '1': '.----',  '2': '..---',  '3': '...--',
+    '4': '....-',  '5': '.....',  '6': '-....',  '7': '--...',
+    '8': '---..',  '9': '----.',
+    '.': '.-.-.-', ',': '--..--', '?': '..--..', '/': '-..-.',
+    '=': '-...-',  '+': '.-.-.',  '-': '-....-', "'": '.----.',
+    '"': '.-..-.', ':': '---...', ';': '-.-.-.', '(': '-.--.',
+    ')': '-.--.-', '@': '.--.-.', '!': '-.-.--', '&': '.-...',
+}
+
+# prosign: (code, the character with the same code, if any)
+PROSIGNS = {
+    '<ar>': ('.-.-.',    '+'),
+    '<as>': ('.-...',    '&'),
+    '<bk>': ('-...-.-',  None),
+    '<bt>': ('-...-',    '='),
+    '<ct>': ('-.-.-',    None),
+    '<kn>': ('-.--.',    '('),
+    '<sk>': ('...-.-',   None),
+    '<sn>': ('...-.',    None),
+}
+
+PHONETIC_ALPHABET = {
+    'a': 'alpha',    'b': 'bravo',   'c': 'charlie', 'd': 'delta',
+    'e': 'echo',     'f': 'foxtrot', 'g': 'golf',    'h': 'hotel',
+    'i': 'india',    'j': 'juliet',  'k': 'kilo',    'l': 'lima',
+    'm': 'mike',     'n': 'november', 'o': 'oscar',  'p': 'papa',
+    'q': 'quebec',   'r': 'romeo',   's': 'sierra',  't': 'tango',
+    'u': 'uniform',  'v': 'victor',  'w': 'whiskey', 'x': 'xray',
+    'y': 'yankee',   'z': 'zulu',
+}
+
+TOKEN_PATTERN = re.compile(r'<[a-z]{2,3}>|.', re.IGNORECASE | re.DOTALL)
+
+# number of words whose tokens are cached
+TOKEN_CACHE_SIZE = 4096
+
+Token = collections.namedtuple('Token', ['text', 'code', 'chars', 'spoken',
+                                         'phonetic', 'external'])
+
+
+def _phonetic(char):
+    if char.isdigit():
+        return char
+    return PHONETIC_ALPHABET.get(char, '')
+
+
+def _buildTokens():
+    tokens = {}
+    for char, code in MORSE_CODE.items():
+        tokens[char] = Token(char, code, frozenset(char), char, _phonetic(char), char)
+
+    for prosign, (code, equivalent) in PROSIGNS.items():
+        letters = prosign[1:-1]
+        tokens[prosign] = Token(prosign.upper(), code, frozenset(letters),
+                                ' '.join(letters.upper()),
+                                '  '.join(_phonetic(c) for c in letters),
+                                equivalent or prosign.upper())
+
+    return tokens
+
+
+TOKENS = _buildTokens()
+
+
+def _unknownToken(text):
+    return Token(text, None, frozenset(text.lower()), text, '', text)
+
+
+# Return the tokens of a word (or line of words)
+@functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def tokenize(text):
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        key = match.group().lower()
+        token = TOKENS.get(key)
+        if token is None:
+            if len(key) > 1:
+                # not a prosign, its characters are tokens of their own
+                tokens.extend(TOKENS.get(c) or _unknownToken(c) for c in key)
+                continue
+            token = _unknownToken(match.group())
+        tokens.append(token)
+
+    return tuple(tokens)
+
+
+# Return the Morse Code of each token of a word that has a code
+def codes(word):
+    return [token.code for token in tokenize(word) if token.code is not None]
+
+
+# Return the number of characters of a word as they are sent, a prosign
+# is one character
+def numChars(word):
+    return sum(1 for token in tokenize(word) if token.code is not None)
+
+
+# Return True if the word only needs the characters in 'charSet'
+def canSend(word, charSet):
+    return all(token.chars <= charSet for token in tokenize(word)
+               if not token.text.isspace())
+
+
+def spokenText(text):
+    return ''.join(token.spoken for token in tokenize(text))
+
+
+# Return the text spelled phonetically, e.g. 'K6ZX' is 'kilo  6  zulu
+# xray', the double spaces give the speech engine a pause
+def phoneticText(text):
+    return ''.join(f"{token.phonetic}  " for token in tokenize(text) if token.phonetic)
+
+
+# Return the text for the external CW programs
+def externalText(text):
+    return ''.join(token.external for token in tokenize(text))
@@ -2,22 +2,31 @@
 # -*- mode: python -*-
 
 
+import time
+
+# start of the run, for the --timing report
+START_TIME = time.perf_counter()
+
+# Only the modules that every run needs are imported here. The audio
+# modules (keyer, playback, ninja, tts, which use numpy) and the other
+# modules that only some modes need are imported by the functions that
+# use them, so that e.g. printing a word list starts quickly.
+import array
+import callfeatures
 import configargparse
-import datetime
-import gtts
-import inspect
-import lzma
+import contextlib
+import cwindex
+import cwtext
+import hashlib
 import os
 import platform
-import pydub
-from pydub.playback import play
 import random
 import re
+import sampler
 import shutil
-import string
 import subprocess
 import sys
-import time
+import tempfile
 
 
 
@@ -32,26 +41,18 @@ CWOPS_CHARS = ['t', 'e', 'a', 'n', 'o', 'i', 's', '1', '4', 'r',
                '6', '?', 'f', 'y', 'p', 'g', '7', '9', '/', 'b',
                'v', 'k', 'j', '8', '0', 'x', 'q', 'z', '.', ',']
 
-VOWELS = ['a', 'e', 'i', 'o', 'u', 'y']
-
-PHONETIC_CHARS = [('A', 'alpha'), ('B', 'bravo'), ('C', 'charlie'),
-                  ('D', 'delta'), ('E', 'echo'), ('F', 'foxtrot'),
-                  ('G', 'golf'), ('H', 'hotel'), ('I', 'india'),
-                  ('J', 'juliet'), ('K', 'kilo'), ('L', 'lima'),
-                  ('M', 'mike'), ('N', 'november'), ('O', 'oscar'),
-                  ('P', 'papa'), ('Q', 'quebec'), ('R', 'romeo'),
-                  ('S', 'sierra'), ('T', 'tango'), ('U', 'uniform'),
-                  ('V', 'victor'), ('W', 'whiskey'), ('X', 'xray'),
-                  ('Y', 'yankee'), ('Z', 'zulu')]
+# character training orders, by name, used to rank the words and
+# callsigns in the corpus indexes
+CHAR_ORDERS = {'koch': KOCH_CHARS, 'cwops': CWOPS_CHARS}
 
+VOWELS = ['a', 'e', 'i', 'o', 'u', 'y']
 
-CW_INPUT_FILE =  "/tmp/ebook2cwinput.txt"
 
+# The external CW programs are run in a private temporary workspace
+# directory per session, so sessions can run in parallel. ebook2cw
+# splits its output into numbered segments, <base>0000.mp3, ...
+CW_INPUT_BASE  = "ebook2cwinput.txt"
 CW_OUTPUT_BASE = "cwwords"
-CW_OUTPUT_FILE = os.path.join("/tmp", CW_OUTPUT_BASE)
-
-WORD_SND_BASE = "cwword-word-snd"
-WORD_SND_FILE = os.path.join("/tmp", WORD_SND_BASE)
 
 # TONE_FILE = os.path.join(sys.path[0], "tone.mp3")
 TONE_FILE     = os.path.join('data', 'tone.mp3')
@@ -61,6 +62,26 @@ TONE_FILE     = os.path.join('data', 'tone.mp3')
 SCRIPT_DIR        = os.path.dirname(os.path.realpath(sys.argv[0]))
 US_CALL_FILE      = os.path.join('data', 'EN.dat.lzma')
 FOREIGN_CALL_FILE = os.path.join('data', 'foreign.dat')
+CALL_INDEX_FILE   = 'callsigns.idx'
+WORD_INDEX_BASE   = 'words'
+WAVE_CACHE_DIR    = 'waveforms'
+TTS_CACHE_DIR     = 'tts'
+
+# number of the hardest characters, from spaced repetition, that are
+# practiced more with the 'weak' word distribution
+WEAK_CHARS = 4
+
+# Any change to the layout or content of the index files must change
+# this, so that existing indexes are rebuilt
+INDEX_SCHEMA = {'version': 5, 'orders': CHAR_ORDERS}
+
+# DXCC country of the callsigns in the FCC file
+US_COUNTRY = 'United States'
+
+# range of the pitch offset (Hz) of the QRM stations from the sidetone
+QRM_MIN_OFFSET = 50
+QRM_MAX_OFFSET = 400
+
 WORD_FILE         = os.path.join('data', 'google-10000-english-master',
                                  'google-10000-english-no-swears.txt')
 
@@ -78,7 +99,7 @@ class CustomFormatter(configargparse.ArgumentDefaultsHelpFormatter,
     pass
 
 
-def parseArguments():
+def parseArguments(argv=None):
 
     p = """
 'cwwords' is a Morse Code practice application that has several 
@@ -155,9 +176,77 @@ speed can all be specified.
                         help='Farnsworth character speed to generate')
     parser.add_argument('--noise', action='store', dest='noiseSNR',
                         type=str, default=0, help="Add background noise with SNR")
+    parser.add_argument('--noise-bw', action='store', dest='noiseBandwidth',
+                        type=float, default=500,
+                        help='Bandwidth (Hz) of the --noise around the sidetone, '
+                        'with the keyer engine')
+    parser.add_argument('--qsb', action='store', dest='qsbDepth', type=float,
+                        default=0, help='QSB (fading) depth between 0 - 1, with the '
+                        'keyer engine')
+    parser.add_argument('--qsb-rate', action='store', dest='qsbRate', type=float,
+                        default=0.1, help='QSB rate (Hz)')
+    parser.add_argument('--chirp', action='store', dest='chirp', type=float,
+                        default=0, help='Chirp (Hz) of the sidetone as each element '
+                        'starts, with the keyer engine')
+    parser.add_argument('--drift', action='store', dest='drift', type=float,
+                        default=0, help='Slow drift (Hz) of the sidetone, with the '
+                        'keyer engine')
+    parser.add_argument('--qrm', action='store', dest='qrm', type=int, default=0,
+                        help='Number of interfering stations calling CQ near the '
+                        'sidetone, with the keyer engine')
+    parser.add_argument('--pileup', action='store', dest='pileup', type=int,
+                        default=0,
+                        help='Callsign pileups of this many callers at once, each '
+                        'with its own speed, pitch and strength, with the keyer '
+                        'engine. The answer key is shown after the pileups')
+    parser.add_argument('--word-dist', action='store', dest='wordDist',
+                        choices=sampler.DISTRIBUTIONS, default='uniform',
+                        help="Distribution of the generated words: 'uniform', 'zipf' "
+                        "(common words more often, by their rank in the word file) or "
+                        "'weak' (words with the --weak-chars more often)")
+    parser.add_argument('--weak-chars', action='store', dest='weakChars', default='',
+                        help="Characters to practice more with '--word-dist weak'")
+    parser.add_argument('--with-replacement', action='store_true', dest='withReplacement',
+                        help='Draw each word independently, so a word may be '
+                        'generated more than once')
+    parser.add_argument('--copy-check', action='store_true', dest='copyCheck',
+                        help='Type the words (or callsigns) as they are played, each '
+                        'word is scored as soon as it is copied')
+    parser.add_argument('--srs', action='store_true', dest='srs',
+                        help='Spaced repetition: include the words or callsigns that '
+                        'are due for review, from the results of earlier sessions')
+    parser.add_argument('--srs-db', action='store', dest='srsFile',
+                        help='Spaced repetition review database (default: '
+                        '~/.local/share/cwwords/reviews.db)')
+    parser.add_argument('--call-structure', action='store', dest='callStructure',
+                        help="Only generate callsigns with this structure, e.g. '2x3'")
+    parser.add_argument('--call-district', action='store', dest='callDistrict',
+                        help='Only generate U.S. callsigns from this call district (0-9)')
+    parser.add_argument('--call-state', action='store', dest='callState',
+                        help="Only generate U.S. callsigns from this state, e.g. 'CA'")
+    parser.add_argument('--call-country', action='store', dest='callCountry',
+                        help="Only generate callsigns from this country, e.g. 'Spain' "
+                        f"or '{US_COUNTRY}'")
+    parser.add_argument('--call-prefix', action='store', dest='callPrefix',
+                        help="Only generate callsigns with this prefix, e.g. 'KB' or 'DL'")
     parser.add_argument('--sound-file', action='store', dest='soundFilename',
-                        type=str, default=CW_OUTPUT_FILE,
-                        help='CW mp3 sound output file')
+                        type=str,
+                        help='CW sound output file, WAV or mp3 (by extension) with the '
+                        "keyer engine, mp3 segments <name>0000.mp3, ... with ebook2cw. "
+                        'In ninja mode the whole session is rendered to this file '
+                        'instead of being played')
+    parser.add_argument('--cw-engine', action='store', dest='cwEngine',
+                        choices=['keyer', 'ebook2cw'], default='keyer',
+                        help="Generate CW with the built-in keyer or the external "
+                        "'ebook2cw'/'morse' programs")
+    parser.add_argument('--wave-cache-mb', action='store', dest='waveCacheMB',
+                        type=int, default=64,
+                        help='Memory budget (MB) of the rendered CW waveform cache')
+    parser.add_argument('--wave-cache-disk', action='store_true', dest='waveCacheDisk',
+                        help='Keep rendered CW words on disk (in ~/.cache/cwwords) '
+                        'between sessions')
+    parser.add_argument('--cache-stats', action='store_true', dest='cacheStats',
+                        help='Print waveform cache statistics at the end of the session')
     parser.add_argument('--play', action='store_true', dest='play', default=False,
                         help='Play cw word file')
     parser.add_argument('--qsos', action='store_true', dest='qsos',
@@ -181,9 +270,45 @@ speed can all be specified.
     parser.add_argument('--ninja-call-phonetic', action='store_true',
                         dest='ninjaCallPhonetic',
                         help='Speak ninja callsigns phonetically')
+    parser.add_argument('--ninja-self-grade', action='store_true', dest='ninjaSelfGrade',
+                        help='After a ninja session, enter the words or callsigns that '
+                        'were missed, for spaced repetition')
+    parser.add_argument('--ninja-pause', action='store', dest='ninjaPause',
+                        type=float,
+                        help='Ninja mode pause (seconds) after the CW and the alert tone '
+                        '(default: 1.0)')
+    parser.add_argument('--tts-engine', action='store', dest='ttsEngine',
+                        default='gtts',
+                        help="Ninja mode text to speech engine: 'gtts', 'espeak' "
+                        "(works offline) or 'stub' (silent, for testing)")
+    parser.add_argument('--tts-voice', action='store', dest='ttsVoice',
+                        help='Ninja mode text to speech voice/language (default: '
+                        'en-ca for gtts, en-us for espeak)')
+    parser.add_argument('--batch', action='store', dest='batchFile',
+                        help='Generate a practice file for every combination of the '
+                        'parameter sets in this batch matrix file and exit')
+    parser.add_argument('--batch-dir', action='store', dest='batchDir', default='.',
+                        help='Directory for the practice files generated by --batch')
+    parser.add_argument('--batch-jobs', action='store', dest='batchJobs', type=int,
+                        help='Number of --batch worker processes (default: number of CPUs)')
+    parser.add_argument('--batch-format', action='store', dest='batchFormat',
+                        choices=['wav', 'mp3'], default='wav',
+                        help='Sound file format of the --batch practice files')
+    parser.add_argument('--output-format', action='store', dest='outputFormat',
+                        choices=['text', 'json', 'csv'], default='text',
+                        help="Format of the generated word or callsign list. With "
+                        "'json' or 'csv' and no --output-file the list is the only "
+                        "output on stdout, the other messages go to stderr")
+    parser.add_argument('--output-file', action='store', dest='outputFile',
+                        help='Also write the generated word or callsign list to this '
+                        'file, in the --output-format')
+    parser.add_argument('--build-index', action='store_true', dest='buildIndex',
+                        help='Rebuild the callsign and word indexes from the data files and exit')
+    parser.add_argument('--timing', action='store_true', dest='timing',
+                        help='Print the time taken by each phase of the run')
     
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # print("-------------------------------------------------------------------")
     # print(parser.format_help())
@@ -218,6 +343,40 @@ def processArguments(args):
     progArgs['ninjaMode'] = args.ninjaMode
     progArgs['ninjaCwVolume'] = args.ninjaCwVolume
     progArgs['ninjaCallPhonetic'] = args.ninjaCallPhonetic
+    progArgs['ninjaPause'] = args.ninjaPause
+    progArgs['ttsEngine'] = args.ttsEngine
+    progArgs['ttsVoice'] = args.ttsVoice
+    progArgs['buildIndex'] = args.buildIndex
+    progArgs['batchFile'] = args.batchFile
+    progArgs['batchDir'] = args.batchDir
+    progArgs['batchJobs'] = args.batchJobs
+    progArgs['batchFormat'] = args.batchFormat
+    progArgs['cwEngine'] = args.cwEngine
+    progArgs['waveCacheMB'] = args.waveCacheMB
+    progArgs['waveCacheDisk'] = args.waveCacheDisk
+    progArgs['cacheStats'] = args.cacheStats
+    progArgs['timing'] = args.timing
+    progArgs['wordDist'] = args.wordDist
+    progArgs['weakChars'] = args.weakChars
+    progArgs['withReplacement'] = args.withReplacement
+    progArgs['copyCheck'] = args.copyCheck
+    progArgs['callStructure'] = args.callStructure
+    progArgs['callDistrict'] = args.callDistrict
+    progArgs['callState'] = args.callState.upper() if args.callState else None
+    progArgs['callCountry'] = args.callCountry
+    progArgs['callPrefix'] = args.callPrefix.upper() if args.callPrefix else None
+    progArgs['srs'] = args.srs
+    progArgs['srsFile'] = args.srsFile
+    progArgs['ninjaSelfGrade'] = args.ninjaSelfGrade
+    progArgs['outputFormat'] = args.outputFormat
+    progArgs['noiseBandwidth'] = args.noiseBandwidth
+    progArgs['qsbDepth'] = args.qsbDepth
+    progArgs['qsbRate'] = args.qsbRate
+    progArgs['chirp'] = args.chirp
+    progArgs['drift'] = args.drift
+    progArgs['qrm'] = args.qrm
+    progArgs['pileup'] = args.pileup
+    progArgs['outputFile'] = args.outputFile
     if args.wordFile:
         progArgs['wordFile'] = args.wordFile
 
@@ -227,24 +386,58 @@ def processArguments(args):
     return progArgs
 
 
-def checkHelperApplications():
-    # Ensure that the required applications that are used by
-    # cwwords.py are installed on the system.
-    error = False
-    if not shutil.which("/usr/bin/ebook2cw"):
-        print("ERROR: the program 'ebook2cw' is not available on "
-              "this system, exiting...")
-        error = True
+# Phases of the run and the time at which each ended, for the
+# --timing report
+TIMING = []
+
+def markTiming(phase):
+    TIMING.append((phase, time.perf_counter()))
 
-    if not shutil.which("morse"):
-        print("ERROR: the program 'morse' is not available on "
-              "this system, exiting...")
-        error = True
 
-    if not shutil.which("mpg123"):
-        print("ERROR: the program 'mpg123' is not available on "
-              "this system, exiting...")
-        error = True
+def printTiming():
+    print("---------------------------------------------------------")
+    print("Timing (msec):")
+    prevTime = START_TIME
+    for phase, endTime in TIMING:
+        print(f"  {phase:<16} {1000 * (endTime - prevTime):8.1f} "
+              f"{1000 * (endTime - START_TIME):8.1f}")
+        prevTime = endTime
+
+
+# platform.system() is 'Darwin' on macOS
+def isMacOS():
+    return platform.system() == 'Darwin'
+
+
+def checkHelperApplications(progArgs):
+    # Ensure that the required applications that are used by
+    # cwwords.py are installed on the system. Only the programs of
+    # the selected backends are checked, the built-in keyer doesn't
+    # need any external programs and they are only used for playing.
+    error = False
+    if (progArgs['cwEngine'] == 'ebook2cw' and progArgs['play'] and
+        not progArgs['ninjaMode']):
+        if isMacOS():
+            if not shutil.which("morse"):
+                print("ERROR: the program 'morse' is not available on "
+                      "this system, exiting...")
+                error = True
+        elif not shutil.which("/usr/bin/ebook2cw"):
+            print("ERROR: the program 'ebook2cw' is not available on "
+                  "this system, exiting...")
+            error = True
+
+        if platform.system() == 'Linux' and not shutil.which("mpg123"):
+            print("ERROR: the program 'mpg123' is not available on "
+                  "this system, exiting...")
+            error = True
+
+    if progArgs['ninjaMode'] and progArgs['ttsEngine'] == 'espeak':
+        import tts
+        if not tts.findEspeak():
+            print("ERROR: the program 'espeak-ng' is not available on "
+                  "this system, exiting...")
+            error = True
 
     if error:
         sys.exit(1)
@@ -293,6 +486,26 @@ def getCWOpsChars(numChars):
     return CWOPS_CHARS[:numChars]
 
 
+def getCharList(progArgs):
+    if progArgs['numKochChars'] is not None:
+        return getKochChars(progArgs['numKochChars'])
+    elif progArgs['numCWOpsChars'] is not None:
+        return getCWOpsChars(progArgs['numCWOpsChars'])
+    else:
+        print("ERROR: the number of characters to use must be set with "
+              "'--koch-chars' or '--cwops-chars', exiting...")
+        sys.exit(1)
+
+
+# Return the name of the character order selected by the arguments,
+# this is a key of CHAR_ORDERS
+def getCharOrder(progArgs):
+    if progArgs['numKochChars'] is not None:
+        return 'koch'
+    else:
+        return 'cwops'
+
+
 def displayParameters(args, charList):
     if args['numKochChars'] is not None:
         text = f"Num Koch chars: {args['numKochChars']}\n"
@@ -318,6 +531,8 @@ def displayParameters(args, charList):
 # is opened using the lzma module which decompresses the file so that
 # it can be processed normally.
 def getUSCallsigns(args):
+    import lzma
+
     callLst = []
 
     if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
@@ -394,44 +609,155 @@ def getForeignCallsigns(args):
     
 def filterCallsigns(charList, calllst):
     # Remove callsigns that contain characters not in the character list
-    tmpLst = []
-    for call in calllst:
-        for c in call:
-            cl = c.lower()
-            if cl not in charList:
-                break
-            else:
-                pass
-        else:
-            tmpLst.append(call)
+    charSet = set(charList)
+
+    return [call for call in calllst if cwtext.canSend(call, charSet)]
+
+
+
+# Build the callsign index from the U.S. and foreign callsign
+# files. Only the callsigns are kept, deduplicated and sorted, so that
+# the index is a small fraction of the size of the source files. The
+# callsigns are ranked by the Koch and CW Ops character orders so that
+# the callsigns for a character set are a range query. This is run
+# once, and again only when one of the source files changes.
+def buildCallsignIndex(progArgs):
+    import qso
+
+    usCalls = {}
+    usStations = {}
+    for x in getUSCallsigns(progArgs):
+        callsign = x['callsign'].strip()
+        if callsign and callsign not in usCalls:
+            usCalls[callsign] = callfeatures.callsignFeatures(
+                callsign, state=x['state'].strip(), country=US_COUNTRY, us=True)
+            usStations[callsign] = qso.stationRecord(x['firstName'], x['fullName'],
+                                                     x['city'], x['state'])
+
+    foreignCalls = {}
+    foreignStations = {}
+    for x in getForeignCallsigns(progArgs):
+        callsign = x['callsign'].strip()
+        if callsign and callsign not in foreignCalls:
+            foreignCalls[callsign] = callfeatures.callsignFeatures(
+                callsign, country=x['country'].strip())
+            foreignStations[callsign] = qso.stationRecord(x['firstName'], x['fullName'],
+                                                          x['city'], x['country'])
+
+    arrays = {}
+    for name, calls, stations in [('us', usCalls, usStations),
+                                  ('foreign', foreignCalls, foreignStations)]:
+        callLst = sorted(calls)
+        cwindex.addRankedStrings(arrays, name, callLst, CHAR_ORDERS)
+        callfeatures.addFeatureTable(arrays, name, [calls[c] for c in callLst],
+                                     CHAR_ORDERS)
+        qso.addStationTable(arrays, name, [stations[c] for c in callLst])
+
+    return {'corpus': 'callsigns'}, arrays
+
+
+def getCallsignIndex(progArgs):
+    if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
+        usFile = os.path.join(sys._MEIPASS, US_CALL_FILE)
+        foreignFile = os.path.join(sys._MEIPASS, FOREIGN_CALL_FILE)
+    else:
+        usFile = os.path.join(SCRIPT_DIR, US_CALL_FILE)
+        foreignFile = os.path.join(SCRIPT_DIR, FOREIGN_CALL_FILE)
 
-    return tmpLst
+    indexFile = os.path.join(cwindex.getCacheDir(), CALL_INDEX_FILE)
 
+    return cwindex.openIndex(indexFile, [usFile, foreignFile],
+                             lambda: buildCallsignIndex(progArgs),
+                             schema=INDEX_SCHEMA, rebuild=progArgs['buildIndex'])
 
 
-def getCallsignList(progArgs, charList):
-    tmpLst = []
+# Complete ranked word lists (with their original positions and rank
+# bounds) that have been loaded from the indexes, by word file and
+# character order. These are only loaded by preloadCorpus(), for batch
+# runs, so the worker processes share them copy-on-write rather than
+# each reading the indexes.
+CORPUS_LISTS = {}
 
-    usDataLst = getUSCallsigns(progArgs)
-    usLst = []
-    for x in usDataLst:
-        usLst.append(x['callsign'])
+def loadRankedList(index, name, order):
+    view = f"{name}.{order}"
+    return (index.strings(view), array.array('I', index.array(f"{view}.pos")),
+            list(index.array(f"{view}.bounds")))
 
-    usLst = filterCallsigns(charList, usLst)
-    
-    foreignDataLst = getForeignCallsigns(progArgs)
-    foreignLst = []
-    for x in foreignDataLst:
-        foreignLst.append(x['callsign'])
-        
-    foreignLst = filterCallsigns(charList, foreignLst)
-    
-    return usLst, foreignLst
 
+# Return the strings, and their original positions, that only use the
+# first 'numChars' characters of the order
+def sliceRankedList(rankedList, numChars):
+    strings, positions, bounds = rankedList
+    numChars = min(max(numChars, 0), len(bounds) - 1)
+
+    return strings[:bounds[numChars]], positions[:bounds[numChars]]
+
+
+def preloadCorpus(progArgs):
+    order = getCharOrder(progArgs)
+
+    if progArgs['qsos']:
+        # the station tables are memory mapped, like the feature tables
+        getQSOStations(progArgs)
+    elif progArgs['callsigns']:
+        # the callsign feature tables are memory mapped, the workers
+        # share the mapping
+        getCallsignFeatures(progArgs)
+    else:
+        key = ('words', getWordFile(progArgs), order)
+        if key not in CORPUS_LISTS:
+            index = getWordIndex(progArgs)
+            CORPUS_LISTS[key] = loadRankedList(index, 'words', order)
+            index.close()
+
+        # the sampler of the session's words is built once and shared,
+        # unless its weak characters come from the review database,
+        # which is only opened by the worker processes
+        if not progArgs['srs']:
+            getWordSampler(progArgs, getCharList(progArgs))
+
+
+# The U.S. and foreign callsign feature tables by character order,
+# the callsign index is kept open for the run
+CALL_FEATURES = {}
+
+def getCallsignFeatures(progArgs):
+    order = getCharOrder(progArgs)
+
+    if order not in CALL_FEATURES:
+        index = getCallsignIndex(progArgs)
+        CALL_FEATURES[order] = (callfeatures.FeatureTable(index, 'us', order),
+                                callfeatures.FeatureTable(index, 'foreign', order))
+
+    return CALL_FEATURES[order]
+
+
+# The U.S. and foreign station tables, for QSOs, by character order
+QSO_STATIONS = {}
+
+def getQSOStations(progArgs):
+    import qso
+
+    order = getCharOrder(progArgs)
+
+    if order not in QSO_STATIONS:
+        index = getCallsignIndex(progArgs)
+        QSO_STATIONS[order] = (qso.StationTable(index, 'us', order),
+                               qso.StationTable(index, 'foreign', order))
+
+    return QSO_STATIONS[order]
+
+
+# The callsign features selected by the arguments
+def getCallsignFilter(progArgs):
+    return {'structure': progArgs['callStructure'],
+            'district': progArgs['callDistrict'],
+            'state': progArgs['callState'],
+            'country': progArgs['callCountry'],
+            'prefix': progArgs['callPrefix']}
 
-def getWordList(progArgs, charList):
-    wordLst = []
 
+def getWordFile(progArgs):
     if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
         # Running from the pyinstaller bundle, so have to juggle the
         # file name of the common words file. If the 'wordFile' set in
@@ -455,7 +781,12 @@ def getWordList(progArgs, charList):
         else:
             wordFile = os.path.join(SCRIPT_DIR, WORD_FILE)
 
-    done = False
+    return wordFile
+
+
+def buildWordIndex(wordFile):
+    wordLst = []
+
     with open(wordFile, 'r') as fileobj:
         for line in fileobj:
             line = line.strip()
@@ -467,31 +798,83 @@ def getWordList(progArgs, charList):
 
             word = lst[0].strip()
             word = word.lower()
+            wordLst.append(word)
 
-            for c in word:
-                # if (c not in charList) and (c.lower() not in charList):
-                if c not in charList:
-                    break
-                else:
-                    pass
-            else:
-                wordLst.append(word)
+    # words are kept in file order within each rank, the word files
+    # are ordered by frequency of use
+    arrays = {}
+    cwindex.addRankedStrings(arrays, 'words', wordLst, CHAR_ORDERS)
 
-    return wordLst
+    return {'corpus': 'words'}, arrays
+
+
+# Each word file has its own index. The built-in word file is
+# extracted to a new temporary directory on every run of the
+# pyinstaller bundle, so its index is named by the relative path of
+# the file rather than its absolute path.
+def getWordIndex(progArgs):
+    wordFile = getWordFile(progArgs)
+
+    if wordFile.endswith(WORD_FILE):
+        key = WORD_FILE
+    else:
+        key = os.path.abspath(wordFile)
+    indexName = f"{WORD_INDEX_BASE}-{hashlib.sha1(key.encode()).hexdigest()[:16]}.idx"
+    indexFile = os.path.join(cwindex.getCacheDir(), indexName)
+
+    return cwindex.openIndex(indexFile, [wordFile],
+                             lambda: buildWordIndex(wordFile),
+                             schema=INDEX_SCHEMA, rebuild=progArgs['buildIndex'])
+
+
+# Return the words that can be sent with the character list, and the
+# rank of each word in the word file
+def getWordList(progArgs, charList):
+    key = ('words', getWordFile(progArgs), getCharOrder(progArgs))
+    if key in CORPUS_LISTS:
+        return sliceRankedList(CORPUS_LISTS[key], len(charList))
 
+    index = getWordIndex(progArgs)
+    wordLst = index.rankedStrings('words', getCharOrder(progArgs), len(charList))
+    rankLst = index.rankedPositions('words', getCharOrder(progArgs), len(charList))
+    index.close()
 
-def applyMinMax(progArgs, lst):
+    return wordLst, rankLst
+
+
+def applyMinMax(progArgs, lst, rankLst):
     wordLst = []
+    wordRankLst = []
 
-    for word in lst:
+    for word, rank in zip(lst, rankLst):
         if len(word) < progArgs['minWordLen']:
             pass
         elif len(word) > progArgs['maxWordLen']:
             pass
         else:
             wordLst.append(word)
+            wordRankLst.append(rank)
+
+    return wordLst, wordRankLst
+
 
-    return wordLst
+# The word samplers by the parameters that select and weight the
+# words, each is built once per run (or batch)
+WORD_SAMPLERS = {}
+
+def getWordSampler(progArgs, charList):
+    weakChars = getWeakChars(progArgs) if progArgs['wordDist'] == 'weak' else ''
+    key = (getWordFile(progArgs), getCharOrder(progArgs), len(charList),
+           progArgs['minWordLen'], progArgs['maxWordLen'], progArgs['wordDist'],
+           weakChars)
+
+    if key not in WORD_SAMPLERS:
+        wordLst, rankLst = getWordList(progArgs, charList)
+        wordLst, rankLst = applyMinMax(progArgs, wordLst, rankLst)
+        WORD_SAMPLERS[key] = sampler.getSampler(wordLst, rankLst, progArgs['wordDist'],
+                                                weakChars)
+
+    return WORD_SAMPLERS[key]
 
 
 def removeAbbreviations(progArgs, lst):
@@ -508,18 +891,164 @@ def removeAbbreviations(progArgs, lst):
         return lst
 
 
-def generateCWSoundFile(progArgs, wordLst):
-    words = ""
+def getNoiseSNR(progArgs):
+    if progArgs['noise'] and float(progArgs['noise']) != 0:
+        return float(progArgs['noise'])
+    else:
+        return None
 
-    # write word list to temporary file for input to 'ebook2cw' program
-    with open(CW_INPUT_FILE, 'w') as fileobj:
-        for word in wordLst:
-            fileobj.write(f"{word}\n")
 
-    for file in os.listdir('/tmp'):
-        if file.find(CW_OUTPUT_BASE) > -1 :
-            absFile = os.path.join("/tmp", file)
-            os.remove(absFile)
+# All of the keyers of a run share one waveform cache, so characters
+# and words rendered with the same settings are only rendered once.
+WAVEFORM_CACHE = None
+
+def getWaveformCache(progArgs):
+    import keyer
+    global WAVEFORM_CACHE
+
+    if WAVEFORM_CACHE is None:
+        if progArgs['waveCacheDisk']:
+            cacheDir = os.path.join(cwindex.getCacheDir(), WAVE_CACHE_DIR)
+        else:
+            cacheDir = None
+        WAVEFORM_CACHE = keyer.WaveformCache(progArgs['waveCacheMB'] * 1024 * 1024,
+                                             cacheDir=cacheDir)
+
+    return WAVEFORM_CACHE
+
+
+# Return the keyer of the session, 'noise' is false when the noise is
+# added by the channel simulation instead
+def getKeyer(progArgs, volume=None, noise=True):
+    import keyer
+
+    if volume is None:
+        volume = keyer.DEFAULT_VOLUME
+
+    return keyer.Keyer(progArgs['wpm'], farns=progArgs['farns'],
+                       extraWordSpace=progArgs['extraWordSpace'],
+                       freq=progArgs['freq'], volume=volume,
+                       noiseSNR=getNoiseSNR(progArgs) if noise else None,
+                       chirp=progArgs['chirp'], cache=getWaveformCache(progArgs))
+
+
+# Return the QRM stations of a session, each calling CQ with a callsign
+# of its own, at its own speed, pitch and strength near the sidetone.
+# 'gain' is the gain the keyer's audio has been turned down by.
+def getQRMStations(progArgs, cwKeyer, gain=1.0):
+    import channel
+    import keyer
+
+    usTable, foreignTable = getCallsignFeatures(progArgs)
+    callLst = (usTable.sample(progArgs['qrm'], len(KOCH_CHARS)) +
+               foreignTable.sample(progArgs['qrm'], len(KOCH_CHARS)))
+    random.shuffle(callLst)
+
+    stations = []
+    for call in callLst[:progArgs['qrm']]:
+        call = call.lower()
+        wpm = max(5, int(progArgs['wpm'] * random.uniform(0.7, 1.4)))
+        offset = random.choice([-1, 1]) * random.uniform(QRM_MIN_OFFSET, QRM_MAX_OFFSET)
+        volume = cwKeyer.volume * gain * random.uniform(0.2, 1.0)
+        qrmKeyer = keyer.Keyer(wpm, freq=max(cwKeyer.freq + offset, 100),
+                               sampleRate=cwKeyer.sampleRate, volume=volume,
+                               cache=cwKeyer.cache)
+        stations.append(channel.Station(qrmKeyer, [f"cq cq de {call} {call} k"],
+                                        delay=random.uniform(0, 5),
+                                        qsbDepth=progArgs['qsbDepth'],
+                                        qsbRate=progArgs['qsbRate']))
+
+    return stations
+
+
+# Return the channel simulation of a keyer session, or None for clean
+# CW. 'gain' is the gain the keyer's audio has been turned down by, the
+# noise and QRM are turned down with it to keep their levels relative
+# to the keyer's.
+def getChannel(progArgs, cwKeyer, gain=1.0):
+    import channel
+
+    snr = getNoiseSNR(progArgs)
+    if (snr is None and not progArgs['qsbDepth'] and not progArgs['drift'] and
+        not progArgs['qrm']):
+        return None
+
+    return channel.Channel(cwKeyer.freq, (cwKeyer.volume * gain) ** 2 / 2,
+                           cwKeyer.sampleRate,
+                           snr=snr, bandwidth=progArgs['noiseBandwidth'],
+                           qsbDepth=progArgs['qsbDepth'], qsbRate=progArgs['qsbRate'],
+                           drift=progArgs['drift'],
+                           stations=getQRMStations(progArgs, cwKeyer, gain))
+
+
+# Generate the CW for the word list with the built-in keyer. The audio
+# is returned for playing and is only written to a file if a sound
+# file was requested.
+def generateKeyerSound(progArgs, wordLst):
+    import keyer
+
+    cwKeyer = getKeyer(progArgs, noise=False)
+    samples = cwKeyer.renderText(wordLst)
+    cwChannel = getChannel(progArgs, cwKeyer)
+    if cwChannel is not None:
+        samples = cwChannel.process(samples)
+
+    if progArgs['soundFilename']:
+        keyer.writeSoundFile(progArgs['soundFilename'], samples, cwKeyer.sampleRate)
+
+    seconds = int(keyer.duration(len(samples), cwKeyer.sampleRate))
+    print(f"Total time: {seconds // 60:02d}:{seconds % 60:02d}")
+
+    return samples
+
+
+# Play the CW for the word list while it is being generated. Each word
+# is rendered into a bounded queue that is drained by a playback
+# thread, so the CW starts as soon as the first word is rendered
+# regardless of the length of the session. If a sound file was
+# requested the CW is also written to it.
+def streamCWSession(progArgs, wordLst):
+    import keyer
+    import playback
+
+    cwKeyer = getKeyer(progArgs, noise=False)
+    chunks = cwKeyer.iterWords(wordLst)
+    cwChannel = getChannel(progArgs, cwKeyer)
+    if cwChannel is not None:
+        chunks = cwChannel.chunks(chunks)
+
+    sinks = [playback.AudioSink(cwKeyer.sampleRate, continuous=cwChannel is not None)]
+    if progArgs['soundFilename']:
+        sinks.append(playback.openFileSink(progArgs['soundFilename'], cwKeyer.sampleRate))
+
+    stats = playback.streamChunks(chunks, playback.TeeSink(sinks))
+
+    seconds = int(keyer.duration(stats['samples'], cwKeyer.sampleRate))
+    print(f"Total time: {seconds // 60:02d}:{seconds % 60:02d}")
+
+
+# Generate the CW for the word list. With the external programs the
+# sound files are generated in the workspace directory 'workDir' (a
+# temporary directory of its own if not given) and the list of the
+# segment files is returned. If a sound file was requested the
+# segments are also copied to it.
+def generateCWSoundFile(progArgs, wordLst, workDir=None):
+    if progArgs['cwEngine'] == 'keyer':
+        return generateKeyerSound(progArgs, wordLst)
+
+    if workDir is None:
+        with tempfile.TemporaryDirectory(prefix='cwwords-') as workDir:
+            generateCWSoundFile(progArgs, wordLst, workDir)
+        return None
+
+    inputFile = os.path.join(workDir, CW_INPUT_BASE)
+    outputFile = os.path.join(workDir, CW_OUTPUT_BASE)
+
+    # write word list to the workspace for input to 'ebook2cw'
+    # program, with the prosigns it knows as their characters
+    with open(inputFile, 'w') as fileobj:
+        for word in wordLst:
+            fileobj.write(f"{cwtext.externalText(word)}\n")
 
     if progArgs['noise']:
         noiseInt = int(progArgs['noise'])
@@ -544,11 +1073,11 @@ def generateCWSoundFile(progArgs, wordLst):
         # use ebook2cw as there 
         cmd = (f"/usr/bin/ebook2cw -w {progArgs['wpm']} -e {progArgs['farns']} "
                f"-W {progArgs['extraWordSpace']} -f {progArgs['freq']} "
-               f"{noiseClause} -o {progArgs['soundFilename']} "
-               f"{CW_INPUT_FILE}")
-    elif platform.system() == 'MacOS':
+               f"{noiseClause} -o {outputFile} "
+               f"{inputFile}")
+    elif isMacOS():
         cmd = (f"/usr/bin/morse -f {progArgs['freq']} -w {progArgs['farns']} "
-               f"-F {progArgs['wpm']} < {CW_INPUT_FILE}")
+               f"-F {progArgs['wpm']} < {inputFile}")
     else:
         print(f"ERROR unknown OS: {platform.system()}, exiting...")
         sys.exit(1)
@@ -561,86 +1090,87 @@ def generateCWSoundFile(progArgs, wordLst):
         if re.search("^Total", line):
             print(line)
 
+    segmentFiles = sorted(os.path.join(workDir, file) for file in os.listdir(workDir)
+                          if file.startswith(CW_OUTPUT_BASE))
+
+    if progArgs['soundFilename']:
+        for segmentFile in segmentFiles:
+            suffix = os.path.basename(segmentFile)[len(CW_OUTPUT_BASE):]
+            shutil.copyfile(segmentFile, f"{progArgs['soundFilename']}{suffix}")
+
+    return segmentFiles
 
-def convertToPhonetic(word):
-    phoneticWord = ""
 
-    for char in word:
-        if char.isdigit():
-            phoneticWord += (char + "  ")
-        for elem in PHONETIC_CHARS:
-            if elem[0] == char:
-                phoneticWord += (elem[1] + "  ")
+# The speaker for ninja mode. Spoken words are cached on disk so a word
+# is only synthesized the first time it is spoken.
+def getSpeaker(progArgs):
+    import keyer
+    import tts
 
-    return phoneticWord
+    try:
+        engine = tts.getEngine(progArgs['ttsEngine'], progArgs['ttsVoice'])
+    except tts.TTSError as e:
+        print(f"ERROR: {e}, exiting...")
+        sys.exit(1)
+
+    cacheDir = os.path.join(cwindex.getCacheDir(), TTS_CACHE_DIR)
+    cache = keyer.WaveformCache(progArgs['waveCacheMB'] * 1024 * 1024, cacheDir=cacheDir)
+
+    return tts.Speaker(engine, cache, phoneticFunc=cwtext.phoneticText,
+                       spokenFunc=cwtext.spokenText)
 
     
-# Ninja mode is based on the Morse Code Ninja website CW training
-# method. It plays the CW for a word/phrase, then the word/phrase is
-# spoken, and then the CW is played again. Then an alert tone is
-# played to signal the next word/phrase sequence. 
-def executeNinjaMode(progArgs, wordLst):
-    # get the terminal width
-    rows, columns = subprocess.check_output(['stty', 'size']).decode().split()
-    columns = int(columns)         # convert to an integer
-    numChars = 0
-    print('')
+def getNinjaRenderer(progArgs):
+    import ninja
 
     if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
         toneFile = os.path.join(sys._MEIPASS, TONE_FILE)
     else:
         toneFile = os.path.join(SCRIPT_DIR, TONE_FILE)
 
+    cwKeyer = getKeyer(progArgs, volume=float(progArgs['ninjaCwVolume']))
+
     # alert tone to delineate word sequence
-    tone = pydub.AudioSegment.from_mp3(toneFile)
-    # reduce volume of alert tone
-    tone = tone - 12                  
-    play(tone)
+    tone = ninja.loadAlertTone(toneFile, cwKeyer.sampleRate)
 
-    print("")
-    for word in wordLst:
-        morseCmdLst = ['morse', f"-f {progArgs['freq']}", f"-v {progArgs['ninjaCwVolume']}",
-                       f"-w {progArgs['farns']}", f"-F {progArgs['wpm']}"]
-        # print(f"DEBUG: morseCmdLst = {morseCmdLst}")
-        proc = subprocess.Popen(morseCmdLst, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        try:
-            # print(f"DEBUG word: {word}")
-            output, errors = proc.communicate(input=word.encode(), timeout=10)
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            output, errors = proc.communicate()
-            print(f"ERROR: {errors}")
+    if progArgs['ninjaPause'] is not None:
+        pause = progArgs['ninjaPause']
+    else:
+        pause = ninja.DEFAULT_PAUSE
 
-        time.sleep(1)
+    return ninja.NinjaRenderer(cwKeyer, getSpeaker(progArgs), tone, pause=pause,
+                               phonetic=progArgs['ninjaCallPhonetic'])
 
-        if progArgs['ninjaCallPhonetic']:
-            phonWords = convertToPhonetic(word)
 
-        if progArgs['ninjaCallPhonetic']:
-            # Right now, I like the Canadian voice in gTTS
-            tts = gtts.gTTS(phonWords, lang='en-ca')
-        else:
-            tts = gtts.gTTS(word, lang='en-ca')
-            
-        tts.save(WORD_SND_FILE)
-        wordSnd = pydub.AudioSegment.from_mp3(WORD_SND_FILE)
-        play(wordSnd)
+# Ninja mode is based on the Morse Code Ninja website CW training
+# method. It plays the CW for a word/phrase, then the word/phrase is
+# spoken, and then the CW is played again. Then an alert tone is
+# played to signal the next word/phrase sequence. The sequences of the
+# next few words are rendered while the current one plays. If a sound
+# file is given, the session is rendered to the file, as fast as the
+# sequences can be rendered, rather than played.
+def executeNinjaMode(progArgs, wordLst):
+    import keyer
+    import ninja
+    import playback
 
-        proc = subprocess.Popen(morseCmdLst, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        try:
-            output, errors = proc.communicate(input=word.encode(), timeout=10)
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            output, errors = proc.communicate()
-            print(f"ERROR: {errors}")
-        
-        time.sleep(1)
-    
+    # get the terminal width, this also works when not run from a
+    # terminal (e.g. batch generation)
+    columns = shutil.get_terminal_size().columns
+    numChars = 0
+    print('')
+
+    renderer = getNinjaRenderer(progArgs)
 
-        play(tone)
-        time.sleep(1)
+    # chunk 0 is the lead-in alert tone, then one chunk per word,
+    # display each word once its sequence has played
+    def displayWord(chunkNum):
+        nonlocal numChars
+        if chunkNum == 0:
+            print("")
+            return
+
+        word = wordLst[chunkNum - 1]
         numChars += len(word) + 1
         if numChars >= columns:
             endChar = '\n'
@@ -648,41 +1178,91 @@ def executeNinjaMode(progArgs, wordLst):
         else:
             endChar = ' '
         print(f"{word} ", end=endChar, flush=True)
+
+    sampleRate = renderer.cwKeyer.sampleRate
+    if progArgs['soundFilename']:
+        sink = playback.openFileSink(progArgs['soundFilename'], sampleRate)
+        lookahead = ninja.RENDER_LOOKAHEAD
+    else:
+        sink = playback.AudioSink(sampleRate)
+        lookahead = ninja.LOOKAHEAD
+
+    stats = playback.streamChunks(ninja.iterSession(wordLst, renderer, lookahead),
+                                  sink, onChunk=displayWord)
         
     print('\n')
 
+    if progArgs['soundFilename']:
+        seconds = int(keyer.duration(stats['samples'], sampleRate))
+        print(f"Ninja session ({seconds // 60:02d}:{seconds % 60:02d}) written to: "
+              f"{progArgs['soundFilename']}")
+
 
         
+# Generate pileups of the callsigns, --pileup callers at a time, with
+# the channel simulation, then show the answer key
+def executePileup(progArgs, callLst):
+    import keyer
+    import pileup
+
+    cwKeyer = getKeyer(progArgs, noise=False)
+    # with noise the callers are kept inside the noise band
+    pitchSpread = pileup.PITCH_SPREAD
+    if getNoiseSNR(progArgs) is not None:
+        pitchSpread = min(pitchSpread, progArgs['noiseBandwidth'] / 2)
+    generator = pileup.PileupGenerator(progArgs['wpm'], cwKeyer.freq, cwKeyer.sampleRate,
+                                       cwKeyer.volume, cwKeyer.cache, pitchSpread)
+    rounds = pileup.splitRounds(removeDuplicates(callLst), progArgs['pileup'])
+    samples, gain, answerKey = generator.generate(rounds, getNoiseSNR(progArgs))
+    markTiming('render pileups')
+
+    cwChannel = getChannel(progArgs, cwKeyer, gain)
+    if cwChannel is not None:
+        samples = cwChannel.process(samples)
+
+    seconds = int(keyer.duration(len(samples), cwKeyer.sampleRate))
+    print(f"Pileups: {len(rounds)}, total time: {seconds // 60:02d}:{seconds % 60:02d}")
+
+    if progArgs['soundFilename']:
+        keyer.writeSoundFile(progArgs['soundFilename'], samples, cwKeyer.sampleRate)
+    if progArgs['play']:
+        keyer.playSamples(samples, cwKeyer.sampleRate)
+
+    outputAnswerKey(progArgs, answerKey)
+
+
+# Generate and play the CW for the word list with the external
+# programs, in a private workspace that is removed afterwards
+def playExternalSession(progArgs, wordLst):
+    with tempfile.TemporaryDirectory(prefix='cwwords-') as workDir:
+        segmentFiles = generateCWSoundFile(progArgs, wordLst, workDir)
+
+        time.sleep(2)
+        playCWSoundFile(progArgs, segmentFiles)
+
+
 # remove duplicate words just for display purposes, no need to show the repeated
-# words or callsigns.
+# words or callsigns. The first occurrence of each word is kept, in order.
 def removeDuplicates(lst):
-    finalLst = []
-    for elem in lst:
-        if elem not in finalLst:
-            finalLst.append(elem)
-
-    return finalLst
+    return list(dict.fromkeys(lst))
     
 
-def playCWSoundFile(progArgs, wordLst):
+# Play the segment files generated by generateCWSoundFile()
+def playCWSoundFile(progArgs, segmentFiles):
 
     # Use mpg123 to play sounds on Linux
     if platform.system() == 'Linux':
-        for file in os.listdir('/tmp'):
-            if file.find(CW_OUTPUT_BASE) > -1:
-                absFile = os.path.join("/tmp", file)
-                cmd = f"/usr/bin/mpg123 {absFile}"
-
-                proc = subprocess.run(cmd, shell=True, encoding='utf-8',
-                                      stdout=subprocess.PIPE,
-                                      stderr=subprocess.PIPE)
-                if proc.returncode:
-                    print(f"ERROR: mpg123 return: {proc.returncode}")
-                else:
-                    pass
+        for segmentFile in segmentFiles:
+            cmd = f"/usr/bin/mpg123 {segmentFile}"
+
+            proc = subprocess.run(cmd, shell=True, encoding='utf-8',
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE)
+            if proc.returncode:
+                print(f"ERROR: mpg123 return: {proc.returncode}")
             else:
                 pass
-    elif platform.system() == 'MacOS':
+    elif isMacOS():
         # On MacOS using the 'morse' program, which plays its own
         # sound
         pass
@@ -691,81 +1271,335 @@ def playCWSoundFile(progArgs, wordLst):
               "been worked out yet")
 
 
+# Return the lines of the generated words, wrapped to the terminal
+# width, one line per word for QSOs
+def wrapGeneratedText(progArgs, wordLst, columns):
+    lines = []
+    line = ''
+    for word in removeDuplicates(wordLst):
+        if word == 'vvvv':
+            continue
+
+        if not progArgs['words']:
+            word = f"{word:6s}"
+
+        if progArgs['qsos']:
+            lines.append(word)
+        elif line and len(line) + 1 + len(word) >= columns:
+            lines.append(line.rstrip())
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+
+    if line:
+        lines.append(line.rstrip())
+
+    return lines
+
+
 def displayGeneratedText(progArgs, wordLst):
     # get the terminal width
-    rows, columns = subprocess.check_output(['stty', 'size']).decode().split()
-    columns = int(columns)
+    columns = shutil.get_terminal_size().columns
 
+    # the text is built in one buffer and printed at once
     if progArgs['words']:
-        print("\nWords Generated:")
+        text = ["\nWords Generated:"]
+    elif progArgs['qsos']:
+        text = ["\nQSOs Generated:"]
     else:
-        print("\nCallsigns Generated:")
-        
-    print("---------------------------------------------------------")
-    numChars = 0
-    rwordLst = removeDuplicates(wordLst)
-    for index, word in enumerate(rwordLst):
-        # print(f"word list: {index}  {word}")
-        if progArgs['qsos']:
-            endChar = "\n"
-        else:
-            endChar = " "
-        
-        if word == 'vvvv':
-            pass
-        else:
-            if progArgs['words']:
-                numChars += len(word) + 1
-            else:
-                numChars += 6 + 1
-                
-            numNextChars = numChars + len(rwordLst[index])
-                                 
-            if numNextChars >= columns:       # print a newline if more chars than
-                endChar = '\n'                # terminal width
-                numChars = 0
-
-            if progArgs['words']:
-                print(f"{word}", end=endChar)
-            else:
-                print(f"{word:6s}", end=endChar)
+        text = ["\nCallsigns Generated:"]
+    text.append("---------------------------------------------------------")
+    text += wrapGeneratedText(progArgs, wordLst, columns)
+    text.append("---------------------------------------------------------")
 
-    print("")
-    print("---------------------------------------------------------")
+    numChars = sum(cwtext.numChars(word) for word in wordLst if word != 'vvvv')
+    text.append(f"total characters: {numChars}")
 
-    numChars = 0
+    print('\n'.join(text))
+
+
+# Return the generated words as JSON or CSV, each different word with
+# the number of times it is sent
+def formatGeneratedText(progArgs, wordLst, fmt):
+    counts = {}
     for word in wordLst:
         if word != 'vvvv':
-            numChars += len(word)
+            counts[word] = counts.get(word, 0) + 1
+
+    if fmt == 'json':
+        import json
+        if progArgs['words']:
+            kind = 'words'
+        elif progArgs['qsos']:
+            kind = 'qsos'
+        else:
+            kind = 'callsigns'
+        data = {'type': kind,
+                'words': [{'word': word, 'count': count}
+                          for word, count in counts.items()],
+                'totalCharacters': sum(cwtext.numChars(word) * count
+                                       for word, count in counts.items())}
+        return json.dumps(data, indent=2) + '\n'
+    elif fmt == 'csv':
+        import csv
+        import io
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        writer.writerow(['word', 'count'])
+        writer.writerows(counts.items())
+        return buf.getvalue()
+    else:
+        return '\n'.join(wrapGeneratedText(progArgs, wordLst, 80)) + '\n'
+
 
-    print(f"total characters: {numChars}")
+# Write the formatted output of the session to the --output-file, or
+# else to stdout
+def writeOutput(progArgs, text):
+    if progArgs['outputFile']:
+        try:
+            with open(progArgs['outputFile'], 'w') as fileobj:
+                fileobj.write(text)
+        except OSError as e:
+            print(f"ERROR: can't write output file {progArgs['outputFile']}: {e}")
+            sys.exit(1)
+    else:
+        # stdout of the run is redirected to stderr by main(), the
+        # output goes to the original stdout
+        sys.__stdout__.write(text)
+        sys.__stdout__.flush()
+
+
+# Output the generated words: displayed as text, or in the JSON/CSV
+# --output-format on stdout, and/or written to the --output-file.
+# 'display' is false for the modes that don't display the text.
+def outputGeneratedText(progArgs, wordLst, display=True):
+    fmt = progArgs['outputFormat']
+
+    if progArgs['outputFile'] or fmt != 'text':
+        writeOutput(progArgs, formatGeneratedText(progArgs, wordLst, fmt))
+
+    if display and (progArgs['outputFile'] or fmt == 'text'):
+        displayGeneratedText(progArgs, wordLst)
+
+
+# Output the answer key of a pileup session, like the generated words
+def outputAnswerKey(progArgs, answerKey):
+    import pileup
+
+    fmt = progArgs['outputFormat']
+    if fmt == 'json':
+        import json
+        text = json.dumps([{field: caller[field] for field in pileup.ANSWER_KEY_FIELDS}
+                           for caller in answerKey], indent=2) + '\n'
+    elif fmt == 'csv':
+        import csv
+        import io
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        writer.writerow(pileup.ANSWER_KEY_FIELDS)
+        for caller in answerKey:
+            writer.writerow([caller[field] for field in pileup.ANSWER_KEY_FIELDS])
+        text = buf.getvalue()
+    else:
+        text = pileup.formatAnswerKey(answerKey) + '\n'
+
+    if progArgs['outputFile'] or fmt != 'text':
+        writeOutput(progArgs, text)
+
+    if progArgs['outputFile'] or fmt == 'text':
+        numAudible = sum(1 for caller in answerKey if caller['audible'])
+        print("\nPileup answer key:")
+        print("---------------------------------------------------------")
+        print(pileup.formatAnswerKey(answerKey))
+        print("---------------------------------------------------------")
+        print(f"callers: {len(answerKey)}, audible: {numAudible}")
     
     
 
-def generateCallsigns(progArgs, charList):
-    print('Generating callsigns...')
-    usLst, foreignLst = getCallsignList(progArgs, charList)
+# The spaced repetition review database of the run, opened when first
+# needed
+REVIEW_DB = None
+
+def getReviewDatabase(progArgs):
+    import srs
+    global REVIEW_DB
+
+    if REVIEW_DB is None:
+        REVIEW_DB = srs.openReviewDatabase(progArgs['srsFile'])
+
+    return REVIEW_DB
+
+
+# The kind of the items of a session in the review database
+def getReviewKind(progArgs):
+    if progArgs['callsigns']:
+        return 'call'
+    else:
+        return 'word'
+
+
+# With spaced repetition, the words or callsigns that are due for
+# review, and can be sent with the character list, take the place of
+# some of the newly selected ones
+def addDueItems(progArgs, itemLst, charList):
+    if not progArgs['srs']:
+        return itemLst
+
+    kind = getReviewKind(progArgs)
+    chars = set(charList)
+
+    def accept(item):
+        if (kind == 'word' and
+            not progArgs['minWordLen'] <= len(item) <= progArgs['maxWordLen']):
+            return False
+        return cwtext.canSend(item, chars)
+
+    dueLst = getReviewDatabase(progArgs).dueItems(kind, progArgs['totalWords'], accept)
+    print(f"Due for review: {len(dueLst)}")
+
+    dueSet = set(dueLst)
+    newLst = [item for item in itemLst if item not in dueSet]
+    itemLst = dueLst + newLst[:max(len(itemLst) - len(dueLst), 0)]
+    random.shuffle(itemLst)
+
+    return itemLst
+
+
+# The characters to practice more with the 'weak' word distribution,
+# those given with '--weak-chars' or, with spaced repetition, the
+# characters that have been hardest to copy
+def getWeakChars(progArgs):
+    if progArgs['weakChars']:
+        return progArgs['weakChars']
+    elif progArgs['srs']:
+        return ''.join(getReviewDatabase(progArgs).weakItems('char', WEAK_CHARS))
+    else:
+        return ''
+
 
-    rnum = random.randint(60, 101) / 100
+# After a ninja session the user enters the numbers of the words (or
+# callsigns) that they missed, the rest are recorded as copied
+def selfGradeSession(progArgs, wordLst):
+    import srs
+
+    itemLst = removeDuplicates(wordLst)
+    for num, item in enumerate(itemLst, 1):
+        print(f"{num:3d}: {item}")
+
+    while True:
+        ans = input("Numbers of the missed words (blank for none): ")
+        try:
+            missed = {int(num) for num in ans.replace(',', ' ').split()}
+        except ValueError:
+            continue
+        if all(1 <= num <= len(itemLst) for num in missed):
+            break
+
+    results = []
+    for num, item in enumerate(itemLst, 1):
+        grade = srs.GRADE_FAIL if num in missed else srs.GRADE_PASS
+        results.append((item, grade, None))
+
+    getReviewDatabase(progArgs).recordResults(getReviewKind(progArgs), results)
+    print(f"Recorded {len(itemLst)} results, {len(missed)} missed")
+
+
+# Grade a copied word for spaced repetition by its number of errors
+def gradeCopy(distance, copied):
+    import srs
+
+    if not copied:
+        return srs.GRADE_FAIL
+    elif distance == 0:
+        return srs.GRADE_PERFECT
+    elif distance == 1:
+        return srs.GRADE_HARD
+    else:
+        return srs.GRADE_FAIL
+
+
+# Copy check mode plays the words with the streaming keyer while the
+# user types their copy, see copycheck.py. With spaced repetition the
+# results of the words and of each character are recorded.
+def executeCopyCheck(progArgs, wordLst):
+    import copycheck
+    import playback
+    import srs
+
+    if platform.system() == 'Windows' or not sys.stdin.isatty():
+        print("ERROR: copy check mode needs a (non Windows) terminal, exiting...")
+        sys.exit(1)
+
+    cwKeyer = getKeyer(progArgs, noise=False)
+    cwChannel = getChannel(progArgs, cwKeyer)
+    check = copycheck.CopyCheck(wordLst, cwKeyer.sampleRate, len(cwKeyer.wordGap),
+                                leadIn=1)
+
+    def play(onChunkStart):
+        chunks = cwKeyer.iterWords(['vvvv'] + wordLst)
+        if cwChannel is not None:
+            chunks = cwChannel.chunks(chunks)
+        chunks = check.chunks(chunks)
+        sink = playback.AudioSink(cwKeyer.sampleRate, continuous=cwChannel is not None)
+        playback.streamChunks(chunks, sink, onChunkStart=onChunkStart)
+
+    print("Copy each word as it is sent, end each word with a space "
+          "(ESC to stop)...\n")
+    with copycheck.RawTerminal() as terminal:
+        check.run(play, terminal)
+
+    print(check.report())
+
+    if progArgs['srs']:
+        wordResults = []
+        charResults = []
+        for result in check.results:
+            grade = gradeCopy(result['distance'], result['copied'])
+            wordResults.append((result['sent'], grade, result['response']))
+            for sent, copied in result['pairs']:
+                if sent:
+                    grade = srs.GRADE_PASS if sent == copied else srs.GRADE_FAIL
+                    charResults.append((sent, grade, None))
+
+        reviewDB = getReviewDatabase(progArgs)
+        reviewDB.recordResults(getReviewKind(progArgs), wordResults)
+        reviewDB.recordResults('char', charResults)
+
+
+# Select the callsigns for a session, with each callsign repeated as
+# requested. Returns an empty list if there are no callsigns that can
+# be sent with the character list.
+def selectCallsigns(progArgs, charList):
+    usTable, foreignTable = getCallsignFeatures(progArgs)
+    numChars = len(charList)
+    callFilter = getCallsignFilter(progArgs)
+
+    rnum = random.randint(60, 100) / 100
     fccnum = int(round(progArgs['totalWords'] * rnum))
     fornum = progArgs['totalWords'] - fccnum
-    print(f"U.S. calls: {fccnum}, Intl calls: {fornum}")
 
-    if usLst:
-        random.shuffle(usLst)
-        trunFccLst = usLst[:progArgs['totalWords']]
+    # all of the calls come from one table if there are no callsigns
+    # in the other that match
+    numUS = usTable.count(numChars, **callFilter)
+    numForeign = foreignTable.count(numChars, **callFilter)
+    if not numForeign:
+        fccnum, fornum = progArgs['totalWords'], 0
+    elif not numUS:
+        fccnum, fornum = 0, progArgs['totalWords']
 
-        if foreignLst:
-            trunFccLst = trunFccLst[:fccnum]
+    if numUS or numForeign:
+        print(f"U.S. calls: {fccnum}, Intl calls: {fornum}")
 
-            random.shuffle(foreignLst)
-            trunForeignLst = foreignLst[:fornum]
+        # the feature tables sample the callsigns without reading the
+        # whole lists
+        trunFccLst = usTable.sample(fccnum, numChars, **callFilter)
+        trunForeignLst = foreignTable.sample(fornum, numChars, **callFilter)
 
-            callsignLst = trunFccLst + trunForeignLst
+        callsignLst = trunFccLst + trunForeignLst
             
-            random.shuffle(callsignLst)
-        else:
-            callsignLst = trunFccLst
+        random.shuffle(callsignLst)
+
+        callsignLst = addDueItems(progArgs, callsignLst, charList)
 
         finalCallsignLst = []
         # if repeat is selected, repeat the words
@@ -777,213 +1611,200 @@ def generateCallsigns(progArgs, charList):
 
             finalCallsignLst = repeatLst
 
+        return finalCallsignLst
+    else:
+        return []
+
+
+def generateCallsigns(progArgs, charList):
+    print('Generating callsigns...')
+    finalCallsignLst = selectCallsigns(progArgs, charList)
+    markTiming('select callsigns')
+
+    if finalCallsignLst and progArgs['pileup']:
+        executePileup(progArgs, finalCallsignLst)
+    elif finalCallsignLst:
         if progArgs['ninjaMode']:
             executeNinjaMode(progArgs, finalCallsignLst)
+            if progArgs['ninjaSelfGrade'] and not progArgs['soundFilename']:
+                selfGradeSession(progArgs, finalCallsignLst)
+        elif progArgs['copyCheck']:
+            executeCopyCheck(progArgs, finalCallsignLst)
         elif progArgs['play']:
             # Add 'vvvv' to beginning of list
             finalCallsignLst.insert(0, 'vvvv')
-            generateCWSoundFile(progArgs, finalCallsignLst)
-            
-            time.sleep(2)
-            playCWSoundFile(progArgs, finalCallsignLst)
+            if progArgs['cwEngine'] == 'keyer':
+                streamCWSession(progArgs, finalCallsignLst)
+            else:
+                playExternalSession(progArgs, finalCallsignLst)
         else:
             pass
 
-        if not progArgs['ninjaMode']:
-            displayGeneratedText(progArgs, finalCallsignLst)
+        outputGeneratedText(progArgs, finalCallsignLst,
+                            not progArgs['ninjaMode'] and not progArgs['copyCheck'])
     else:
         print("No callsigns were found using the input parameters, ")
         print("increase number of characters in set.")
 
 
-def generateWords(progArgs, charList):
-    wordLst = getWordList(progArgs, charList)
-    wordLst = applyMinMax(progArgs, wordLst)
+# Select the words for a session. Returns an empty list if there are
+# no words that can be sent with the character list.
+def selectWords(progArgs, charList):
+    if progArgs['wordDist'] == 'weak' and not getWeakChars(progArgs):
+        print("ERROR: '--word-dist weak' needs the characters to practice "
+              "given with '--weak-chars' (or found by '--srs'), exiting...")
+        sys.exit(1)
+
+    wordSampler = getWordSampler(progArgs, charList)
+    wordLst = wordSampler.sample(progArgs['totalWords'],
+                                 replace=progArgs['withReplacement'])
 
-    if wordLst:
-        random.shuffle(wordLst)
-        trunWordLst = wordLst[:progArgs['totalWords']]
+    return addDueItems(progArgs, wordLst, charList)
 
+
+def generateWords(progArgs, charList):
+    trunWordLst = selectWords(progArgs, charList)
+    markTiming('select words')
+
+    if trunWordLst:
         if progArgs['ninjaMode']:
             executeNinjaMode(progArgs, trunWordLst)
+            if progArgs['ninjaSelfGrade'] and not progArgs['soundFilename']:
+                selfGradeSession(progArgs, trunWordLst)
+        elif progArgs['copyCheck']:
+            executeCopyCheck(progArgs, trunWordLst)
 
         elif progArgs['play']:
             # Add 'vvvv' to beginning of list
             trunWordLst.insert(0, 'vvvv')
-            generateCWSoundFile(progArgs, trunWordLst)
-            
-            time.sleep(2)
-            playCWSoundFile(progArgs, trunWordLst)
+            if progArgs['cwEngine'] == 'keyer':
+                streamCWSession(progArgs, trunWordLst)
+            else:
+                playExternalSession(progArgs, trunWordLst)
         else:
             pass
 
-        if not progArgs['ninjaMode']:
-            displayGeneratedText(progArgs, trunWordLst)
+        outputGeneratedText(progArgs, trunWordLst,
+                            not progArgs['ninjaMode'] and not progArgs['copyCheck'])
     else:
         print("No words were found using the input parameters, decrease word length")
         print("and/or increase number of characters in set.")
 
 
-def generateSkccNum():
-    rnum = random.randint(1, 25000)
-    return rnum
-    
-# def generateQSOs(progArgs, charList):
-#     print('Generating QSOs...')
-#     callLst = getLOTWLogCallsigns()
-#     print(f"num LOTW calls: {len(callLst)}")
-#     random.shuffle(callLst)
-#     dxStation = callLst[0]
-
-#     rnum = random.randint(0, 100)
-#     # if rnum > 50:
-#     if rnum > 100:      # modify so call is always TO me, not FROM me
-#         dxStation = callLst[0]
-#         deStation = MY_CALLSIGN
-#     else:
-#         dxStation = MY_CALLSIGN
-#         deStation = callLst[0]
-
-#     dxCall = f"{dxStation} DE {deStation}"
-#     deCall = f"{deStation} DE {dxStation}"
-
-#     qrz = QRZ(QRZ_USERNAME, QRZ_PASSWORD)
-#     dxCallData = qrz.callsignData(dxStation, verbose=False)
-#     dxOP = dxCallData['fname'].split(' ')[0]
-#     dxCity = dxCallData['addr2']
-#     if 'state' in dxCallData:
-#         dxLoc = dxCallData['state']
-#     else:
-#         dxLoc = dxCallData['country']
-
-#     deCallData = qrz.callsignData(deStation, verbose=False)
-#     deOP = deCallData['fname'].split(' ')[0]
-#     deCity = deCallData['addr2']
-#     if 'state' in deCallData:
-#         deLoc = deCallData['state']
-#     else:
-#         deLoc = deCallData['country']
-
-#     if deStation == MY_CALLSIGN:
-#         deSKCCNum = MY_SKCC_NUM
-#         dxSKCCNum = generateSkccNum()
-#     else:
-#         deSKCCNum = generateSkccNum()
-#         dxSKCCNum = MY_SKCC_NUM
-
-#     now = datetime.datetime.now()
-#     if 3 <= now.hour < 12:
-#         salutation = "GM"
-#     elif 12 <= now.hour < 20:
-#         salutation = "GE"
-#     else:
-#         salutation = "GN"
-
-#     deRead = random.randint(1, 5)
-#     deStrgth = random.randint(1, 9)
-#     deTone = random.randint(1, 9)
-#     dxRead = random.randint(1, 5)
-#     dxStrgth = random.randint(1, 9)
-#     dxTone = random.randint(1, 9)
-
-#     qsoLst = ['vvvv']
-#     qsoLine = []
-
-#     print(f"DEBUG qsoline: {progArgs['qsoLine']}")
-#     if progArgs['qsoLine'] == None:
-#         qsoLine = [1, 2, 3, 4, 5, 6]
-#     else:
-#         for item in progArgs['qsoLine'].split(','):
-#             qsoLine.append(int(item))
-    
-#     if qsoLine == []:
-#         qsoLine = [1, 2, 3, 4, 5, 6]
-
-#     # use a random number to decide on number of CQs
-#     if 1 in qsoLine:
-#         if dxRead < 2:
-#             qsoLst.append(f"CQ CQ CQ DE {deStation} {deStation} {deStation} K")
-
-#         else:
-#             qsoLst.append(f"CQ CQ DE {deStation} {deStation} K")
-
-#     #    if qsoLine == MAX_QSO_LINES or qsoLine == 2:
-#     if 2 in qsoLine:
-#         if dxRead < 2:
-#             qsoLst.append(f"{deStation} {deStation} DE "
-#                           f"{dxStation} {dxStation} <AR>")
-#         else:
-#             qsoLst.append(f"{deStation} DE "
-#                           f"{dxStation} {dxStation} <AR>")
-            
-#     if 3 in qsoLine:
-#         call      = f"{dxStation} DE {deStation}"
-#         greeting  = f"TNX FER CALL <BT>"
-#         signalRpt = f"UR RST {dxRead}{dxStrgth}{dxTone} {dxRead}{dxStrgth}{dxTone} <BT>"
-#         qthRpt    = f"HR QTH {deCity} {deLoc} {deCity} {deLoc} <BT>"
-#         nameRpt   = f"NAME {deOP} {deOP} SKCC {deSKCCNum} {deSKCCNum} HW? <BK>"
-#         qsoLst.append(f"{greeting} {signalRpt} {qthRpt} {nameRpt}")
-
-#     if 4 in qsoLine:
-#         call      = f"{deStation} DE {dxStation}"
-#         greeting  = f"R R {salutation} ES TNX FER CALL <BT>"
-#         signalRpt = f"UR RST {dxRead}{dxStrgth}{dxTone} {dxRead}{dxStrgth}{dxTone} <BT>"
-#         qthRpt    = f"HR QTH {deCity} {deLoc} {deCity} {deLoc} <BT>"
-#         nameRpt   = f"NAME {deOP} {deOP} SKCC {deSKCCNum} {deSKCCNum} HW? <BK>"
-#         qsoLst.append(f"{greeting} {signalRpt} {qthRpt} {nameRpt}")
-
-#     if 5 in qsoLine:
-#         call      = f"{dxStation} DE {deStation}"
-#         greeting  = f"TNX FER FB QSO {dxOP} <BT> HP CU AGN 73 <SK>"
-#         qsoLst.append(f"{greeting} {call} i")
-
-#     if 6 in qsoLine:
-#         call      = f"{deStation} DE {dxStation}"
-#         greeting  = f"TNX FER QSO {deOP} <BT> 73 <SK>"
-#         qsoLst.append(f"{greeting} DE {call} i")
-
-#     # print(f"DEBUG  qsoLst: {qsoLst}")
-
-#     generateCWSoundFile(progArgs, qsoLst)
-    
-#     if progArgs['play']:
-#         time.sleep(2)
-#         playCWSoundFile(progArgs, qsoLst)
-#     else:
-#         pass
+# Return the numbers of the QSO lines to generate, from --qso-line
+def getQSOLines(progArgs):
+    import qso
 
-#     displayGeneratedText(progArgs, qsoLst)
+    if not progArgs['qsoLine'] or not progArgs['qsoLine'].strip():
+        return qso.DEFAULT_QSO_LINES
 
-#     # print()
-#     # for line in qsoLst:
-#     #     print(line)
+    qsoLines = []
+    for item in progArgs['qsoLine'].split(','):
+        try:
+            line = int(item)
+        except ValueError:
+            line = None
+        if line not in qso.QSO_LINES:
+            print(f"ERROR: invalid QSO line: '{item.strip()}', the lines are "
+                  f"{', '.join(str(n) for n in qso.DEFAULT_QSO_LINES)}, exiting...")
+            sys.exit(1)
+        qsoLines.append(line)
+
+    return qsoLines
+
+
+# Select the lines of the QSOs of a session, QSOs between random
+# stations whose callsigns can be sent with the character list are
+# generated until there are --total-words lines. Returns an empty list
+# if there are no such stations.
+def selectQSOs(progArgs, charList):
+    import qso
+
+    usTable, foreignTable = getQSOStations(progArgs)
+    generator = qso.QSOGenerator(usTable, foreignTable, len(charList))
+    if not generator:
+        return []
+
+    qsoLines = getQSOLines(progArgs)
+    qsoLst = []
+    while len(qsoLst) < progArgs['totalWords']:
+        qsoLst += generator.generate(qsoLines)
+
+    return qsoLst
+
+
+def generateQSOs(progArgs, charList):
+    print('Generating QSOs...')
+    qsoLst = selectQSOs(progArgs, charList)
+    markTiming('select qsos')
+
+    if qsoLst:
+        if progArgs['play']:
+            # Add 'vvvv' to beginning of list
+            qsoLst.insert(0, 'vvvv')
+            if progArgs['cwEngine'] == 'keyer':
+                streamCWSession(progArgs, qsoLst)
+            else:
+                playExternalSession(progArgs, qsoLst)
+
+        outputGeneratedText(progArgs, qsoLst)
+    else:
+        print("No QSOs were generated using the input parameters, ")
+        print("increase number of characters in set.")
         
     
 
 def main():
+    markTiming('imports')
     args = parseArguments()
     progArgs = processArguments(args)
+    markTiming('arguments')
     # print(f"DEBUG: {progArgs}")
 
-    checkHelperApplications()
-    
     if progArgs['init'] is not None:
         initCwwords(progArgs)
         sys.exit(0)
 
-    if progArgs['numKochChars'] is not None:
-        charList = getKochChars(progArgs['numKochChars'])
-    elif progArgs['numCWOpsChars'] is not None:
-        charList = getCWOpsChars(progArgs['numCWOpsChars'])
+    if progArgs['buildIndex']:
+        getCallsignIndex(progArgs).close()
+        getWordIndex(progArgs).close()
+        sys.exit(0)
 
-    displayParameters(progArgs, charList)
-    
-    if progArgs['callsigns']:
-        generateCallsigns(progArgs, charList)
-    elif progArgs['words']:
-        generateWords(progArgs, charList)
-    # else:
-    #     generateQSOs(progArgs, charList)
+    if progArgs['batchFile']:
+        import batch
+        batch.runBatch(progArgs['batchFile'], progArgs['batchDir'],
+                       progArgs['batchJobs'], progArgs['batchFormat'])
+        sys.exit(0)
+
+    # with a JSON or CSV word list on stdout, the messages of the run
+    # go to stderr so the list can be piped to other tools
+    if progArgs['outputFormat'] != 'text' and not progArgs['outputFile']:
+        messages = contextlib.redirect_stdout(sys.stderr)
+    else:
+        messages = contextlib.nullcontext()
+
+    with messages:
+        checkHelperApplications(progArgs)
+        markTiming('helper checks')
+
+        charList = getCharList(progArgs)
+
+        displayParameters(progArgs, charList)
+
+        if progArgs['callsigns']:
+            generateCallsigns(progArgs, charList)
+        elif progArgs['words']:
+            generateWords(progArgs, charList)
+        elif progArgs['qsos']:
+            generateQSOs(progArgs, charList)
+
+        markTiming('session')
+
+        if progArgs['cacheStats'] and WAVEFORM_CACHE is not None:
+            print(WAVEFORM_CACHE.stats())
+
+        if progArgs['timing']:
+            printTiming()
 
     sys.exit(0)
 
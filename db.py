@@ -5,11 +5,119 @@
 import datetime
 import re
 import sqlite3
+import sys
 from inspect import currentframe, getframeinfo
 
 from qrz import *
 
 
+# fields of the LOTW records stored in the lotwlog table
+LOTW_FIELDS = ['call', 'band', 'freq', 'mode', 'app_lotw_modegroup', 'qso_date',
+               'time_on', 'qsl_rcvd', 'qslrdate']
+
+# the fields that identify a QSO, lotwlog has a unique index on them
+LOTW_QSO_KEY = ['call', 'band', 'mode', 'qso_date', 'time_on']
+
+# QRZ callsign data field: callsigndata column
+QRZ_FIELDS = {
+    'call': 'call', 'fname': 'fname', 'name': 'name', 'addr1': 'addr1',
+    'addr2': 'addr2', 'state': 'state', 'zip': 'zip', 'country': 'country',
+    'lat': 'lat', 'lon': 'lon', 'grid': 'grid', 'county': 'county',
+    'TimeZone': 'timezone',
+}
+
+# The database is in WAL mode, so the log can be read (e.g. by the
+# generator) while a sync writes to it, and each connection is tuned
+# with these pragmas: NORMAL synchronous is safe with WAL, the page
+# cache size is in KiB when negative, and the file is memory mapped
+# up to MMAP_SIZE bytes.
+SYNCHRONOUS = 'NORMAL'
+CACHE_SIZE  = -16 * 1024
+MMAP_SIZE   = 256 * 1024 * 1024
+
+
+# The schema is versioned with PRAGMA user_version. The tables are
+# created as they always were, then each of the MIGRATIONS that the
+# database hasn't had yet is applied in its own transaction, which
+# also sets user_version to the migration's number (its position in
+# MIGRATIONS, from 1), so a database of any earlier version is brought
+# up to date when it is opened and a failed migration leaves it as it
+# was. New migrations are added to the end of the list.
+
+# Merge the lotwlog records of the same QSO into the first of them,
+# keeping the callsign data and QSL card links of any of them, and
+# return the number of records deleted
+def mergeLotwDuplicates(conn):
+    key = ", ".join(LOTW_QSO_KEY)
+    match = " AND ".join("d.{0} = lotwlog.{0}".format(field) for field in LOTW_QSO_KEY)
+
+    sql =  "UPDATE lotwlog SET "
+    sql += "callsigndata_id = COALESCE(callsigndata_id, "
+    sql += "(SELECT max(d.callsigndata_id) FROM lotwlog d WHERE {})), ".format(match)
+    sql += "qslcard_id = COALESCE(qslcard_id, "
+    sql += "(SELECT max(d.qslcard_id) FROM lotwlog d WHERE {})) ".format(match)
+    sql += "WHERE lotw_id IN (SELECT min(lotw_id) FROM lotwlog "
+    sql += "GROUP BY {} HAVING count(*) > 1)".format(key)
+    conn.execute(sql)
+
+    sql =  "DELETE FROM lotwlog WHERE lotw_id NOT IN "
+    sql += "(SELECT min(lotw_id) FROM lotwlog GROUP BY {})".format(key)
+
+    return conn.execute(sql).rowcount
+
+
+# Merge the callsigndata records of the same callsign into the latest
+# of them, linking the QSOs of the others to it, and return the number
+# of records deleted
+def mergeCallsignDuplicates(conn):
+    sql =  "UPDATE lotwlog SET callsigndata_id = "
+    sql += "(SELECT max(k.callsigndata_id) FROM callsigndata k, callsigndata c "
+    sql += "WHERE c.callsigndata_id = lotwlog.callsigndata_id AND k.call = c.call) "
+    sql += "WHERE callsigndata_id IN (SELECT callsigndata_id FROM callsigndata "
+    sql += "WHERE call IN (SELECT call FROM callsigndata "
+    sql += "GROUP BY call HAVING count(*) > 1))"
+    conn.execute(sql)
+
+    sql =  "DELETE FROM callsigndata WHERE callsigndata_id NOT IN "
+    sql += "(SELECT max(callsigndata_id) FROM callsigndata GROUP BY call)"
+
+    return conn.execute(sql).rowcount
+
+
+# 1: a QSO is stored once, the unique key of the bulk LOTW sync
+def migrateLotwQSOKey(conn):
+    numMerged = mergeLotwDuplicates(conn)
+    if numMerged:
+        print('merged duplicate lotwlog records: ', numMerged)
+
+    sql =  "CREATE UNIQUE INDEX IF NOT EXISTS lotwlog_qso "
+    sql += "ON lotwlog ({})".format(", ".join(LOTW_QSO_KEY))
+    conn.execute(sql)
+
+
+# 2: a callsign has one callsigndata record, found by its call, and the
+# QSOs are found by their callsign data link. The lotwlog index covers
+# the search for the callsigns without callsign data by the QRZ sync.
+def migrateCallsignIndexes(conn):
+    numMerged = mergeCallsignDuplicates(conn)
+    if numMerged:
+        print('merged duplicate callsigndata records: ', numMerged)
+
+    sql =  "CREATE UNIQUE INDEX IF NOT EXISTS callsigndata_call "
+    sql += "ON callsigndata (call)"
+    conn.execute(sql)
+
+    sql =  "CREATE INDEX IF NOT EXISTS lotwlog_callsigndata "
+    sql += "ON lotwlog (callsigndata_id, call)"
+    conn.execute(sql)
+
+
+MIGRATIONS = [
+    migrateLotwQSOKey,
+    migrateCallsignIndexes,
+]
+
+
 # An sqlite database that mirrors my LOTW database. The real purpose
 # of this database is to track QSL cards. The LOTW database is the
 # master database and this database is updated from that. This
@@ -22,8 +130,12 @@ class LogDatabase:
         # exist, it will be created. Then check if the log table
         # exists, if not create it
         self.databaseFile = dbFile
+        self._qrz = None
 
-        with sqlite3.connect(dbFile) as conn:
+        with self._connect() as conn:
+            # WAL is a property of the database file, it can't be
+            # turned on in a transaction
+            conn.execute("PRAGMA journal_mode=WAL")
 
             sql =  "CREATE TABLE IF NOT EXISTS metadata "
             sql += "(metadata_id integer primary key, "
@@ -66,93 +178,93 @@ class LogDatabase:
             for row in conn.execute(sql):
                 print(row)
 
+            self._migrate(conn)
+
             sql = "SELECT SQLITE_VERSION()"
             for row in conn.execute(sql):
                 print('sqlite version: ', row[0])
 
-            
+
+    # Return a connection to the database, with the pragmas set
+    def _connect(self):
+        conn = sqlite3.connect(self.databaseFile)
+        conn.execute("PRAGMA synchronous = {}".format(SYNCHRONOUS))
+        conn.execute("PRAGMA cache_size = {}".format(CACHE_SIZE))
+        conn.execute("PRAGMA mmap_size = {}".format(MMAP_SIZE))
+
+        return conn
+
+
+    # Apply the MIGRATIONS the database hasn't had yet
+    def _migrate(self, conn):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > len(MIGRATIONS):
+            print(f"ERROR: database {self.databaseFile} is schema version {version}, "
+                  f"newer than this program's {len(MIGRATIONS)}, exiting...")
+            sys.exit(1)
+
+        for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+            conn.execute("BEGIN")
+            try:
+                migration(conn)
+                conn.execute("PRAGMA user_version = {}".format(number))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print('database migrated to schema version: ', number)
+
 
 
     def syncLotwLog(self, logDict):
         # This method updates or inserts logging data from LOTW. The
         # LOTW database is the master database so this database tracks
         # any changes to that with the exception of the QSL Card
-        # fields.
+        # fields. The LOTW records are loaded into a temporary staging
+        # table in one executemany, then merged into lotwlog by a
+        # single INSERT ... ON CONFLICT DO UPDATE on the QSO's unique
+        # key (see LOTW_QSO_KEY), all in one transaction. A QSO that
+        # is already in the database only has its QSL fields updated.
 
         print('Downloading LOTW data and insert/update into local database...')
-        
-        numRecordsInserted = 0
-        numRecordsUpdated = 0
-
-        with sqlite3.connect(self.databaseFile) as conn:
-            cur = conn.cursor()
-
-            for elem in logDict:
-                # debug
-                # print('-----------------------------------------------------------------')
-                # print('elem: ', elem)
-
-                sql =  "SELECT * FROM lotwlog WHERE "
-                sql += "call='{}' AND mode='{}' AND band='{}' ".\
-                              format(elem['call'], elem['mode'], elem['band'])
-                sql += "AND qso_date='{}'".format(elem['qso_date'])
-                # print('select: ', sql)
-                
-                cur.execute(sql)
-                if cur.fetchone() == None:
-                    # log entry from LOTW is not in database, insert this new record
-                    
-                    # print('log entry {} not in database, insert...'.\
-                    #       format(elem['call']))
-                    
-                    sql =  "INSERT INTO lotwlog "
-                    sql += "(call, band, freq, mode, app_lotw_modegroup, qso_date, "
-                    sql += "time_on, qsl_rcvd"
-                    if 'qslrdate' in elem:
-                        sql += ", qslrdate) "
-                    else:
-                        sql += ") "
-                    sql += "VALUES ('{}', '{}', '{}', ".\
-                           format(elem['call'], elem['band'], elem['freq'])
-                    sql += "'{}', '{}', '{}', '{}', '{}'".\
-                           format(elem['mode'], elem['app_lotw_modegroup'],
-                                  elem['qso_date'], elem['time_on'],
-                                  elem['qsl_rcvd'])
-                    if 'qslrdate' in elem:
-                        # won't have qslrdate unless QSL is true, so
-                        # check if that key is in the dict
-                        sql += ", '{}')".format(elem['qslrdate'])
-                    else:
-                        sql += ")"
-                    print('insert: ', sql)
-                    cur.execute(sql)
-                    numRecordsInserted += cur.rowcount
-                    for row in cur.fetchall():
-                        print('insert: ', row)
-                else:
-                    # print('log entry {} in database, update...'.\
-                    #       format(elem['call']))
-                    
-                    # Do an UPDATE to update the records values from the
-                    # LOTW data if the record already exists in the
-                    # database
-                    sql =  "UPDATE lotwlog SET "
-                    sql += "qsl_rcvd='{}' ".format(elem['qsl_rcvd'])
-                    if 'qslrdate' in elem:
-                        # won't have qslrdate unless QSL is true, so
-                        # check if that key is in the dict
-                        sql += ", qslrdate='{}' ".format(elem['qslrdate'])
-                    sql += "WHERE call='{}' AND band='{}' AND freq='{}' ".\
-                                        format(elem['call'], elem['band'],
-                                               elem['freq'])
-                    sql += "AND mode='{}' AND qso_date='{}' ".format(elem['mode'],
-                                                                     elem['qso_date'])
-                    sql += "AND time_on='{}'".format(elem['time_on'])
-                    # print('update: ', sql)
-                    cur.execute(sql)
-                    numRecordsUpdated += cur.rowcount
-                    for row in cur.fetchall():
-                        print('update: ', row)
+
+        rows = [tuple(elem.get(field) for field in LOTW_FIELDS) for elem in logDict]
+        columns = ", ".join(LOTW_FIELDS)
+        key = ", ".join(LOTW_QSO_KEY)
+
+        with self._connect() as conn:
+            sql =  "CREATE TEMP TABLE IF NOT EXISTS lotwstage "
+            sql += "(call varchar(16), band varchar(8), freq float(20, 10), "
+            sql += "mode varchar(8), app_lotw_modegroup varchar(16), "
+            sql += "qso_date varchar(16), time_on varchar(16), "
+            sql += "qsl_rcvd varchar(8), qslrdate varchar(16))"
+            conn.execute(sql)
+            conn.execute("DELETE FROM lotwstage")
+
+            sql =  f"INSERT INTO lotwstage ({columns}) "
+            sql += f"VALUES ({', '.join('?' * len(LOTW_FIELDS))})"
+            conn.executemany(sql, rows)
+
+            # the QSOs already in the database are the ones updated
+            sql =  "SELECT count(*) FROM lotwstage s WHERE EXISTS "
+            sql += "(SELECT 1 FROM lotwlog l WHERE "
+            sql += " AND ".join(f"l.{field} = s.{field}" for field in LOTW_QSO_KEY)
+            sql += ")"
+            numRecordsUpdated = conn.execute(sql).fetchone()[0]
+            numRecordsBefore = conn.execute("SELECT count(*) FROM lotwlog").fetchone()[0]
+
+            # 'WHERE true' tells the parser the ON CONFLICT is the
+            # upsert clause, not part of the SELECT's join
+            sql =  f"INSERT INTO lotwlog ({columns}) "
+            sql += f"SELECT {columns} FROM lotwstage WHERE true "
+            sql += f"ON CONFLICT ({key}) DO UPDATE SET "
+            sql += "qsl_rcvd = excluded.qsl_rcvd, "
+            sql += "qslrdate = COALESCE(excluded.qslrdate, lotwlog.qslrdate)"
+            conn.execute(sql)
+
+            numRecordsInserted = (conn.execute("SELECT count(*) FROM lotwlog").fetchone()[0] -
+                                  numRecordsBefore)
+            conn.execute("DELETE FROM lotwstage")
 
             print('Records inserted: ', numRecordsInserted)
             print('Records updated:  ', numRecordsUpdated)
@@ -171,19 +283,19 @@ class LogDatabase:
 
         print('Updating QRZ callsign information in the local database...')
 
-        # Init QRZ connection object
-        qrz = QRZ(qrzUsername, qrzPassword)
+        # Init QRZ connection object, it is kept for the next sync
+        qrz = self._getQRZ(qrzUsername, qrzPassword)
 
-        # Query the lotwlog table for records that don't have the
-        # foreigh key callsigndata_id set. This indicates that there
-        # is no callsign data for linked for that QSO. Store the
-        # information about these records in a list for further
-        # processing.
+        # Query the lotwlog table for the callsigns of records that
+        # don't have the foreigh key callsigndata_id set. This
+        # indicates that there is no callsign data for linked for
+        # those QSOs. Store the callsigns in a list for further
+        # processing, once each however many QSOs there are with them.
         lotwList = []
-        conn = sqlite3.connect(self.databaseFile)
+        conn = self._connect()
         cur = conn.cursor()
 
-        sql = "SELECT lotw_id, call from lotwlog WHERE callsigndata_id IS NULL"
+        sql = "SELECT DISTINCT call from lotwlog WHERE callsigndata_id IS NULL"
         cur.execute(sql)
         for row in cur.fetchall():
             lotwList.append(row)
@@ -197,83 +309,37 @@ class LogDatabase:
             # print('lotw: ', i)
 
             try:
-                callData = qrz.callsignData(i[1])
+                callData = qrz.callsignData(i[0])
                 # print('call: ', callData)
 
-                sql =  "INSERT OR REPLACE INTO callsigndata "
-                colSql = "("
-                valSql = "VALUES ("
-
-                if 'call' in callData:
-                    colSql += "call"
-                    valSql += "'{}'".format(callData['call'])
-                if 'fname' in callData:
-                    colSql += ", fname"
-                    valSql += ", '{}'".format(callData['fname'])
-                if 'name' in callData:
-                    colSql += ", name"
-                    valSql += ", '{}'".format(callData['name'])
-                if 'addr1' in callData:
-                    colSql += ", addr1"
-                    valSql += ", '{}'".format(callData['addr1'])
-                if 'addr2' in callData:
-                    colSql += ", addr2"
-                    valSql += ", '{}'".format(callData['addr2'])
-                if 'state' in callData:
-                    colSql += ", state"
-                    valSql += ", '{}'".format(callData['state'])
-                if 'zip' in callData:
-                    colSql += ", zip"
-                    valSql += ", '{}'".format(callData['zip'])
-                if 'country' in callData:
-                    colSql += ", country"
-                    valSql += ", '{}'".format(callData['country'])
-                if 'lat' in callData:
-                    colSql += ", lat"
-                    valSql += ", '{}'".format(callData['lat'])
-                if 'lon' in callData:
-                    colSql += ", lon"
-                    valSql += ", '{}'".format(callData['lon'])
-                if 'grid' in callData:
-                    colSql += ", grid"
-                    valSql += ", '{}'".format(callData['grid'])
-                if 'county' in callData:
-                    colSql += ", county"
-                    valSql += ", '{}'".format(callData['county'])
-                if 'TimeZone' in callData:
-                    colSql += ", timezone"
-                    valSql += ", '{}'".format(callData['TimeZone'])
-
-                colSql += ")"
-                valSql += ")"
-                sql += colSql + " " + valSql
-                # print('sql: ', sql)
-                # print('------------------------------------------------------------------------------')
-                cur.execute(sql)
-                for row in cur.fetchall():
-                    print('callsigndata insert: ', row)
+                # Insert the callsign data, or update it if the
+                # callsign has a record already, which keeps its
+                # callsigndata_id
+                fields = [field for field in QRZ_FIELDS if field in callData]
+                columns = [QRZ_FIELDS[field] for field in fields]
+                sql =  "INSERT INTO callsigndata ({}) ".format(", ".join(columns))
+                sql += "VALUES ({}) ".format(", ".join("?" * len(columns)))
+                sql += "ON CONFLICT (call) DO UPDATE SET "
+                sql += ", ".join("{0} = excluded.{0}".format(column)
+                                 for column in columns if column != 'call')
+                cur.execute(sql, [callData[field] for field in fields])
                 conn.commit()
 
                 # Now insert the callsigndata record's primary key
-                # into the foreign key in the lotwlog record to
+                # into the foreign key in the lotwlog records, those of
+                # the callsign as logged and as QRZ has it, to
                 # establish the link between the callsign data and the
                 # QSO record
                 sql =  "UPDATE lotwlog set callsigndata_id = "
-                sql += "(SELECT callsigndata_id FROM callsigndata "
-                sql += "WHERE call = '{}')".format(callData['call'])
-                sql += " WHERE call = '{}'".format(callData['call'])
-                # print('sql: ', sql)
-                
-                cur.execute(sql)
-                for row in cur.fetchall():
-                    print('callsigndata_id insert: ', row)
+                sql += "(SELECT callsigndata_id FROM callsigndata WHERE call = ?) "
+                sql += "WHERE call IN (?, ?)"
+                cur.execute(sql, (callData['call'], i[0], callData['call']))
                 conn.commit()
-                # print('===============================================================================')
 
             except CallsignNotFound:
-                print("_syncQRZData() Callsign {} not in QRZ database".format(i[1]))
+                print("_syncQRZData() Callsign {} not in QRZ database".format(i[0]))
             except Exception as e:
-                print("_syncQRZData() Caught exception '{}' for callsign {}".format(e, i[1]))
+                print("_syncQRZData() Caught exception '{}' for callsign {}".format(e, i[0]))
 
         # update metadata table with date-time group of last DB sync
         sql =  "UPDATE metadata SET last_db_sync = {}".format(self._getDTG_UTC())
@@ -291,6 +357,16 @@ class LogDatabase:
         conn.close()
 
 
+    # Return the QRZ client, which is created by the first sync and
+    # reused by the later ones, keeping its session
+    def _getQRZ(self, qrzUsername, qrzPassword):
+        qrz = self._qrz
+        if qrz is None or (qrz.username, qrz.password) != (qrzUsername, qrzPassword):
+            qrz = self._qrz = QRZ(qrzUsername, qrzPassword)
+
+        return qrz
+
+
     def syncQRZData(self, qrzUsername, qrzPassword):
         self._syncQRZData(qrzUsername, qrzPassword)
 
@@ -303,7 +379,7 @@ class LogDatabase:
     def doDBQuery(self, sql):
         resultLst = []
         
-        with sqlite3.connect(self.databaseFile) as conn:
+        with self._connect() as conn:
             for row in conn.execute(sql):
                 resultLst.append(row)
 
@@ -313,7 +389,7 @@ class LogDatabase:
     def getDBLOTWDuplicates(self):
         resultLst = []
         
-        with sqlite3.connect(self.databaseFile) as conn:
+        with self._connect() as conn:
             sql = "SELECT call, band, qso_date, mode, time_on, count(*) FROM lotwlog "
             sql += "GROUP BY call, band, qso_date, mode, time_on HAVING count(*) > 1"
             for row in conn.execute(sql):
@@ -325,7 +401,7 @@ class LogDatabase:
     def getDBCallSignDuplicates(self):
         resultLst = []
         
-        with sqlite3.connect(self.databaseFile) as conn:
+        with self._connect() as conn:
             sql = "SELECT call, count(*) FROM callsigndata "
             sql += "GROUP BY call HAVING count(*) > 1"
             for row in conn.execute(sql):
@@ -338,7 +414,7 @@ class LogDatabase:
 
         dupLst = self.getDBCallSignDuplicates()
 
-        conn = sqlite3.connect(self.databaseFile)
+        conn = self._connect()
         cur = conn.cursor()
 
         for i in dupLst:
@@ -346,20 +422,20 @@ class LogDatabase:
 
             # Get the callsigndata_id associated of this callsign
             sql = "SELECT callsigndata_id FROM callsigndata "
-            sql += "WHERE call = '{}'".format(call)
-            cur.execute(sql)
+            sql += "WHERE call = ?"
+            cur.execute(sql, (call,))
             callIDLst = cur.fetchall()
             for id in callIDLst:
                 callID = id[0]
 
-                sql = "SELECT * from lotwlog WHERE callsigndata_id = {}".format(callID)
-                cur.execute(sql)
+                sql = "SELECT * from lotwlog WHERE callsigndata_id = ?"
+                cur.execute(sql, (callID,))
                 if cur.fetchone() is None:
                     # This callsigndata_id isn't in lotwlog and is a
                     # duplicate, so it should be deleted
                     sql = "DELETE FROM callsigndata "
-                    sql += "WHERE callsigndata_id = {}".format(callID)
-                    cur.execute(sql)
+                    sql += "WHERE callsigndata_id = ?"
+                    cur.execute(sql, (callID,))
                     conn.commit()
                     print('deleted duplicate callsigndata record for id: ', id[0])
 
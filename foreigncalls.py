@@ -3,12 +3,17 @@
 
 
 
+import collections
+import concurrent.futures
+import configargparse
+import json
 import os
-import re
 import string
 import sys
+import threading
 import time
 
+import itu
 from qrz import *
 
 
@@ -20,207 +25,464 @@ QRZ_PASSWORD   = 'Sean!12233'
 FOREIGN_CALL_FILE = os.path.join(os.environ['HOME'],
                                  'devel/python/cwwords-data/foreign.dat')
 
-NUM_DOTS = 0
+# The foreign callsign file is harvested from QRZ by querying candidate
+# callsigns and keeping the ones that are found outside of the
+# U.S. The queries are made by a pool of worker threads, each keeping
+# its own QRZ client, and all of them drawing from one token bucket
+# before each request, so the crawl runs at the configured query rate
+# however long each query takes. The callsigns already looked up are
+# answered by the QRZ cache (see qrz.py) without a request.
+#
+# The candidates are numbered, and a checkpoint file next to the
+# callsign file holds the position of the crawl: every candidate
+# before it has been queried and its result written. The records
+# found are appended to the callsign file in batches, each batch
+# synced to disk before the checkpoint is moved past it, so an
+# interrupted crawl resumes where it stopped without losing or
+# repeating records.
+
+CALL_CHARS = string.ascii_uppercase + string.digits
+CALL_LENGTHS = [4, 5, 6]
+
+# countries whose series aren't crawled, their stations aren't foreign
+EXCLUDED_COUNTRIES = ['United States']
+SUFFIX_LENGTHS = [1, 2, 3]
+
+# QRZ queries per second
+DEFAULT_RATE = 1.0
+DEFAULT_WORKERS = 4
 
+# records appended to the callsign file at a time, or after
+# BATCH_SECONDS
+BATCH_SIZE = 100
+BATCH_SECONDS = 30
+
+# seconds to wait after an error before querying again
+RETRY_WAIT = 60
+
+# seconds between status lines
+STATUS_SECONDS = 10
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+# Every string of CALL_CHARS of each of the CALL_LENGTHS that has a
+# digit in it, as the original nested loops enumerated them. The
+# position of a candidate is its number in the whole space, the
+# candidates without a digit are skipped but keep their positions.
+class BruteForceCandidates:
+
+    name = 'bruteforce'
+
+    def __init__(self, chars=CALL_CHARS, lengths=CALL_LENGTHS):
+        self.chars = chars
+        self.lengths = lengths
+        self._charIndex = {c: i for i, c in enumerate(chars)}
+        self._digits = set(string.digits)
+
+
+    def __len__(self):
+        return sum(len(self.chars) ** n for n in self.lengths)
+
+
+    def call(self, position):
+        for length in self.lengths:
+            count = len(self.chars) ** length
+            if position < count:
+                chars = []
+                for i in range(length):
+                    position, c = divmod(position, len(self.chars))
+                    chars.append(self.chars[c])
+                return ''.join(reversed(chars))
+            position -= count
+
+        raise IndexError('candidate position out of range')
+
+
+    def position(self, call):
+        position = 0
+        for length in self.lengths:
+            if length == len(call):
+                number = 0
+                for c in call:
+                    number = number * len(self.chars) + self._charIndex[c]
+                return position + number
+            position += len(self.chars) ** length
+
+        raise ValueError(f"not a candidate callsign: {call}")
+
+
+    # Yield the (position, callsign) of the candidates from 'start'
+    def iterate(self, start=0):
+        for position in range(start, len(self)):
+            call = self.call(position)
+            if self._digits.intersection(call):
+                yield position, call
+
+
+# The callsigns that follow the callsign grammar: a prefix from an ITU
+# series (see itu.py) of a country outside of EXCLUDED_COUNTRIES, a
+# digit and a suffix of SUFFIX_LENGTHS letters. That is about a
+# fourteenth of the brute force candidates, and none of them is a U.S.
+# callsign. The candidates are numbered by suffix length first, so the
+# short callsigns of every country are queried before the longer ones,
+# then by prefix, digit and suffix, and a position is converted to its
+# callsign and back arithmetically.
+class PrefixCandidates:
+
+    name = 'itu'
+
+    def __init__(self, prefixes=None, suffixLengths=SUFFIX_LENGTHS,
+                 excluded=EXCLUDED_COUNTRIES):
+        if prefixes is None:
+            prefixes = [prefix for prefix, country in itu.PREFIXES.items()
+                        if country not in excluded]
+        self.prefixes = prefixes
+        self.suffixLengths = suffixLengths
+        self._prefixIndex = {prefix: i for i, prefix in enumerate(prefixes)}
+        self._letters = set(string.ascii_uppercase)
 
-def getCalldata(call):
-    global NUM_DOTS
-    
-    result = "notfound"
-    
-    if re.search('.*[0-9]+.*', call):
-        # callsigns need at least one number
-        # so check for that
-    
+
+    # Return the number of candidates with a suffix of 'length' letters
+    def _blockSize(self, length):
+        return len(self.prefixes) * len(string.digits) * len(string.ascii_uppercase) ** length
+
+
+    def __len__(self):
+        return sum(self._blockSize(n) for n in self.suffixLengths)
+
+
+    def call(self, position):
+        for length in self.suffixLengths:
+            size = self._blockSize(length)
+            if position < size:
+                position, number = divmod(position, len(string.ascii_uppercase) ** length)
+                prefix, digit = divmod(position, len(string.digits))
+                suffix = []
+                for i in range(length):
+                    number, c = divmod(number, len(string.ascii_uppercase))
+                    suffix.append(string.ascii_uppercase[c])
+                return (f"{self.prefixes[prefix]}{string.digits[digit]}"
+                        f"{''.join(reversed(suffix))}")
+            position -= size
+
+        raise IndexError('candidate position out of range')
+
+
+    def position(self, call):
+        for n in (2, 1):
+            prefix, digit, suffix = call[:n], call[n:n + 1], call[n + 1:]
+            if (prefix in self._prefixIndex and digit.isdigit() and
+                len(suffix) in self.suffixLengths and self._letters.issuperset(suffix)):
+                position = sum(self._blockSize(length) for length in self.suffixLengths
+                               if length < len(suffix))
+                number = 0
+                for c in suffix:
+                    number = number * len(string.ascii_uppercase) + ord(c) - ord('A')
+                return (position + (self._prefixIndex[prefix] * len(string.digits) +
+                                    int(digit)) * len(string.ascii_uppercase) ** len(suffix) +
+                        number)
+
+        raise ValueError(f"not a candidate callsign: {call}")
+
+
+    # Yield the (position, callsign) of the candidates from 'start'
+    def iterate(self, start=0):
+        for position in range(start, len(self)):
+            yield position, self.call(position)
+
+
+CANDIDATES = {
+    PrefixCandidates.name: PrefixCandidates,
+    BruteForceCandidates.name: BruteForceCandidates,
+}
+
+
+# Limits the rate of the queries of all of the workers, up to 'burst'
+# queries may be made at once after a pause
+class TokenBucket:
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
         while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Return the callsign file record of QRZ callsign data
+def formatRecord(c, call):
+    return (f"{c['call']}|{c.get('fname', '')}|{c.get('name', '')}|"
+            f"{c.get('addr1', '')}|{c.get('addr2', '')}|{c['country']}|{call}")
+
+
+class Harvester:
+
+    def __init__(self, candidates, callFile, checkpointFile, username, password,
+                 baseUrl=None, cacheFile=None, rate=DEFAULT_RATE,
+                 workers=DEFAULT_WORKERS, batchSize=BATCH_SIZE, retryWait=RETRY_WAIT):
+        self.candidates = candidates
+        self.callFile = callFile
+        self.checkpointFile = checkpointFile
+        self.username = username
+        self.password = password
+        self.baseUrl = baseUrl
+        self.cacheFile = cacheFile
+        self.workers = workers
+        self.batchSize = batchSize
+        self.retryWait = retryWait
+        self.bucket = TokenBucket(rate, burst=workers)
+
+        self.queried = 0
+        self.found = 0
+        self._records = []
+        self._lastFlush = time.monotonic()
+        self._local = threading.local()
+        # set when the crawl stops, the workers give up their queries
+        self._stop = threading.Event()
+
+
+    # The QRZ client of the worker thread, which keeps its session
+    def _client(self):
+        if getattr(self._local, 'qrz', None) is None:
+            self._local.qrz = QRZ(self.username, self.password, baseUrl=self.baseUrl,
+                                  cacheFile=self.cacheFile,
+                                  rateLimiter=self.bucket.acquire)
+
+        return self._local.qrz
+
+
+    # Return the callsign file record of a candidate callsign, or None
+    # if it isn't a foreign callsign or the crawl has stopped
+    def lookup(self, call):
+        while not self._stop.is_set():
             try:
-                qrz = QRZ(QRZ_USERNAME, QRZ_PASSWORD)
-                c = qrz.callsignData(call, verbose=False)
-                # print(f"DEBUG callsignData(): {c}")
-                if c['country'] != 'United States':
-                    result = (f"{c['call']}|{c['fname']}|{c['name']}|{c['addr1']}|"
-                              f"{c['addr2']}|{c['country']}|{call}")
-                    break
-                else:
-                    break
-            except CallsignNotFound as e:
-                # print(f"getCalldata() {e}")
-                break
-            except KeyError:
-                break
-            except AttributeError:
-                break
+                c = self._client().callsignData(call, verbose=False)
+                if c['country'] == 'United States':
+                    return None
+                return formatRecord(c, call)
+            except (CallsignNotFound, KeyError):
+                return None
             except Exception as e:
-                # print("", end="\r")               # carriage return
-                # sys.stdout.write("\033[K")        # clear to EOL
-                # NUM_DOTS = 0
-                print(f"\nWARNING: {e}")
-                time.sleep(60)
-
-        time.sleep(1)      # slow the QRZ query rate down
-                
-    columns, rows = os.get_terminal_size(0)
-    columns -= 5
-    if result == "notfound":
-        if NUM_DOTS >= columns:
-            # goto beginning of line and clear it
-            print("", end="\r")               # carriage return
-            sys.stdout.write("\033[K")        # clear to EOL
-            NUM_DOTS = 0
-        else:
-            print('.', end="", flush=True)
-            NUM_DOTS += 1
-    else:
-        # a callsign was found so clear to EOL so that the data can be
-        # printed (by another function)
-        if NUM_DOTS > 0:
-            print("", end="\r")
-            sys.stdout.write("\033[K")
-            NUM_DOTS = 0
-            
-    return result
-        
-
-
-def getStartingCallsign():
+                print(f"WARNING: {call}: {e}")
+                self._stop.wait(self.retryWait)
+
+        return None
+
+
+    def loadCheckpoint(self):
+        if os.path.exists(self.checkpointFile):
+            with open(self.checkpointFile, 'r') as fileobj:
+                state = json.load(fileobj)
+            if state.get('candidates') != self.candidates.name:
+                print(f"ERROR: checkpoint {self.checkpointFile} is of the "
+                      f"'{state.get('candidates')}' candidates, not "
+                      f"'{self.candidates.name}' (see --candidates), exiting...")
+                sys.exit(1)
+            return state
+
+        # no checkpoint, the brute force crawl carries on after the last
+        # callsign in the file (which it wrote in candidate order), the
+        # others start over since the callsigns they find are in no
+        # order of theirs
+        state = {'candidates': self.candidates.name, 'position': 0,
+                 'queried': 0, 'found': 0}
+        if self.candidates.name != BruteForceCandidates.name:
+            return state
+
+        startCall = getStartingCallsign(self.callFile)
+        if startCall:
+            try:
+                state['position'] = self.candidates.position(startCall) + 1
+            except ValueError:
+                print(f"WARNING: can't resume after {startCall}, starting over")
+
+        return state
+
+
+    def saveCheckpoint(self, position):
+        state = {'candidates': self.candidates.name, 'position': position,
+                 'queried': self.queried, 'found': self.found,
+                 'saved': time.strftime('%Y-%m-%d %H:%M:%S')}
+        tmpFile = f"{self.checkpointFile}.tmp"
+        with open(tmpFile, 'w') as fileobj:
+            json.dump(state, fileobj)
+        os.replace(tmpFile, self.checkpointFile)
+
+
+    # Append the records of the candidates before 'position' to the
+    # callsign file, then move the checkpoint to it. The records of the
+    # queries after it that are already done are kept for the next
+    # batch, they are made again if the crawl is resumed from here.
+    def flush(self, position):
+        records = [record for pos, record in self._records if pos < position]
+        if records:
+            with open(self.callFile, 'a') as fileobj:
+                fileobj.write(''.join(f"{record}\n" for record in records))
+                fileobj.flush()
+                os.fsync(fileobj.fileno())
+            self.found += len(records)
+            self._records = [(pos, record) for pos, record in self._records
+                             if pos >= position]
+
+        self.saveCheckpoint(position)
+        self._lastFlush = time.monotonic()
+
+
+    def run(self):
+        state = self.loadCheckpoint()
+        self.queried = state['queried']
+        self.found = state['found']
+        nextPosition = state['position']
+        if nextPosition >= len(self.candidates):
+            print(f"The crawl of the '{self.candidates.name}' candidates is "
+                  f"complete (checkpoint: {self.checkpointFile})")
+            return
+
+        print(f"Harvesting from {self.candidates.call(nextPosition)} "
+              f"(candidate {nextPosition} of {len(self.candidates)})")
+
+        candidates = self.candidates.iterate(nextPosition)
+        maxPending = 2 * self.workers
+        pending = {}
+        # positions of the queries in the order they were made, and
+        # those of them that are done
+        submitted = collections.deque()
+        completed = set()
+        startTime = lastStatus = time.monotonic()
+        startQueried = self.queried
+
+        def checkpoint():
+            return submitted[0] if submitted else nextPosition
+
+        self._stop.clear()
+        pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < maxPending:
+                    try:
+                        position, call = next(candidates)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[pool.submit(self.lookup, call)] = position
+                    submitted.append(position)
+                    nextPosition = position + 1
+
+                if not pending:
+                    break
+
+                done, notDone = concurrent.futures.wait(
+                    pending, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    position = pending.pop(future)
+                    completed.add(position)
+                    self.queried += 1
+                    record = future.result()
+                    if record:
+                        self._records.append((position, record))
+                        print(record)
+                while submitted and submitted[0] in completed:
+                    completed.remove(submitted.popleft())
+
+                now = time.monotonic()
+                if (len(self._records) >= self.batchSize or
+                    now - self._lastFlush >= BATCH_SECONDS):
+                    self.flush(checkpoint())
+                if now - lastStatus >= STATUS_SECONDS and pending:
+                    rate = (self.queried - startQueried) / (now - startTime)
+                    print(f"queried: {self.queried}, found: {self.found}, "
+                          f"{rate:.2f} queries/sec, at "
+                          f"{self.candidates.call(checkpoint())}", flush=True)
+                    lastStatus = now
+        finally:
+            # the queries that are still running are made again when the
+            # crawl is resumed, the workers retrying a query stop waiting
+            # so the pool's threads can finish
+            self._stop.set()
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+            self.flush(checkpoint())
+            print(f"queried: {self.queried}, found: {self.found}, "
+                  f"checkpoint: {self.checkpointFile}")
+
+
+# Return the last candidate callsign queried in the callsign file (the
+# last field of its last record), or "" if there isn't one
+def getStartingCallsign(callFile=FOREIGN_CALL_FILE):
     callsign = ""
 
-    if os.path.exists(FOREIGN_CALL_FILE):
-        print(f"getStartingCallsign(): file {FOREIGN_CALL_FILE} exists")
-        with open(FOREIGN_CALL_FILE, 'r') as fileobj:
+    if os.path.exists(callFile):
+        print(f"getStartingCallsign(): file {callFile} exists")
+        with open(callFile, 'r') as fileobj:
             for line in fileobj:
                 l = line.strip()
-                call = l.split("|")[0]
-                # print(f"    {call}")
-
-            # print(f"getStartingCallsign(): {call}")
+                if l:
+                    callsign = l.split("|")[-1]
 
-        callsign = call
-        
     return callsign
 
 
-def generateCallsigns(startCall):
-    print(f"generateCallsigns() call: {startCall}")
-
-    aStr = string.ascii_uppercase + string.digits
-    bStr = string.ascii_uppercase + string.digits
-    cStr = string.ascii_uppercase + string.digits
-    dStr = string.ascii_uppercase + string.digits
-    eStr = string.ascii_uppercase + string.digits
-    fStr = string.ascii_uppercase + string.digits
-    
-    restartCallLen = 0
-    if startCall != "":
-        restartCallLen = len(startCall)
-        print(f"call len : {restartCallLen}")
-
-        for i in range(len(string.ascii_uppercase + string.digits)):
-            if startCall[0] == aStr[i]:
-                break
-        aStr = aStr[i + 1:]
-
-        for i in range(len(string.ascii_uppercase + string.digits)):
-            if startCall[1] == bStr[i]:
-                break
-        bStr = bStr[i + 1:]
-
-        for i in range(len(string.ascii_uppercase + string.digits)):
-            if startCall[2] == cStr[i]:
-                break
-        cStr = cStr[i + 1:]
-
-        for i in range(len(string.ascii_uppercase + string.digits)):
-            if startCall[3] == dStr[i]:
-                break
-        dStr = dStr[i + 1:]
-
-        print(f"debug: aStr {aStr}")
-        print(f"debug: bStr {bStr}")
-        print(f"debug: cStr {cStr}")
-        print(f"debug: dStr {dStr}")
-
-        if restartCallLen >= 5:
-            for i in range(len(string.ascii_uppercase + string.digits)):
-                if startCall[4] == eStr[i]:
-                    break
-            eStr = eStr[i + 1:]
-
-            print(f"debug: eStr {eStr}")
+def parseArguments(argv=None):
+    parser = configargparse.ArgumentParser(
+        description='Harvest the foreign callsign file from QRZ.com')
+
+    parser.add_argument('--call-file', action='store', dest='callFile',
+                        default=FOREIGN_CALL_FILE, help='Foreign callsign file')
+    parser.add_argument('--checkpoint', action='store', dest='checkpointFile',
+                        help=f"Checkpoint file (default: the callsign file + "
+                        f"'{CHECKPOINT_SUFFIX}')")
+    parser.add_argument('--candidates', action='store', dest='candidates',
+                        choices=list(CANDIDATES), default=PrefixCandidates.name,
+                        help="Candidate callsigns: those of the ITU series and "
+                        "callsign grammar, or every string of 4 to 6 characters")
+    parser.add_argument('--url', action='store', dest='baseUrl',
+                        help=f"QRZ XML interface URL (default: {QRZ.QRZ_BASE_URL})")
+    parser.add_argument('--cache-file', action='store', dest='cacheFile',
+                        help='QRZ cache file (default: qrz.db in the cwwords cache directory)')
+    parser.add_argument('--rate', action='store', dest='rate', type=float,
+                        default=DEFAULT_RATE, help='QRZ queries per second')
+    parser.add_argument('--workers', action='store', dest='workers', type=int,
+                        default=DEFAULT_WORKERS, help='Number of concurrent queries')
+    parser.add_argument('--batch-size', action='store', dest='batchSize', type=int,
+                        default=BATCH_SIZE,
+                        help='Records appended to the callsign file at a time')
+    parser.add_argument('--username', action='store', dest='username',
+                        default=QRZ_USERNAME, help='QRZ username')
+    parser.add_argument('--password', action='store', dest='password',
+                        default=QRZ_PASSWORD, help='QRZ password')
+
+    return parser.parse_args(argv)
 
-        if restartCallLen >= 6:
-            for i in range(len(string.ascii_uppercase + string.digits)):
-                if startCall[5] == fStr[i]:
-                    break
-            fStr = fStr[i + 1:]
-
-            print(f"debug: fStr {fStr}")
-            
-    with open(FOREIGN_CALL_FILE, 'a') as fileobj:
-        if restartCallLen <= 4:
-            # generate 4 character callsigns
-            print("Getting 4 character callsigns")
-            for a in aStr:
-                for b in bStr:
-                    for c in cStr:
-                        for d in dStr:
-                            call = f"{a}{b}{c}{d}"
-                            callData = getCalldata(call)
-
-                            if not re.search("notfound", callData):
-                                print(f"{callData}")
-                                fileobj.write(f"{callData}\n")
-                                fileobj.flush()
-                                os.sync()
-
-            # generate 5 character callsigns
-            print("Getting 5 character callsigns")
-            for a in string.ascii_uppercase + string.digits:
-                for b in string.ascii_uppercase + string.digits:
-                    for c in string.ascii_uppercase + string.digits:
-                        for d in string.ascii_uppercase + string.digits:
-                            for e in string.ascii_uppercase + string.digits:
-                                call = f"{a}{b}{c}{d}{e}"
-                                callData = getCalldata(call)
-
-                                if not re.search("notfound", callData):
-                                    print(f"{callData}")
-                                    fileobj.write(f"{callData}\n")
-                                    fileobj.flush()
-                                    os.sync()
-
-            # generate 6 character callsigns
-            print("Getting 6 character callsigns")
-            for a in string.ascii_uppercase + string.digits:
-                for b in string.ascii_uppercase + string.digits:
-                    for c in string.ascii_uppercase + string.digits:
-                        for d in string.ascii_uppercase + string.digits:
-                            for e in string.ascii_uppercase + string.digits:
-                                for f in string.ascii_uppercase + string.digits:
-                                    call = f"{a}{b}{c}{d}{e}{f}"
-                                    callData = getCalldata(call)
-
-                                    if not re.search("notfound", callData):
-                                        print(f"{callData}")
-                                        fileobj.write(f"{callData}\n")
-                                        fileobj.flush()
-                                        os.sync()
-
-                                        
 
 def main():
-    # qrz = QRZ(QRZ_USERNAME, QRZ_PASSWORD)
-
-    startingCall = getStartingCallsign()
-    print(f"starting callsign: {startingCall}")
-
-    # generateCallsigns(qrz, startingCall)
-    generateCallsigns(startingCall)
+    args = parseArguments()
 
-    
+    harvester = Harvester(CANDIDATES[args.candidates](), args.callFile,
+                          args.checkpointFile or args.callFile + CHECKPOINT_SUFFIX,
+                          args.username, args.password, baseUrl=args.baseUrl,
+                          cacheFile=args.cacheFile, rate=args.rate, workers=args.workers,
+                          batchSize=args.batchSize)
+    try:
+        harvester.run()
+    except KeyboardInterrupt:
+        pass
 
 
-                        
-    
 if __name__ == '__main__':
     main()
@@ -0,0 +1,168 @@
+
+# itu.py - the ITU table of allocation of international call sign series
+
+
+import string
+
+
+# The ITU allocates the international call sign series (the first one
+# or two characters of a callsign) to the countries, e.g. DA - DR to
+# Germany (ITU Radio Regulations, Appendix 42). An amateur callsign is
+# a prefix from one of its country's series, a digit and a suffix of
+# letters: DL 1 ABC, G 3 XYZ, 4X 4 AB, A2 2 A.
+#
+# ITU_SERIES holds the series as ranges of two character prefixes
+# ('AA', 'AL') in the order of the table, a one character entry ('F')
+# is a whole letter allocated to a country, which also uses the letter
+# on its own as a prefix (F5ABC as well as FG5ABC). The few series
+# that the table splits between two countries on the third character
+# (SSA - SSM Egypt and SSN - STZ Sudan, 3DA - 3DM Eswatini and 3DN -
+# 3DZ Fiji) are listed under the first of them.
+
+ITU_SERIES = [
+    ('AA', 'AL', 'United States'), ('AM', 'AO', 'Spain'),
+    ('AP', 'AS', 'Pakistan'), ('AT', 'AW', 'India'), ('AX', 'AX', 'Australia'),
+    ('AY', 'AZ', 'Argentina'), ('A2', 'A2', 'Botswana'), ('A3', 'A3', 'Tonga'),
+    ('A4', 'A4', 'Oman'), ('A5', 'A5', 'Bhutan'),
+    ('A6', 'A6', 'United Arab Emirates'), ('A7', 'A7', 'Qatar'),
+    ('A8', 'A8', 'Liberia'), ('A9', 'A9', 'Bahrain'),
+    ('B', 'B', 'China'),
+    ('CA', 'CE', 'Chile'), ('CF', 'CK', 'Canada'), ('CL', 'CM', 'Cuba'),
+    ('CN', 'CN', 'Morocco'), ('CO', 'CO', 'Cuba'), ('CP', 'CP', 'Bolivia'),
+    ('CQ', 'CU', 'Portugal'), ('CV', 'CX', 'Uruguay'), ('CY', 'CZ', 'Canada'),
+    ('C2', 'C2', 'Nauru'), ('C3', 'C3', 'Andorra'), ('C4', 'C4', 'Cyprus'),
+    ('C5', 'C5', 'Gambia'), ('C6', 'C6', 'Bahamas'), ('C8', 'C9', 'Mozambique'),
+    ('DA', 'DR', 'Germany'), ('DS', 'DT', 'South Korea'),
+    ('DU', 'DZ', 'Philippines'), ('D2', 'D3', 'Angola'), ('D4', 'D4', 'Cape Verde'),
+    ('D5', 'D5', 'Liberia'), ('D6', 'D6', 'Comoros'), ('D7', 'D9', 'South Korea'),
+    ('EA', 'EH', 'Spain'), ('EI', 'EJ', 'Ireland'), ('EK', 'EK', 'Armenia'),
+    ('EL', 'EL', 'Liberia'), ('EM', 'EO', 'Ukraine'), ('EP', 'EQ', 'Iran'),
+    ('ER', 'ER', 'Moldova'), ('ES', 'ES', 'Estonia'), ('ET', 'ET', 'Ethiopia'),
+    ('EU', 'EW', 'Belarus'), ('EX', 'EX', 'Kyrgyzstan'),
+    ('EY', 'EY', 'Tajikistan'), ('EZ', 'EZ', 'Turkmenistan'),
+    ('E2', 'E2', 'Thailand'), ('E3', 'E3', 'Eritrea'), ('E4', 'E4', 'Palestine'),
+    ('E5', 'E5', 'Cook Islands'), ('E6', 'E6', 'Niue'),
+    ('E7', 'E7', 'Bosnia and Herzegovina'),
+    ('F', 'F', 'France'),
+    ('G', 'G', 'United Kingdom'),
+    ('HA', 'HA', 'Hungary'), ('HB', 'HB', 'Switzerland'), ('HC', 'HD', 'Ecuador'),
+    ('HE', 'HE', 'Switzerland'), ('HF', 'HF', 'Poland'), ('HG', 'HG', 'Hungary'),
+    ('HH', 'HH', 'Haiti'), ('HI', 'HI', 'Dominican Republic'),
+    ('HJ', 'HK', 'Colombia'), ('HL', 'HL', 'South Korea'),
+    ('HM', 'HM', 'North Korea'), ('HN', 'HN', 'Iraq'), ('HO', 'HP', 'Panama'),
+    ('HQ', 'HR', 'Honduras'), ('HS', 'HS', 'Thailand'), ('HT', 'HT', 'Nicaragua'),
+    ('HU', 'HU', 'El Salvador'), ('HV', 'HV', 'Vatican City'),
+    ('HW', 'HY', 'France'), ('HZ', 'HZ', 'Saudi Arabia'), ('H2', 'H2', 'Cyprus'),
+    ('H3', 'H3', 'Panama'), ('H4', 'H4', 'Solomon Islands'),
+    ('H6', 'H7', 'Nicaragua'), ('H8', 'H9', 'Panama'),
+    ('I', 'I', 'Italy'),
+    ('JA', 'JS', 'Japan'), ('JT', 'JV', 'Mongolia'), ('JW', 'JX', 'Norway'),
+    ('JY', 'JY', 'Jordan'), ('JZ', 'JZ', 'Indonesia'), ('J2', 'J2', 'Djibouti'),
+    ('J3', 'J3', 'Grenada'), ('J4', 'J4', 'Greece'), ('J5', 'J5', 'Guinea-Bissau'),
+    ('J6', 'J6', 'Saint Lucia'), ('J7', 'J7', 'Dominica'),
+    ('J8', 'J8', 'Saint Vincent'),
+    ('K', 'K', 'United States'),
+    ('LA', 'LN', 'Norway'), ('LO', 'LW', 'Argentina'), ('LX', 'LX', 'Luxembourg'),
+    ('LY', 'LY', 'Lithuania'), ('LZ', 'LZ', 'Bulgaria'), ('L2', 'L9', 'Argentina'),
+    ('M', 'M', 'United Kingdom'),
+    ('N', 'N', 'United States'),
+    ('OA', 'OC', 'Peru'), ('OD', 'OD', 'Lebanon'), ('OE', 'OE', 'Austria'),
+    ('OF', 'OJ', 'Finland'), ('OK', 'OL', 'Czech Republic'), ('OM', 'OM', 'Slovakia'),
+    ('ON', 'OT', 'Belgium'), ('OU', 'OZ', 'Denmark'),
+    ('PA', 'PI', 'Netherlands'), ('PJ', 'PJ', 'Netherlands Antilles'),
+    ('PK', 'PO', 'Indonesia'), ('PP', 'PY', 'Brazil'), ('PZ', 'PZ', 'Suriname'),
+    ('P2', 'P2', 'Papua New Guinea'), ('P3', 'P3', 'Cyprus'), ('P4', 'P4', 'Aruba'),
+    ('P5', 'P9', 'North Korea'),
+    ('R', 'R', 'Russia'),
+    ('SA', 'SM', 'Sweden'), ('SN', 'SR', 'Poland'), ('SS', 'SS', 'Egypt'),
+    ('ST', 'ST', 'Sudan'), ('SU', 'SU', 'Egypt'), ('SV', 'SZ', 'Greece'),
+    ('S2', 'S3', 'Bangladesh'), ('S5', 'S5', 'Slovenia'), ('S6', 'S6', 'Singapore'),
+    ('S7', 'S7', 'Seychelles'), ('S8', 'S8', 'South Africa'),
+    ('S9', 'S9', 'Sao Tome and Principe'),
+    ('TA', 'TC', 'Turkey'), ('TD', 'TD', 'Guatemala'), ('TE', 'TE', 'Costa Rica'),
+    ('TF', 'TF', 'Iceland'), ('TG', 'TG', 'Guatemala'), ('TH', 'TH', 'France'),
+    ('TI', 'TI', 'Costa Rica'), ('TJ', 'TJ', 'Cameroon'), ('TK', 'TK', 'France'),
+    ('TL', 'TL', 'Central African Republic'), ('TM', 'TM', 'France'),
+    ('TN', 'TN', 'Congo'), ('TO', 'TQ', 'France'), ('TR', 'TR', 'Gabon'),
+    ('TS', 'TS', 'Tunisia'), ('TT', 'TT', 'Chad'), ('TU', 'TU', "Cote d'Ivoire"),
+    ('TV', 'TX', 'France'), ('TY', 'TY', 'Benin'), ('TZ', 'TZ', 'Mali'),
+    ('T2', 'T2', 'Tuvalu'), ('T3', 'T3', 'Kiribati'), ('T4', 'T4', 'Cuba'),
+    ('T5', 'T5', 'Somalia'), ('T6', 'T6', 'Afghanistan'), ('T7', 'T7', 'San Marino'),
+    ('T8', 'T8', 'Palau'),
+    ('UA', 'UI', 'Russia'), ('UJ', 'UM', 'Uzbekistan'), ('UN', 'UQ', 'Kazakhstan'),
+    ('UR', 'UZ', 'Ukraine'),
+    ('VA', 'VG', 'Canada'), ('VH', 'VN', 'Australia'), ('VO', 'VO', 'Canada'),
+    ('VP', 'VQ', 'United Kingdom'), ('VR', 'VR', 'Hong Kong'),
+    ('VS', 'VS', 'United Kingdom'), ('VT', 'VW', 'India'), ('VX', 'VY', 'Canada'),
+    ('VZ', 'VZ', 'Australia'), ('V2', 'V2', 'Antigua and Barbuda'),
+    ('V3', 'V3', 'Belize'), ('V4', 'V4', 'Saint Kitts and Nevis'),
+    ('V5', 'V5', 'Namibia'), ('V6', 'V6', 'Micronesia'),
+    ('V7', 'V7', 'Marshall Islands'), ('V8', 'V8', 'Brunei'),
+    ('W', 'W', 'United States'),
+    ('XA', 'XI', 'Mexico'), ('XJ', 'XO', 'Canada'), ('XP', 'XP', 'Denmark'),
+    ('XQ', 'XR', 'Chile'), ('XS', 'XS', 'China'), ('XT', 'XT', 'Burkina Faso'),
+    ('XU', 'XU', 'Cambodia'), ('XV', 'XV', 'Vietnam'), ('XW', 'XW', 'Laos'),
+    ('XX', 'XX', 'Macao'), ('XY', 'XZ', 'Myanmar'),
+    ('YA', 'YA', 'Afghanistan'), ('YB', 'YH', 'Indonesia'), ('YI', 'YI', 'Iraq'),
+    ('YJ', 'YJ', 'Vanuatu'), ('YK', 'YK', 'Syria'), ('YL', 'YL', 'Latvia'),
+    ('YM', 'YM', 'Turkey'), ('YN', 'YN', 'Nicaragua'), ('YO', 'YR', 'Romania'),
+    ('YS', 'YS', 'El Salvador'), ('YT', 'YU', 'Serbia'), ('YV', 'YY', 'Venezuela'),
+    ('Y2', 'Y9', 'Germany'),
+    ('ZA', 'ZA', 'Albania'), ('ZB', 'ZJ', 'United Kingdom'),
+    ('ZK', 'ZM', 'New Zealand'), ('ZN', 'ZO', 'United Kingdom'),
+    ('ZP', 'ZP', 'Paraguay'), ('ZQ', 'ZQ', 'United Kingdom'),
+    ('ZR', 'ZU', 'South Africa'), ('ZV', 'ZZ', 'Brazil'), ('Z2', 'Z2', 'Zimbabwe'),
+    ('Z3', 'Z3', 'North Macedonia'), ('Z8', 'Z8', 'South Sudan'),
+    ('2A', '2Z', 'United Kingdom'),
+    ('3A', '3A', 'Monaco'), ('3B', '3B', 'Mauritius'),
+    ('3C', '3C', 'Equatorial Guinea'), ('3D', '3D', 'Eswatini'),
+    ('3E', '3F', 'Panama'), ('3G', '3G', 'Chile'), ('3H', '3U', 'China'),
+    ('3V', '3V', 'Tunisia'), ('3W', '3W', 'Vietnam'), ('3X', '3X', 'Guinea'),
+    ('3Y', '3Y', 'Norway'), ('3Z', '3Z', 'Poland'),
+    ('4A', '4C', 'Mexico'), ('4D', '4I', 'Philippines'), ('4J', '4K', 'Azerbaijan'),
+    ('4L', '4L', 'Georgia'), ('4M', '4M', 'Venezuela'), ('4O', '4O', 'Montenegro'),
+    ('4P', '4S', 'Sri Lanka'), ('4T', '4T', 'Peru'), ('4U', '4U', 'United Nations'),
+    ('4V', '4V', 'Haiti'), ('4W', '4W', 'Timor-Leste'), ('4X', '4X', 'Israel'),
+    ('4Z', '4Z', 'Israel'),
+    ('5A', '5A', 'Libya'), ('5B', '5B', 'Cyprus'), ('5C', '5G', 'Morocco'),
+    ('5H', '5I', 'Tanzania'), ('5J', '5K', 'Colombia'), ('5L', '5M', 'Liberia'),
+    ('5N', '5O', 'Nigeria'), ('5P', '5Q', 'Denmark'), ('5R', '5S', 'Madagascar'),
+    ('5T', '5T', 'Mauritania'), ('5U', '5U', 'Niger'), ('5V', '5V', 'Togo'),
+    ('5W', '5W', 'Samoa'), ('5X', '5X', 'Uganda'), ('5Y', '5Z', 'Kenya'),
+    ('6A', '6B', 'Egypt'), ('6C', '6C', 'Syria'), ('6D', '6J', 'Mexico'),
+    ('6K', '6N', 'South Korea'), ('6O', '6O', 'Somalia'), ('6P', '6S', 'Pakistan'),
+    ('6T', '6U', 'Sudan'), ('6V', '6W', 'Senegal'), ('6X', '6X', 'Madagascar'),
+    ('6Y', '6Y', 'Jamaica'), ('6Z', '6Z', 'Liberia'),
+    ('7A', '7I', 'Indonesia'), ('7J', '7N', 'Japan'), ('7O', '7O', 'Yemen'),
+    ('7P', '7P', 'Lesotho'), ('7Q', '7Q', 'Malawi'), ('7R', '7R', 'Algeria'),
+    ('7S', '7S', 'Sweden'), ('7T', '7Y', 'Algeria'), ('7Z', '7Z', 'Saudi Arabia'),
+    ('8A', '8I', 'Indonesia'), ('8J', '8N', 'Japan'), ('8O', '8O', 'Botswana'),
+    ('8P', '8P', 'Barbados'), ('8Q', '8Q', 'Maldives'), ('8R', '8R', 'Guyana'),
+    ('8S', '8S', 'Sweden'), ('8T', '8Y', 'India'), ('8Z', '8Z', 'Saudi Arabia'),
+    ('9A', '9A', 'Croatia'), ('9B', '9D', 'Iran'), ('9E', '9F', 'Ethiopia'),
+    ('9G', '9G', 'Ghana'), ('9H', '9H', 'Malta'), ('9I', '9J', 'Zambia'),
+    ('9K', '9K', 'Kuwait'), ('9L', '9L', 'Sierra Leone'), ('9M', '9M', 'Malaysia'),
+    ('9N', '9N', 'Nepal'), ('9O', '9T', 'DR Congo'), ('9U', '9U', 'Burundi'),
+    ('9V', '9V', 'Singapore'), ('9W', '9W', 'Malaysia'), ('9X', '9X', 'Rwanda'),
+    ('9Y', '9Z', 'Trinidad and Tobago'),
+]
+
+
+# Return the prefixes of the series of ITU_SERIES, as a dict of prefix:
+# country in the order of the table
+def allocatedPrefixes(series=ITU_SERIES):
+    prefixes = {}
+    for first, last, country in series:
+        if len(first) == 1:
+            prefixes[first] = country
+            for c in string.ascii_uppercase:
+                prefixes[first + c] = country
+        else:
+            for c in range(ord(first[1]), ord(last[1]) + 1):
+                prefixes[first[0] + chr(c)] = country
+
+    return prefixes
+
+
+PREFIXES = allocatedPrefixes()
+
@@ -0,0 +1,341 @@
+
+# keyer.py - in-process Morse Code audio synthesis
+
+
+import collections
+import hashlib
+import os
+import threading
+import wave
+
+import numpy as np
+
+import cwtext
+
+
+# The keyer turns text into PCM audio without any external
+# programs. Timing follows the ARRL/PARIS standard: a dit is 1.2/wpm
+# seconds, a dah is three dits, the gap between the elements of a
+# character is one dit, between characters three dits and between
+# words seven dits. When a Farnsworth speed lower than the character
+# speed is used, the characters are sent at the character speed and
+# the character and word gaps are stretched so that the overall speed
+# is the Farnsworth speed.
+#
+# Each element (dit, dah) is rendered once per keyer with
+# raised-cosine rise and fall edges to avoid key clicks, and the gaps
+# are rendered once as silence. A session is assembled by
+# concatenating these buffers.
+#
+# Rendered characters, and whole words for ninja mode, are kept in a
+# WaveformCache that can be shared by keyers, so a drill that repeats
+# the same characters thousands of times only renders each of them
+# once per set of timing/tone parameters.
+#
+# A keyer may also 'chirp': the pitch of each element starts 'chirp' Hz
+# off the sidetone and settles with a time constant of CHIRP_TIME, as
+# a poorly regulated transmitter does when the key closes.
+
+SAMPLE_RATE = 22050
+
+# rise and fall time of the keying envelope (seconds)
+EDGE_TIME = 0.005
+
+# time constant of the chirp of each element (seconds)
+CHIRP_TIME = 0.01
+
+# peak amplitude of the tone, leaving headroom for noise
+DEFAULT_VOLUME = 0.7
+
+# memory budget of a waveform cache (bytes)
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# the Morse Code of the characters, see cwtext.py for the prosigns
+MORSE_CODE = cwtext.MORSE_CODE
+
+
+# An LRU cache of rendered waveforms with a bounded memory budget. If
+# a cache directory is given, waveforms that are stored with
+# 'persist' are also written there so that they survive across
+# sessions. The cache may be shared by threads, waveforms are rendered
+# outside of the lock.
+class WaveformCache:
+
+    def __init__(self, maxBytes=DEFAULT_CACHE_BYTES, cacheDir=None):
+        self.maxBytes = maxBytes
+        self.cacheDir = cacheDir
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.diskHits = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        if cacheDir:
+            os.makedirs(cacheDir, exist_ok=True)
+
+
+    def get(self, key, renderFunc, persist=False):
+        with self._lock:
+            samples = self._entries.get(key)
+            if samples is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return samples
+
+        diskFile = None
+        if persist and self.cacheDir:
+            digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            diskFile = os.path.join(self.cacheDir, f"{digest}.npy")
+            try:
+                samples = np.load(diskFile)
+                with self._lock:
+                    self.diskHits += 1
+            except (OSError, ValueError):
+                samples = None
+
+        if samples is None:
+            with self._lock:
+                self.misses += 1
+            samples = renderFunc()
+            if diskFile:
+                tmpFile = f"{diskFile}.{os.getpid()}.tmp"
+                with open(tmpFile, 'wb') as fileobj:
+                    np.save(fileobj, samples)
+                os.replace(tmpFile, diskFile)
+
+        with self._lock:
+            self._put(key, samples)
+
+        return samples
+
+
+    def _put(self, key, samples):
+        if samples.nbytes > self.maxBytes or key in self._entries:
+            return
+
+        self._entries[key] = samples
+        self.nbytes += samples.nbytes
+        while self.nbytes > self.maxBytes:
+            oldKey, oldSamples = self._entries.popitem(last=False)
+            self.nbytes -= oldSamples.nbytes
+
+
+    def stats(self):
+        lookups = self.hits + self.diskHits + self.misses
+        hitRate = 100 * (self.hits + self.diskHits) / lookups if lookups else 0
+
+        return (f"waveform cache: {len(self._entries)} entries, "
+                f"{self.nbytes / (1024 * 1024):.1f} MB, hits: {self.hits}, "
+                f"disk hits: {self.diskHits}, misses: {self.misses} "
+                f"({hitRate:.1f}% hit rate)")
+
+
+class Keyer:
+
+    def __init__(self, wpm, farns=None, extraWordSpace=0, freq=600,
+                 sampleRate=SAMPLE_RATE, volume=DEFAULT_VOLUME, noiseSNR=None,
+                 chirp=0, cache=None):
+        self.wpm = wpm
+        self.farns = farns
+        self.extraWordSpace = extraWordSpace
+        self.freq = freq
+        self.sampleRate = sampleRate
+        self.volume = volume
+        self.noiseSNR = noiseSNR
+        self.chirp = chirp
+        self.cache = cache if cache is not None else WaveformCache()
+
+        dit = 1.2 / wpm
+        if farns and farns < wpm:
+            # Farnsworth timing, the total extra delay for the word
+            # PARIS is spread over the 19 dits of character and word
+            # spacing it contains
+            delay = (60 * wpm - 37.2 * farns) / (farns * wpm)
+            charSpace = 3 * delay / 19
+            wordSpace = 7 * delay / 19
+        else:
+            charSpace = 3 * dit
+            wordSpace = 7 * dit
+        wordSpace += extraWordSpace
+
+        self.ditLen = self._samples(dit)
+        self.elementGap = np.zeros(self.ditLen, dtype=np.float32)
+        self.charGap = np.zeros(self._samples(charSpace), dtype=np.float32)
+        self.wordGap = np.zeros(self._samples(wordSpace), dtype=np.float32)
+        self.dit = self._renderTone(self.ditLen)
+        self.dah = self._renderTone(3 * self.ditLen)
+
+
+    def _samples(self, seconds):
+        return int(round(seconds * self.sampleRate))
+
+
+    def _renderTone(self, numSamples):
+        t = np.arange(numSamples, dtype=np.float64) / self.sampleRate
+        phase = 2 * np.pi * self.freq * t
+        if self.chirp:
+            phase += 2 * np.pi * self.chirp * CHIRP_TIME * (1 - np.exp(-t / CHIRP_TIME))
+        tone = np.sin(phase)
+
+        edge = min(self._samples(EDGE_TIME), numSamples // 2)
+        if edge > 0:
+            ramp = 0.5 * (1 - np.cos(np.pi * np.arange(edge) / edge))
+            tone[:edge] *= ramp
+            tone[numSamples - edge:] *= ramp[::-1]
+
+        return (self.volume * tone).astype(np.float32)
+
+
+    # The cache key of a waveform, everything that changes how it
+    # sounds
+    def _cacheKey(self, kind, text):
+        return (kind, text, self.wpm, self.farns, self.extraWordSpace,
+                self.freq, self.sampleRate, self.volume, self.chirp)
+
+
+    def _renderChar(self, code):
+        bufs = []
+        for i, element in enumerate(code):
+            if i > 0:
+                bufs.append(self.elementGap)
+            bufs.append(self.dit if element == '.' else self.dah)
+
+        return np.concatenate(bufs)
+
+
+    # Return the waveform of the Morse Code of a character (or
+    # prosign), without any trailing gap
+    def codeWaveform(self, code):
+        return self.cache.get(self._cacheKey('char', code),
+                              lambda: self._renderChar(code))
+
+
+    # Return the waveform of a character or prosign (e.g. '<AR>'),
+    # without any trailing gap. Characters that have no Morse Code
+    # return None.
+    def charWaveform(self, char):
+        codes = cwtext.codes(char)
+        if len(codes) != 1:
+            return None
+
+        return self.codeWaveform(codes[0])
+
+
+    # The words are split into characters and prosigns by the shared
+    # tokenizer
+    def wordBuffers(self, word):
+        bufs = []
+        for code in cwtext.codes(word):
+            if bufs:
+                bufs.append(self.charGap)
+            bufs.append(self.codeWaveform(code))
+
+        return bufs
+
+
+    def _renderWord(self, word):
+        bufs = self.wordBuffers(word)
+        bufs.append(self.wordGap)
+
+        return np.concatenate(bufs)
+
+
+    # Render a word followed by a word gap. Whole words are cached (and
+    # persisted if the cache has a directory) as they are repeated in
+    # ninja mode.
+    def renderWord(self, word):
+        samples = self.cache.get(self._cacheKey('word', word),
+                                 lambda: self._renderWord(word), persist=True)
+
+        return self.addNoise(samples)
+
+
+    # Yield each word of a list of words (or lines of words) as its own
+    # buffer, followed by its word gap, for streaming playback
+    def iterWords(self, wordLst):
+        for line in wordLst:
+            for word in line.split():
+                yield self.addNoise(self._renderWord(word))
+
+
+    # Render a list of words (or lines of words) into one buffer
+    def renderText(self, wordLst):
+        bufs = []
+        for line in wordLst:
+            for word in line.split():
+                bufs.extend(self.wordBuffers(word))
+                bufs.append(self.wordGap)
+
+        if not bufs:
+            return np.zeros(0, dtype=np.float32)
+
+        return self.addNoise(np.concatenate(bufs))
+
+
+    # Add white noise with a signal to noise ratio (dB) relative to the
+    # power of the tone
+    def addNoise(self, samples):
+        if self.noiseSNR is None:
+            return samples
+
+        signalPower = self.volume ** 2 / 2
+        noiseStd = np.sqrt(signalPower / 10 ** (self.noiseSNR / 10))
+        noise = np.random.default_rng().normal(0, noiseStd, len(samples))
+
+        return (samples + noise).astype(np.float32)
+
+
+def concatenate(bufs):
+    if bufs:
+        return np.concatenate(bufs)
+    else:
+        return np.zeros(0, dtype=np.float32)
+
+
+def toPCM16(samples):
+    return (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+
+
+def duration(numSamples, sampleRate=SAMPLE_RATE):
+    return numSamples / sampleRate
+
+
+# Return the samples of a pydub AudioSegment, mono at 'sampleRate'
+def segmentToSamples(seg, sampleRate=SAMPLE_RATE):
+    seg = seg.set_channels(1).set_sample_width(2).set_frame_rate(sampleRate)
+
+    return (np.frombuffer(seg.raw_data, dtype=np.int16) / 32768).astype(np.float32)
+
+
+# Read a sound file of any format supported by pydub (which requires
+# ffmpeg for mp3)
+def readSoundFile(filename, sampleRate=SAMPLE_RATE):
+    import pydub
+
+    return segmentToSamples(pydub.AudioSegment.from_file(filename), sampleRate)
+
+
+# Write the samples to a sound file. The file is a WAV file unless the
+# filename ends in '.mp3', in which case it is encoded using pydub
+# (which requires ffmpeg).
+def writeSoundFile(filename, samples, sampleRate=SAMPLE_RATE):
+    pcm = toPCM16(samples)
+
+    if os.path.splitext(filename)[1].lower() == '.mp3':
+        import pydub
+        seg = pydub.AudioSegment(data=pcm.tobytes(), sample_width=2,
+                                 frame_rate=sampleRate, channels=1)
+        seg.export(filename, format='mp3')
+    else:
+        with wave.open(filename, 'wb') as fileobj:
+            fileobj.setnchannels(1)
+            fileobj.setsampwidth(2)
+            fileobj.setframerate(sampleRate)
+            fileobj.writeframes(pcm.tobytes())
+
+
+def playSamples(samples, sampleRate=SAMPLE_RATE):
+    import simpleaudio
+    playObj = simpleaudio.play_buffer(toPCM16(samples).tobytes(), 1, 2, sampleRate)
+    playObj.wait_done()
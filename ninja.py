@@ -0,0 +1,85 @@
+
+# ninja.py - ninja mode session scheduling
+
+
+import collections
+import concurrent.futures
+
+import numpy as np
+
+import keyer
+
+
+# A ninja mode session is a timeline of word sequences. Each sequence
+# is the CW for the word, a pause, the spoken word, the CW again, a
+# pause, the alert tone and a pause. The session starts with the alert
+# tone.
+#
+# Rendering a sequence can be slow (speech synthesis may need the
+# network), so a pool of workers renders the sequences of the next
+# 'lookahead' words while the current one plays. Each sequence is
+# rendered into a single buffer with the pauses as silence, so the
+# pauses are exact and playback never waits on synthesis once the
+# lookahead is filled.
+
+LOOKAHEAD = 4
+
+# lookahead when rendering a session to a file, where the only limit is
+# how fast the sequences can be rendered
+RENDER_LOOKAHEAD = 16
+
+# gain of the alert tone, which is louder than the CW and speech
+ALERT_TONE_GAIN_DB = -12
+
+DEFAULT_PAUSE = 1.0
+
+
+class NinjaRenderer:
+
+    # 'cwKeyer' renders the CW, 'speaker' is a tts.Speaker and
+    # 'alertTone' is the samples of the alert tone.
+    def __init__(self, cwKeyer, speaker, alertTone, pause=DEFAULT_PAUSE,
+                 phonetic=False):
+        self.cwKeyer = cwKeyer
+        self.speaker = speaker
+        self.alertTone = alertTone
+        self.phonetic = phonetic
+        self.pause = np.zeros(int(round(pause * cwKeyer.sampleRate)), dtype=np.float32)
+
+
+    def leadIn(self):
+        return self.alertTone
+
+
+    def renderSequence(self, word):
+        cw = self.cwKeyer.renderWord(word)
+        speech = self.speaker.speak(word, phonetic=self.phonetic)
+
+        return np.concatenate([cw, self.pause, speech, cw, self.pause,
+                               self.alertTone, self.pause])
+
+
+def loadAlertTone(toneFile, sampleRate=keyer.SAMPLE_RATE):
+    return keyer.readSoundFile(toneFile, sampleRate) * 10 ** (ALERT_TONE_GAIN_DB / 20)
+
+
+# Yield the lead-in and then the sequence of each word, in order. The
+# sequences of up to 'lookahead' words are rendered ahead by a pool of
+# worker threads.
+def iterSession(wordLst, renderer, lookahead=LOOKAHEAD):
+    yield renderer.leadIn()
+
+    words = iter(wordLst)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=lookahead) as pool:
+        pending = collections.deque()
+        for word in words:
+            pending.append(pool.submit(renderer.renderSequence, word))
+            if len(pending) >= lookahead:
+                break
+
+        while pending:
+            sequence = pending.popleft().result()
+            for word in words:
+                pending.append(pool.submit(renderer.renderSequence, word))
+                break
+            yield sequence
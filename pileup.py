@@ -0,0 +1,154 @@
+
+# pileup.py - contest pileups of overlapping callers
+
+
+import random
+
+import numpy as np
+
+import keyer
+
+
+# A pileup is a round of several stations calling at once, as when a
+# DX station or contester finishes a QSO. Each caller sends its
+# callsign once or twice at its own speed, pitch offset from the
+# sidetone and strength, starting at a random time in the first
+# START_JITTER seconds of the round. The callers are rendered by their
+# own keyers and mixed into one buffer, each caller being added to its
+# slice of the buffer as one array operation, and the rounds follow
+# each other with ROUND_GAP seconds of silence.
+#
+# The answer key lists every caller of every round, with when it was
+# heard and whether it was audible: a caller is audible if it is no
+# more than AUDIBLE_RANGE dB below the strongest caller of its round
+# and, with noise, at least MIN_AUDIBLE_SNR dB above the noise. When
+# the mix is turned down to keep it from clipping the gain is returned
+# with it, for the noise to be turned down as well, and the callers are
+# kept inside the noise band so none is heard in the clear.
+
+# ratio of the callers' speeds to the session speed
+WPM_SPREAD = (0.8, 1.3)
+
+# largest pitch offset (Hz) of a caller from the sidetone, without noise
+PITCH_SPREAD = 300
+
+# level (dB) of the callers relative to the strongest possible caller
+LEVEL_RANGE = (-24.0, 0.0)
+
+# seconds
+START_JITTER = 1.5
+ROUND_GAP    = 2.0
+
+AUDIBLE_RANGE   = 18.0
+MIN_AUDIBLE_SNR = -6.0
+
+# fields of the answer key, in order
+ANSWER_KEY_FIELDS = ['round', 'call', 'start', 'end', 'wpm', 'offset', 'level',
+                     'repeat', 'audible']
+
+
+# Return the callers of a round, dicts of their call and how they are
+# sent, up to 'pitchSpread' Hz from the sidetone
+def makeCallers(callLst, wpm, pitchSpread=PITCH_SPREAD):
+    callers = []
+    for call in callLst:
+        callers.append({'call': call,
+                        'wpm': max(5, int(round(wpm * random.uniform(*WPM_SPREAD)))),
+                        'offset': int(random.uniform(-pitchSpread, pitchSpread)),
+                        'level': round(random.uniform(*LEVEL_RANGE), 1),
+                        'repeat': random.randint(1, 2),
+                        'start': random.uniform(0, START_JITTER)})
+
+    return callers
+
+
+# Set 'audible' for the callers of a round. 'snr' is the SNR (dB) of
+# the strongest possible caller, None without noise.
+def markAudible(callers, snr=None):
+    strongest = max(caller['level'] for caller in callers)
+    for caller in callers:
+        audible = caller['level'] >= strongest - AUDIBLE_RANGE
+        if snr is not None:
+            audible = audible and snr + caller['level'] >= MIN_AUDIBLE_SNR
+        caller['audible'] = audible
+
+
+class PileupGenerator:
+
+    # The callers are sent up to 'pitchSpread' Hz around the sidetone
+    # 'freq', the strongest possible caller at 'volume'. 'cache' is the
+    # waveform cache shared by the callers' keyers.
+    def __init__(self, wpm, freq, sampleRate=keyer.SAMPLE_RATE,
+                 volume=keyer.DEFAULT_VOLUME, cache=None, pitchSpread=PITCH_SPREAD):
+        self.wpm = wpm
+        self.freq = freq
+        self.pitchSpread = pitchSpread
+        self.sampleRate = sampleRate
+        self.volume = volume
+        self.cache = cache if cache is not None else keyer.WaveformCache()
+
+
+    def _renderCaller(self, caller):
+        callerKeyer = keyer.Keyer(caller['wpm'], freq=self.freq + caller['offset'],
+                                  sampleRate=self.sampleRate,
+                                  volume=self.volume * 10 ** (caller['level'] / 20),
+                                  cache=self.cache)
+
+        return callerKeyer.renderText([' '.join([caller['call'].lower()] *
+                                                caller['repeat'])])
+
+
+    # Return the samples of the rounds of callers (lists of callsigns),
+    # the gain they were turned down by and the answer key, the list of
+    # callers with their round and the times (seconds) they started and
+    # ended
+    def generate(self, rounds, snr=None):
+        answerKey = []
+        waves = []
+        roundStart = 0.0
+        for roundNum, callLst in enumerate(rounds):
+            callers = makeCallers(callLst, self.wpm, self.pitchSpread)
+            markAudible(callers, snr)
+
+            roundEnd = roundStart
+            for caller in callers:
+                wave = self._renderCaller(caller)
+                start = int((roundStart + caller['start']) * self.sampleRate)
+                waves.append((start, wave))
+                caller['round'] = roundNum + 1
+                caller['start'] = round(start / self.sampleRate, 3)
+                caller['end'] = round((start + len(wave)) / self.sampleRate, 3)
+                roundEnd = max(roundEnd, caller['end'])
+                answerKey.append(caller)
+
+            roundStart = roundEnd + ROUND_GAP
+
+        samples = np.zeros(int(roundStart * self.sampleRate) + 1, dtype=np.float32)
+        for start, wave in waves:
+            samples[start:start + len(wave)] += wave
+
+        # strong callers on top of each other can add up to more than
+        # full scale, the whole session is turned down rather than
+        # clipped
+        peak = np.abs(samples).max() if len(samples) else 0
+        gain = 1 / peak if peak > 1 else 1.0
+        samples *= gain
+
+        return samples, gain, answerKey
+
+
+# Split the callsigns into rounds of 'numCallers'
+def splitRounds(callLst, numCallers):
+    return [callLst[i:i + numCallers] for i in range(0, len(callLst), numCallers)]
+
+
+def formatAnswerKey(answerKey):
+    lines = [f"{'round':>5}  {'call':8s} {'start':>7} {'end':>7} {'wpm':>4} "
+             f"{'pitch':>6} {'level':>6}  audible"]
+    for caller in answerKey:
+        lines.append(f"{caller['round']:5d}  {caller['call']:8s} "
+                     f"{caller['start']:7.2f} {caller['end']:7.2f} {caller['wpm']:4d} "
+                     f"{caller['offset']:+6d} {caller['level']:6.1f}  "
+                     f"{'yes' if caller['audible'] else 'no'}")
+
+    return '\n'.join(lines)
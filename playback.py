@@ -0,0 +1,192 @@
+
+# playback.py - streaming audio playback
+
+
+import queue
+import threading
+import time
+import wave
+
+import keyer
+
+
+# A session is played as a producer/consumer pipeline. The producer
+# (the caller) renders the session one chunk (e.g. word) at a time into
+# a bounded queue and a playback thread drains the queue into a
+# sink. Playback starts as soon as the first chunk is rendered, and
+# memory use is bounded by the queue depth rather than the length of
+# the session.
+
+QUEUE_DEPTH = 8
+
+
+# Play chunks on the audio device. Clean CW is played one buffer per
+# chunk, back to back: each chunk ends with its word gap, so the small
+# latency of starting the next buffer falls in silence. With a channel
+# simulation (noise, QSB or QRM) there is no silence between the words
+# and a gap between the buffers is heard as a dropout, so with
+# 'continuous' the chunks are written to one output stream that plays
+# for the whole session. A write to the stream returns once the chunk
+# is queued behind the audio still playing, about when that audio
+# ends, so the next chunk starts when it is written as with the
+# buffers.
+class AudioSink:
+
+    def __init__(self, sampleRate=keyer.SAMPLE_RATE, continuous=False):
+        self.sampleRate = sampleRate
+        self._stream = None
+        if continuous:
+            try:
+                import sounddevice
+            except ImportError:
+                print("WARNING: sounddevice isn't installed, the channel "
+                      "simulation will drop out between the words")
+            else:
+                self._stream = sounddevice.OutputStream(samplerate=sampleRate,
+                                                        channels=1, dtype='int16')
+                self._stream.start()
+
+        if self._stream is None:
+            import simpleaudio
+            self._simpleaudio = simpleaudio
+
+
+    def write(self, samples):
+        if self._stream is not None:
+            self._stream.write(keyer.toPCM16(samples).reshape(-1, 1))
+            return
+
+        playObj = self._simpleaudio.play_buffer(keyer.toPCM16(samples).tobytes(),
+                                                1, 2, self.sampleRate)
+        playObj.wait_done()
+
+
+    # Wait for the stream to finish playing
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+
+# Write chunks to a WAV file as they arrive
+class WavSink:
+
+    def __init__(self, filename, sampleRate=keyer.SAMPLE_RATE):
+        self.filename = filename
+        self.sampleRate = sampleRate
+        self._wave = wave.open(filename, 'wb')
+        self._wave.setnchannels(1)
+        self._wave.setsampwidth(2)
+        self._wave.setframerate(sampleRate)
+
+
+    def write(self, samples):
+        self._wave.writeframes(keyer.toPCM16(samples).tobytes())
+
+
+    def close(self):
+        self._wave.close()
+
+
+# Collect chunks and write them to a sound file when the session ends,
+# for formats (mp3) that can't be written incrementally
+class SoundFileSink:
+
+    def __init__(self, filename, sampleRate=keyer.SAMPLE_RATE):
+        self.filename = filename
+        self.sampleRate = sampleRate
+        self._chunks = []
+
+
+    def write(self, samples):
+        self._chunks.append(samples)
+
+
+    def close(self):
+        keyer.writeSoundFile(self.filename, keyer.concatenate(self._chunks),
+                             self.sampleRate)
+
+
+class TeeSink:
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+
+    def write(self, samples):
+        for sink in self.sinks:
+            sink.write(samples)
+
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def openFileSink(filename, sampleRate=keyer.SAMPLE_RATE):
+    if filename.lower().endswith('.mp3'):
+        return SoundFileSink(filename, sampleRate)
+    else:
+        return WavSink(filename, sampleRate)
+
+
+# Stream the chunks from the iterable 'chunks' into the sink and close
+# the sink. If 'onChunk' is given it is called from the playback
+# thread with the number (from 0) of each chunk once it has been
+# written to the sink, e.g. to display the word that was just
+# played. 'onChunkStart' is called the same way just before each chunk
+# is written, e.g. to timestamp the start of its audio. Returns a dict
+# of statistics: the time from the start of the call to the first
+# chunk reaching the sink, the number of chunks and the number of
+# samples.
+def streamChunks(chunks, sink, queueDepth=QUEUE_DEPTH, onChunk=None,
+                 onChunkStart=None):
+    chunkQueue = queue.Queue(maxsize=queueDepth)
+    stop = threading.Event()
+    stats = {'firstChunk': None, 'chunks': 0, 'samples': 0}
+    errors = []
+    startTime = time.monotonic()
+
+    def drain():
+        while True:
+            chunk = chunkQueue.get()
+            if chunk is None:
+                break
+            if stop.is_set():
+                continue
+            try:
+                if onChunkStart:
+                    onChunkStart(stats['chunks'])
+                sink.write(chunk)
+                if stats['firstChunk'] is None:
+                    stats['firstChunk'] = time.monotonic() - startTime
+                if onChunk:
+                    onChunk(stats['chunks'])
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+                continue
+            stats['chunks'] += 1
+            stats['samples'] += len(chunk)
+
+    thread = threading.Thread(target=drain, daemon=True)
+    thread.start()
+
+    try:
+        for chunk in chunks:
+            if stop.is_set():
+                break
+            chunkQueue.put(chunk)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        chunkQueue.put(None)
+        thread.join()
+        sink.close()
+
+    if errors:
+        raise errors[0]
+
+    return stats
@@ -0,0 +1,208 @@
+
+# qso.py - practice QSOs from templates and the local callsign data
+
+
+import datetime
+import random
+import re
+import unicodedata
+
+import cwindex
+
+
+# A QSO is a sequence of numbered lines, a ragchew in the style of an
+# SKCC contact: the CQ (1), the answer (2), the exchange of the station
+# that called CQ (3) and of the answering station (4), and the
+# sign-offs (5, 6). Each line has a few templates, one of which is
+# picked at random, filled in from the fields of the QSO: the two
+# stations, their names and QTHs, signal reports, SKCC numbers and the
+# time of day salutation.
+#
+# The stations come from the callsign index, which holds a station
+# table for each callsign table: '<name>.stations', a string table of
+# 'name|city|location' (the state of a U.S. station, the country of a
+# foreign one) in the sorted order of the callsigns. A callsign drawn
+# from a ranked table (so it can be sent with the current characters)
+# finds its station through the ranked table's '.pos' array, so
+# drawing a station is a random position and two lookups: O(1),
+# without reading the callsign files.
+
+QSO_LINES = {
+    1: ["CQ CQ CQ DE {de} {de} {de} K",
+        "CQ CQ DE {de} {de} K",
+        "CQ SKCC CQ SKCC DE {de} {de} K"],
+    2: ["{de} DE {dx} {dx} <AR>",
+        "{de} {de} DE {dx} {dx} <AR>",
+        "{de} DE {dx} {dx} {dx} <AR>"],
+    3: ["{dx} DE {de} {salutation} TNX FER CALL <BT> UR RST {dxRst} {dxRst} <BT> "
+        "HR QTH {deQth} {deQth} <BT> NAME {deName} {deName} SKCC {deSkcc} {deSkcc} "
+        "<BT> HW? {dx} DE {de} <KN>",
+        "{dx} DE {de} R R {salutation} ES TNX FER CALL <BT> RST {dxRst} {dxRst} <BT> "
+        "QTH {deQth} {deQth} <BT> OP {deName} {deName} <BT> SKCC NR {deSkcc} "
+        "{deSkcc} <BT> HW CPY? {dx} DE {de} <KN>"],
+    4: ["{de} DE {dx} R R {salutation} {deName} ES TNX FER RPT <BT> UR RST {deRst} "
+        "{deRst} <BT> HR QTH {dxQth} {dxQth} <BT> NAME {dxName} {dxName} SKCC "
+        "{dxSkcc} {dxSkcc} <BT> HW? {de} DE {dx} <KN>",
+        "{de} DE {dx} FB {deName} TNX <BT> RST {deRst} {deRst} <BT> QTH {dxQth} "
+        "{dxQth} <BT> OP {dxName} {dxName} <BT> SKCC NR {dxSkcc} {dxSkcc} <BT> "
+        "{de} DE {dx} <KN>"],
+    5: ["{dx} DE {de} TNX FER FB QSO {dxName} <BT> HP CU AGN 73 <SK> {dx} DE {de} E E",
+        "{dx} DE {de} R TNX {dxName} FER QSO ES RPT <BT> 73 ES GL <SK> E E"],
+    6: ["{de} DE {dx} TNX FER QSO {deName} <BT> 73 <SK> {de} DE {dx} E E",
+        "{de} DE {dx} R R TNX {deName} CUL 73 <SK> E E"],
+}
+
+DEFAULT_QSO_LINES = sorted(QSO_LINES)
+
+# fraction of the stations that are U.S. stations
+US_STATIONS = 0.7
+
+# random stations to try for one with a name and a city
+MAX_TRIES = 20
+
+SKCC_NUMBERS = (1, 25000)
+
+
+# Return the text of a field of the callsign data as it is sent:
+# upper case ASCII, or '' if there is nothing to send
+def cleanField(text):
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    text = re.sub(r'[^A-Za-z0-9/ ]+', ' ', text).strip().upper()
+
+    return ' '.join(text.split()) if re.search('[A-Z]', text) else ''
+
+
+# Return the words of a field as it is sent, without the words with
+# digits in them (e.g. a postcode or a callsign)
+def fieldWords(text):
+    return [w for w in cleanField(text).split() if not re.search(r'\d', w)]
+
+
+# Return the station table record of a callsign, the name is the first
+# word of the first name, or of the full name if there is no first name
+def stationRecord(firstName, fullName, city, location):
+    names = fieldWords(firstName) or fieldWords(fullName)
+    name = names[0] if names else ''
+
+    # some cities have the postcode in them
+    city = ' '.join(fieldWords(city))
+
+    return '|'.join([name, city, cleanField(location)])
+
+
+# Add the station table of the callsign table 'name' to the dict of
+# arrays of an index, 'records' are the station records of the
+# callsigns in their sorted order
+def addStationTable(arrays, name, records):
+    cwindex.addStrings(arrays, f"{name}.stations", records)
+
+
+class StationTable:
+
+    # The stations of the callsign table 'name' of an open index, for
+    # the character order 'orderName'
+    def __init__(self, index, name, orderName):
+        self.index = index
+        self.view = f"{name}.{orderName}"
+        self.stations = f"{name}.stations"
+        self.pos = index.array(f"{self.view}.pos")
+        self.bounds = index.array(f"{self.view}.bounds")
+
+
+    # Return the number of stations whose callsign can be sent with the
+    # first numChars characters
+    def count(self, numChars):
+        return self.bounds[min(max(numChars, 0), len(self.bounds) - 1)]
+
+
+    def station(self, rankedPos):
+        name, city, location = self.index.string(self.stations,
+                                                 self.pos[rankedPos]).split('|')
+
+        return {'call': self.index.string(self.view, rankedPos), 'name': name,
+                'city': city, 'location': location}
+
+
+    # Return a random station whose callsign can be sent with the first
+    # numChars characters, preferably one with a name and a city
+    def randomStation(self, numChars):
+        count = self.count(numChars)
+        if not count:
+            return None
+
+        for i in range(MAX_TRIES):
+            station = self.station(random.randrange(count))
+            if station['name'] and station['city']:
+                break
+
+        return station
+
+
+def getSalutation(now=None):
+    hour = (now or datetime.datetime.now()).hour
+    if 3 <= hour < 12:
+        return "GM"
+    elif 12 <= hour < 20:
+        return "GE"
+    else:
+        return "GN"
+
+
+def randomRST():
+    return f"{random.randint(3, 5)}{random.randint(3, 9)}9"
+
+
+class QSOGenerator:
+
+    # 'usTable' and 'foreignTable' are the StationTables of the U.S. and
+    # foreign callsigns, 'numChars' the number of characters the
+    # callsigns can be sent with
+    def __init__(self, usTable, foreignTable, numChars):
+        self.tables = [(table, weight) for table, weight in
+                       [(usTable, US_STATIONS), (foreignTable, 1 - US_STATIONS)]
+                       if table.count(numChars)]
+        self.numChars = numChars
+        self.salutation = getSalutation()
+
+
+    def __bool__(self):
+        return bool(self.tables)
+
+
+    def randomStation(self):
+        if len(self.tables) == 1 or random.random() < self.tables[0][1]:
+            table = self.tables[0][0]
+        else:
+            table = self.tables[1][0]
+
+        return table.randomStation(self.numChars)
+
+
+    # Return the fields of a QSO between two random stations
+    def fields(self):
+        de = self.randomStation()
+        for i in range(MAX_TRIES):
+            dx = self.randomStation()
+            if dx['call'] != de['call']:
+                break
+
+        fields = {'salutation': self.salutation}
+        for prefix, station in [('de', de), ('dx', dx)]:
+            fields[prefix] = station['call']
+            fields[f"{prefix}Name"] = station['name'] or 'OM'
+            location = station['location']
+            if location == station['city']:
+                location = ''
+            fields[f"{prefix}Qth"] = ' '.join(f for f in [station['city'], location] if f)
+            fields[f"{prefix}Rst"] = randomRST()
+            fields[f"{prefix}Skcc"] = random.randint(*SKCC_NUMBERS)
+
+        return fields
+
+
+    # Return the lines of a QSO, 'lines' are the numbers of the lines to
+    # include
+    def generate(self, lines=DEFAULT_QSO_LINES):
+        fields = self.fields()
+
+        return [random.choice(QSO_LINES[line]).format(**fields) for line in lines]
@@ -0,0 +1,207 @@
+
+# sampler.py - weighted random selection of words
+
+
+import random
+
+
+# A session selects a few words from a corpus of thousands. Rather
+# than shuffling the whole corpus for every session, a Sampler is built
+# once per (filtered) corpus and each session draws its words from it:
+#
+#   - with replacement, from an alias table (Vose's method), O(1) per
+#     draw
+#   - without replacement, from a tree of cumulative weights (Fenwick
+#     tree), O(log n) per draw. The weights of the drawn words are set
+#     to zero while the session is drawn and restored afterwards, so
+#     the tree is reused by the next session.
+#
+# Uniform samplers don't need either table, random.sample() and
+# random.choices() are already O(k) for k words.
+#
+# The distributions are:
+#   uniform - every word is equally likely
+#   zipf    - words are weighted by their rank in the word file, which
+#             is ordered by frequency of use (1 / rank)
+#   weak    - words containing the given weak characters are boosted,
+#             by WEAK_CHAR_BOOST for each different weak character
+
+DISTRIBUTIONS = ['uniform', 'zipf', 'weak']
+
+ZIPF_EXPONENT = 1.0
+
+WEAK_CHAR_BOOST = 4.0
+
+
+def zipfWeights(ranks, exponent=ZIPF_EXPONENT):
+    return [1 / (rank + 1) ** exponent for rank in ranks]
+
+
+def weakCharWeights(words, weakChars, baseWeights=None, boost=WEAK_CHAR_BOOST):
+    weakChars = set(weakChars.lower())
+    weights = []
+    for i, word in enumerate(words):
+        weight = baseWeights[i] if baseWeights is not None else 1.0
+        weights.append(weight * boost ** len(weakChars.intersection(word.lower())))
+
+    return weights
+
+
+# Walker's alias method, as constructed by Vose. Each slot i of the
+# table is drawn with equal probability and then either i or its
+# alias is returned according to prob[i].
+class AliasTable:
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        if n == 0 or total <= 0:
+            raise ValueError("alias table needs a positive total weight")
+
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        # what is left over has a probability of 1 up to rounding
+
+
+    def draw(self):
+        u = random.random() * len(self.prob)
+        i = int(u)
+        if u - i < self.prob[i]:
+            return i
+        else:
+            return self.alias[i]
+
+
+# A Fenwick (binary indexed) tree of weights supporting O(log n)
+# weighted draws and weight updates
+class WeightTree:
+
+    def __init__(self, weights):
+        self.weights = list(weights)
+        self.total = sum(self.weights)
+        n = len(self.weights)
+
+        self._tree = [0.0] + self.weights
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                self._tree[j] += self._tree[i]
+
+        self._topStep = 1
+        while self._topStep * 2 <= n:
+            self._topStep *= 2
+
+
+    def update(self, i, weight):
+        delta = weight - self.weights[i]
+        self.weights[i] = weight
+        self.total += delta
+
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+
+    # Return the index of the item in which the cumulative weight
+    # 'target' falls
+    def find(self, target):
+        pos = 0
+        step = self._topStep
+        while step:
+            nextPos = pos + step
+            if nextPos < len(self._tree) and self._tree[nextPos] <= target:
+                pos = nextPos
+                target -= self._tree[nextPos]
+            step //= 2
+
+        return pos
+
+
+    def draw(self):
+        # rounding in the cumulative weights can land on an item with
+        # no weight (e.g. one that has been drawn), draw again
+        while True:
+            i = self.find(random.random() * self.total)
+            if i < len(self.weights) and self.weights[i] > 0:
+                return i
+
+
+class Sampler:
+
+    # 'weights' is None for a uniform sampler
+    def __init__(self, items, weights=None):
+        if weights is not None and len(weights) != len(items):
+            raise ValueError("sampler needs one weight per item")
+
+        self.items = items
+        self.weights = weights
+        self._aliasTable = None
+        self._weightTree = None
+        if weights is not None:
+            self._numWeighted = sum(1 for w in weights if w > 0)
+        else:
+            self._numWeighted = len(items)
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    # Return 'k' items, or as many items as there are if drawing
+    # without replacement
+    def sample(self, k, replace=False):
+        if not self.items or k <= 0:
+            return []
+
+        if self.weights is None:
+            if replace:
+                return random.choices(self.items, k=k)
+            else:
+                return random.sample(self.items, min(k, len(self.items)))
+
+        if replace:
+            if self._aliasTable is None:
+                self._aliasTable = AliasTable(self.weights)
+            return [self.items[self._aliasTable.draw()] for i in range(k)]
+
+        if self._weightTree is None:
+            self._weightTree = WeightTree(self.weights)
+
+        drawn = []
+        for n in range(min(k, self._numWeighted)):
+            i = self._weightTree.draw()
+            self._weightTree.update(i, 0)
+            drawn.append(i)
+
+        for i in drawn:
+            self._weightTree.update(i, self.weights[i])
+
+        return [self.items[i] for i in drawn]
+
+
+# Build a sampler for the words with the named distribution. 'ranks'
+# are the positions of the words in the (frequency ordered) word file.
+def getSampler(words, ranks, distribution='uniform', weakChars=''):
+    if distribution == 'uniform':
+        return Sampler(words)
+    elif distribution == 'zipf':
+        return Sampler(words, zipfWeights(ranks))
+    elif distribution == 'weak':
+        return Sampler(words, weakCharWeights(words, weakChars))
+    else:
+        raise ValueError(f"unknown distribution: {distribution}")
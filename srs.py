@@ -0,0 +1,195 @@
+
+# srs.py - spaced repetition of words, callsigns and characters
+
+
+import os
+import sqlite3
+import time
+
+
+# The review store is an sqlite database of the results of practice
+# sessions, one row per reviewed item (a word, callsign or character)
+# holding its spaced repetition schedule, plus a log of every
+# review. The schedule follows the SM-2 algorithm: each result is
+# graded from 0 (not copied at all) to 5 (copied perfectly). A pass
+# (grade 3 or better) sends the item further into the future, by the
+# item's ease factor, which itself is adjusted by the grade. A fail
+# starts the item over and lowers its ease.
+#
+# Items are looked up through indexes on (kind, item) and (kind, due),
+# so selecting the items that are due for review reads only those rows,
+# however many reviews have been logged.
+
+# grades of the results
+GRADE_PERFECT = 5
+GRADE_PASS    = 4
+GRADE_HARD    = 3
+GRADE_FAIL    = 1
+
+# seconds
+LEARNING_INTERVAL = 10 * 60
+FIRST_INTERVAL    = 24 * 60 * 60
+
+DEFAULT_EASE = 2.5
+MIN_EASE     = 1.3
+
+DATA_DIR_NAME = 'cwwords'
+REVIEW_DB_FILE = 'reviews.db'
+
+
+# Return the per-user data directory, creating it if necessary. Unlike
+# the index cache the review store can't be rebuilt, so it is kept
+# with the user's data.
+def getDataDir():
+    dataHome = os.environ.get('XDG_DATA_HOME',
+                              os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    dataDir = os.path.join(dataHome, DATA_DIR_NAME)
+    os.makedirs(dataDir, exist_ok=True)
+
+    return dataDir
+
+
+# Return the new (interval, ease, reps, lapses) of an item after a
+# review with 'grade'
+def schedule(grade, interval, ease, reps, lapses):
+    if grade < GRADE_HARD:
+        return LEARNING_INTERVAL, max(MIN_EASE, ease - 0.2), 0, lapses + 1
+
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    if reps == 0:
+        interval = LEARNING_INTERVAL
+    elif reps == 1:
+        interval = FIRST_INTERVAL
+    else:
+        interval = interval * ease
+
+    return interval, ease, reps + 1, lapses
+
+
+class ReviewDatabase:
+
+    def __init__(self, dbFile):
+        # connect to the sqlite database, if the database doesn't
+        # exist, it will be created. The connection is kept open for
+        # the session so that each lookup is only a query.
+        self.databaseFile = dbFile
+        self.conn = sqlite3.connect(dbFile)
+
+        with self.conn:
+            sql =  "CREATE TABLE IF NOT EXISTS item "
+            sql += "(item_id integer primary key, "
+            sql += "kind varchar(8) NOT NULL, item varchar(64) NOT NULL, "
+            sql += "ease float NOT NULL, interval float NOT NULL, "
+            sql += "reps int NOT NULL, lapses int NOT NULL, "
+            sql += "due float NOT NULL, last_review float"
+            sql += ")"
+            self.conn.execute(sql)
+
+            sql =  "CREATE UNIQUE INDEX IF NOT EXISTS item_kind_item "
+            sql += "ON item (kind, item)"
+            self.conn.execute(sql)
+
+            sql =  "CREATE INDEX IF NOT EXISTS item_kind_due "
+            sql += "ON item (kind, due)"
+            self.conn.execute(sql)
+
+            sql =  "CREATE TABLE IF NOT EXISTS review "
+            sql += "(review_id integer primary key, "
+            sql += "item_id int NOT NULL, reviewed float NOT NULL, "
+            sql += "grade int NOT NULL, latency float, "
+            sql += "FOREIGN KEY (item_id) REFERENCES item(item_id)"
+            sql += ")"
+            self.conn.execute(sql)
+
+            sql =  "CREATE INDEX IF NOT EXISTS review_item "
+            sql += "ON review (item_id)"
+            self.conn.execute(sql)
+
+
+    def close(self):
+        self.conn.close()
+
+
+    # Record the results of a session, a list of (item, grade,
+    # latency) tuples for items of 'kind' ('word', 'call' or 'char'),
+    # latency is the time (seconds) to respond or None.
+    def recordResults(self, kind, results, now=None):
+        if now is None:
+            now = time.time()
+
+        with self.conn:
+            cur = self.conn.cursor()
+            for item, grade, latency in results:
+                sql =  "SELECT item_id, ease, interval, reps, lapses FROM item "
+                sql += "WHERE kind = ? AND item = ?"
+                cur.execute(sql, (kind, item))
+                row = cur.fetchone()
+                if row is None:
+                    itemID = None
+                    ease, interval, reps, lapses = DEFAULT_EASE, 0.0, 0, 0
+                else:
+                    itemID, ease, interval, reps, lapses = row
+
+                interval, ease, reps, lapses = schedule(grade, interval, ease,
+                                                        reps, lapses)
+                values = (ease, interval, reps, lapses, now + interval, now)
+                if itemID is None:
+                    sql =  "INSERT INTO item (kind, item, ease, interval, reps, "
+                    sql += "lapses, due, last_review) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                    cur.execute(sql, (kind, item) + values)
+                    itemID = cur.lastrowid
+                else:
+                    sql =  "UPDATE item SET ease = ?, interval = ?, reps = ?, "
+                    sql += "lapses = ?, due = ?, last_review = ? WHERE item_id = ?"
+                    cur.execute(sql, values + (itemID,))
+
+                sql =  "INSERT INTO review (item_id, reviewed, grade, latency) "
+                sql += "VALUES (?, ?, ?, ?)"
+                cur.execute(sql, (itemID, now, grade, latency))
+
+
+    # Return up to 'limit' items of 'kind' that are due for review,
+    # most overdue first. Only the items for which accept(item) is true
+    # (e.g. the item can be sent with the current character set) are
+    # returned, at most 'scanLimit' due items are examined.
+    def dueItems(self, kind, limit, accept=None, now=None, scanLimit=1000):
+        if now is None:
+            now = time.time()
+
+        sql =  "SELECT item FROM item WHERE kind = ? AND due <= ? "
+        sql += "ORDER BY due LIMIT ?"
+
+        itemLst = []
+        for row in self.conn.execute(sql, (kind, now, scanLimit)):
+            if accept is None or accept(row[0]):
+                itemLst.append(row[0])
+                if len(itemLst) >= limit:
+                    break
+
+        return itemLst
+
+
+    # Return the items of 'kind' that have been hardest to copy, lowest
+    # ease first, only those that have failed at least once
+    def weakItems(self, kind, limit):
+        sql =  "SELECT item FROM item WHERE kind = ? AND lapses > 0 "
+        sql += "ORDER BY ease, lapses DESC LIMIT ?"
+
+        return [row[0] for row in self.conn.execute(sql, (kind, limit))]
+
+
+    def stats(self, kind, now=None):
+        if now is None:
+            now = time.time()
+
+        sql =  "SELECT count(*), sum(due <= ?), sum(lapses) FROM item WHERE kind = ?"
+        items, due, lapses = self.conn.execute(sql, (now, kind)).fetchone()
+
+        return {'items': items, 'due': due or 0, 'lapses': lapses or 0}
+
+
+def openReviewDatabase(dbFile=None):
+    if dbFile is None:
+        dbFile = os.path.join(getDataDir(), REVIEW_DB_FILE)
+
+    return ReviewDatabase(dbFile)
@@ -0,0 +1,164 @@
+
+# tts.py - text to speech engines for ninja mode
+
+
+import io
+import shutil
+import subprocess
+import wave
+
+import numpy as np
+
+import keyer
+
+
+# Ninja mode speaks each word (or callsign) after its CW. The speech is
+# produced by one of several engines, all of which return decoded
+# audio samples at the keyer sample rate:
+#   gtts   - Google Text-to-Speech (requires network access)
+#   espeak - the local, offline 'espeak-ng' (or 'espeak') program
+#   stub   - an offline, deterministic stand-in for testing
+#
+# A Speaker combines an engine with a content-addressed waveform cache
+# keyed by (engine, voice, phonetic flag, text) that is kept on disk,
+# so a word that has been spoken before, in this or any earlier
+# session, costs a cache lookup rather than a synthesis.
+
+TTS_ENGINES = ['gtts', 'espeak', 'stub']
+
+
+class TTSError(Exception):
+    pass
+
+
+def resample(samples, fromRate, toRate):
+    if fromRate == toRate or len(samples) == 0:
+        return samples
+
+    numSamples = int(round(len(samples) * toRate / fromRate))
+    t = np.arange(numSamples) * (fromRate / toRate)
+
+    return np.interp(t, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def decodeWav(data, sampleRate=keyer.SAMPLE_RATE):
+    with wave.open(io.BytesIO(data), 'rb') as fileobj:
+        if fileobj.getsampwidth() != 2:
+            raise TTSError(f"unsupported sample width: {fileobj.getsampwidth()}")
+        channels = fileobj.getnchannels()
+        rate = fileobj.getframerate()
+        pcm = np.frombuffer(fileobj.readframes(fileobj.getnframes()), dtype=np.int16)
+
+    samples = pcm.reshape(-1, channels).mean(axis=1) / 32768
+
+    return resample(samples.astype(np.float32), rate, sampleRate)
+
+
+class GTTSEngine:
+
+    name = 'gtts'
+    # Right now, I like the Canadian voice in gTTS
+    defaultVoice = 'en-ca'
+
+    def __init__(self, voice=None, sampleRate=keyer.SAMPLE_RATE):
+        self.voice = voice or self.defaultVoice
+        self.sampleRate = sampleRate
+
+
+    def synthesize(self, text):
+        import gtts
+        import pydub
+
+        mp3 = io.BytesIO()
+        gtts.gTTS(text, lang=self.voice).write_to_fp(mp3)
+        mp3.seek(0)
+        seg = pydub.AudioSegment.from_file(mp3, format='mp3')
+
+        return keyer.segmentToSamples(seg, self.sampleRate)
+
+
+class EspeakEngine:
+
+    name = 'espeak'
+    defaultVoice = 'en-us'
+
+    def __init__(self, voice=None, sampleRate=keyer.SAMPLE_RATE):
+        self.voice = voice or self.defaultVoice
+        self.sampleRate = sampleRate
+        self.program = findEspeak()
+        if self.program is None:
+            raise TTSError("the program 'espeak-ng' (or 'espeak') is not "
+                           "available on this system")
+
+
+    def synthesize(self, text):
+        proc = subprocess.run([self.program, '--stdout', '-v', self.voice, text],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode:
+            raise TTSError(f"{self.program} return: {proc.returncode}: "
+                           f"{proc.stderr.decode(errors='replace').strip()}")
+
+        return decodeWav(proc.stdout, self.sampleRate)
+
+
+# Produces a quiet tone whose length depends on the length of the text,
+# so sessions can be built and timed without any speech engine
+class StubEngine:
+
+    name = 'stub'
+    defaultVoice = 'stub'
+
+    def __init__(self, voice=None, sampleRate=keyer.SAMPLE_RATE):
+        self.voice = voice or self.defaultVoice
+        self.sampleRate = sampleRate
+
+
+    def synthesize(self, text):
+        numSamples = int(self.sampleRate * (0.2 + 0.06 * len(text)))
+        t = np.arange(numSamples) / self.sampleRate
+
+        return (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def findEspeak():
+    return shutil.which('espeak-ng') or shutil.which('espeak')
+
+
+def getEngine(name, voice=None, sampleRate=keyer.SAMPLE_RATE):
+    if name == 'gtts':
+        return GTTSEngine(voice, sampleRate)
+    elif name == 'espeak':
+        return EspeakEngine(voice, sampleRate)
+    elif name == 'stub':
+        return StubEngine(voice, sampleRate)
+    else:
+        raise TTSError(f"unknown text to speech engine: {name}")
+
+
+class Speaker:
+
+    # 'cache' is a keyer.WaveformCache (normally with a cache directory
+    # so the speech is kept between sessions) and 'phoneticFunc'
+    # converts text to the phonetic text that is spoken when
+    # 'phonetic' is requested, 'spokenFunc' to the text that is spoken
+    # otherwise (e.g. prosigns as their letters).
+    def __init__(self, engine, cache, phoneticFunc=None, spokenFunc=None):
+        self.engine = engine
+        self.cache = cache
+        self.phoneticFunc = phoneticFunc
+        self.spokenFunc = spokenFunc
+
+
+    def speak(self, text, phonetic=False):
+        key = ('tts', self.engine.name, self.engine.voice, bool(phonetic), text,
+               self.engine.sampleRate)
+
+        if phonetic and self.phoneticFunc:
+            spokenText = self.phoneticFunc(text)
+        elif self.spokenFunc:
+            spokenText = self.spokenFunc(text)
+        else:
+            spokenText = text
+
+        return self.cache.get(key, lambda: self.engine.synthesize(spokenText),
+                              persist=True)